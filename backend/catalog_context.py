@@ -0,0 +1,173 @@
+"""
+Pre-rendered vehicle catalog text for AI prompts.
+
+recommend and chat embed the same catalog listing in every prompt. The lines are
+rendered once, kept per vehicle and patched when a vehicle is created, updated
+or deleted, so prompts are byte-stable between catalog changes (which keeps the
+LLM response cache and Gemini prompt caching effective). Each snapshot carries a
+BM25 index (catalog_search) so prompts embed only the vehicles relevant to the
+query instead of the first CATALOG_CONTEXT_LIMIT.
+"""
+import math
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Optional
+
+from catalog_search import BM25Index, vehicle_terms, CATALOG_RETRIEVAL_TOP_N
+
+logger = logging.getLogger(__name__)
+
+# Same cap the endpoints used before ("Limit context"); used when retrieval finds nothing
+CATALOG_CONTEXT_LIMIT = 50
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for Gemini tokenizers)"""
+    return math.ceil(len(text) / 4) if text else 0
+
+
+def fit_lines(lines: List[str], max_tokens: Optional[int]) -> str:
+    """Join lines in order, stopping before the estimated token budget is exceeded"""
+    if max_tokens is None:
+        return "\n".join(lines)
+    kept, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1  # + newline
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+def render_recommend_line(v: dict) -> str:
+    return f"- {v.get('brand')} {v.get('model')} ({v.get('year')}): {v.get('price')} TL, {v.get('engine', {}).get('fuel')}, {v.get('engine', {}).get('transmission')}"
+
+
+def render_chat_line(v: dict) -> str:
+    return f"- {v.get('brand')} {v.get('model')} (Slug: {v.get('slug')})"
+
+
+class CatalogSnapshot:
+    """Immutable rendering of the catalog at a given version"""
+
+    def __init__(self, version: int, recommend_lines: list, chat_lines: list, terms: list, limit: int = CATALOG_CONTEXT_LIMIT):
+        self.version = version
+        self.limit = limit
+        self.recommend_lines = recommend_lines
+        self.chat_lines = chat_lines
+        self.index = BM25Index(terms)
+        self.recommend_text = "\n".join(recommend_lines[:limit])
+        self.chat_text = "\n".join(chat_lines[:limit])
+        self.vehicle_count = len(chat_lines)
+        self.recommend_tokens = estimate_tokens(self.recommend_text)
+        self.chat_tokens = estimate_tokens(self.chat_text)
+
+    def select(self, query: str, top_n: int = CATALOG_RETRIEVAL_TOP_N) -> List[int]:
+        """Positions of the vehicles most relevant to query; the first `limit` if nothing matches"""
+        hits = self.index.search(query, top_n)
+        if not hits:
+            return list(range(min(self.limit, self.vehicle_count)))
+        return [position for position, _ in hits]
+
+    def recommend_text_for(self, query: str, top_n: int = CATALOG_RETRIEVAL_TOP_N, max_tokens: int = None) -> str:
+        """Best matches first, so trimming to max_tokens drops the least relevant vehicles"""
+        return fit_lines([self.recommend_lines[i] for i in self.select(query, top_n)], max_tokens)
+
+    def chat_text_for(self, query: str, top_n: int = CATALOG_RETRIEVAL_TOP_N, max_tokens: int = None) -> str:
+        return fit_lines([self.chat_lines[i] for i in self.select(query, top_n)], max_tokens)
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "vehicles": self.vehicle_count,
+            "recommendTokens": self.recommend_tokens,
+            "chatTokens": self.chat_tokens,
+            "retrievalTopN": CATALOG_RETRIEVAL_TOP_N,
+        }
+
+
+class CatalogContextService:
+    def __init__(self, limit: int = CATALOG_CONTEXT_LIMIT):
+        self.limit = limit
+        self.version = 0
+        self._lines = OrderedDict()  # vehicle id -> (recommend_line, chat_line, search_terms)
+        self._loaded = False
+        self._pending = set()
+        self._changes = 0
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._snapshot_changes = -1
+        self._lock = asyncio.Lock()
+
+    def invalidate(self, vehicle_id: str = None):
+        """Mark one vehicle (or, without an id, the whole catalog) as changed"""
+        if vehicle_id is None:
+            self._loaded = False
+            self._pending.clear()
+        else:
+            self._pending.add(vehicle_id)
+        self._changes += 1
+
+    def _is_current(self) -> bool:
+        return self._snapshot is not None and self._snapshot_changes == self._changes
+
+    async def get_snapshot(self, db) -> CatalogSnapshot:
+        if self._is_current():
+            return self._snapshot
+
+        async with self._lock:
+            if not self._is_current():
+                # Changes arriving while we rebuild bump _changes and trigger another pass
+                seen_changes = self._changes
+                if not self._loaded:
+                    await self._full_rebuild(db)
+                else:
+                    await self._apply_pending(db)
+                self.version += 1
+                self._snapshot = self._render()
+                self._snapshot_changes = seen_changes
+                logger.info(f"Catalog context rebuilt: {self._snapshot.stats()}")
+            return self._snapshot
+
+    async def _full_rebuild(self, db):
+        self._pending.clear()
+        self._loaded = True
+        vehicles = await db.vehicles.find({}).to_list(length=None)
+        self._lines = OrderedDict()
+        for v in vehicles:
+            self._lines[v.get("id")] = (render_recommend_line(v), render_chat_line(v), vehicle_terms(v))
+
+    async def _apply_pending(self, db):
+        changed = list(self._pending)
+        self._pending.clear()
+        if not changed:
+            return
+        vehicles = await db.vehicles.find({"id": {"$in": changed}}).to_list(length=len(changed))
+        found = {v.get("id"): v for v in vehicles}
+        for vehicle_id in changed:
+            v = found.get(vehicle_id)
+            if v is None:
+                self._lines.pop(vehicle_id, None)
+            else:
+                # Updates keep their position, new vehicles go to the end
+                self._lines[vehicle_id] = (render_recommend_line(v), render_chat_line(v), vehicle_terms(v))
+
+    def stats(self) -> dict:
+        stats = self._snapshot.stats() if self._snapshot else {"version": self.version}
+        stats["stale"] = not self._is_current()
+        return stats
+
+    def _render(self) -> CatalogSnapshot:
+        entries = list(self._lines.values())
+        return CatalogSnapshot(
+            self.version,
+            [recommend for recommend, _, _ in entries],
+            [chat for _, chat, _ in entries],
+            [terms for _, _, terms in entries],
+            self.limit,
+        )
+
+
+# Singleton instance
+catalog_context = CatalogContextService()
@@ -0,0 +1,107 @@
+"""
+Local BM25 retrieval over the vehicle catalog.
+
+Prompts used to carry the first 50 vehicles regardless of the question. The
+index scores every vehicle on brand, model, segment, strengths and bestFor, so
+recommend/chat only embed the few vehicles relevant to the user's query or
+garage, however large the catalog grows. Built by catalog_context once per
+catalog version.
+"""
+import os
+import re
+import math
+from collections import Counter
+from typing import List, Tuple
+
+CATALOG_RETRIEVAL_TOP_N = int(os.environ.get("CATALOG_RETRIEVAL_TOP_N", "15"))
+
+# Field weights: a brand/model hit matters more than a word in the strengths
+FIELD_WEIGHTS = {"brand": 3, "model": 3, "segment": 2, "strengths": 1, "bestFor": 1}
+
+# Turkish letters folded to ASCII so "SUV'lar", "şehir" and "sehir" meet
+_FOLD = str.maketrans("çğıöşüâîûÇĞIİÖŞÜ", "cgiosuaiucgiiosu")
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Agglutinative Turkish: the first 5 letters are a cheap, robust stem ("ekonomik"/"ekonomisi" -> "ekono")
+STEM_LENGTH = 5
+
+STOPWORDS = {
+    "ve", "veya", "ile", "icin", "bir", "bu", "su", "de", "da", "mi", "mu",
+    "cok", "en", "gibi", "ama", "ben", "bana", "benim", "olan", "olsun",
+    "araci", "araba", "oner", "istiyorum", "the", "and", "for", "with", "a", "an", "of",
+}
+
+
+def tokenize(text: str) -> List[str]:
+    if not text:
+        return []
+    tokens = _TOKEN_RE.findall(str(text).translate(_FOLD).lower())
+    return [t[:STEM_LENGTH] for t in tokens if t not in STOPWORDS]
+
+
+def _localized_values(value) -> List[str]:
+    """LocalizedText / LocalizedTextList dicts -> flat list of strings (every language)"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    if isinstance(value, dict):
+        values = []
+        for item in value.values():
+            values.extend(_localized_values(item))
+        return values
+    return []
+
+
+def vehicle_terms(v: dict) -> List[str]:
+    """Weighted bag of terms for one vehicle document"""
+    terms = []
+    for field, weight in FIELD_WEIGHTS.items():
+        field_tokens = []
+        for text in _localized_values(v.get(field)):
+            field_tokens.extend(tokenize(text))
+        terms.extend(field_tokens * weight)
+    return terms
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of documents (one per catalog entry)"""
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._term_freqs = [Counter(doc) for doc in documents]
+        self._lengths = [len(doc) for doc in documents]
+        self.size = len(documents)
+        self._avg_length = (sum(self._lengths) / self.size) if self.size else 0.0
+
+        doc_freqs = Counter()
+        for freqs in self._term_freqs:
+            doc_freqs.update(freqs.keys())
+        self._idf = {
+            term: math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            for term, df in doc_freqs.items()
+        }
+
+    def search(self, query: str, limit: int) -> List[Tuple[int, float]]:
+        """(document position, score) pairs, best first; only documents sharing a term"""
+        query_terms = [t for t in set(tokenize(query)) if t in self._idf]
+        if not query_terms or not self.size:
+            return []
+
+        scores = []
+        for position, freqs in enumerate(self._term_freqs):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[position] / (self._avg_length or 1))
+            for term in query_terms:
+                tf = freqs.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            if score > 0:
+                scores.append((position, score))
+
+        # Ties keep catalog order so prompts stay byte-stable
+        scores.sort(key=lambda item: (-item[1], item[0]))
+        return scores[:limit]
@@ -0,0 +1,115 @@
+"""
+Comments on garage vehicles (db.garage_comments).
+
+Comments used to be an unbounded `comments` array on the garage document, so
+every explore or detail response carried (and validated) the full history and
+documents grew without limit. Each comment is now its own document
+{id, vehicleId, userId, userName, content, createdAt}. The garage document
+keeps a commentCount maintained with $inc, and its `comments` array only
+holds the latest COMMENTS_INLINE comments (oldest first, as before) for the
+card/detail preview. Older ones are read a page at a time with
+list_comments.
+
+Documents written before this still carry the full array (and no
+commentCount); they are moved over when their comments are next written or
+listed, or all at once with migrate_comments.py. Until then the vehicle
+responses fall back to the array.
+"""
+import os
+from typing import List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from pagination import decode_cursor, after_query, keyset_sort, split_page
+
+COMMENTS_INLINE = int(os.environ.get("GARAGE_COMMENTS_INLINE", "3"))
+COMMENT_PAGE_MAX = 50
+
+COMMENT_FIELDS = {"_id": 0, "id": 1, "userId": 1, "userName": 1, "content": 1, "createdAt": 1}
+
+
+def comment_count(vehicle: dict) -> int:
+    if "commentCount" in vehicle:
+        return vehicle["commentCount"]
+    return len(vehicle.get("comments") or [])
+
+
+def inline_comments(vehicle: dict) -> List[dict]:
+    """The latest comments shown with the vehicle, oldest first"""
+    return (vehicle.get("comments") or [])[-COMMENTS_INLINE:]
+
+
+async def latest_comments(db: AsyncIOMotorDatabase, vehicle_id: str) -> List[dict]:
+    latest = await db.garage_comments.find(
+        {"vehicleId": vehicle_id}, COMMENT_FIELDS
+    ).sort(keyset_sort("createdAt")).limit(COMMENTS_INLINE).to_list(length=COMMENTS_INLINE)
+    return latest[::-1]
+
+
+async def migrate_document(db: AsyncIOMotorDatabase, vehicle: dict) -> int:
+    """
+    Move a legacy comments array into db.garage_comments and set commentCount;
+    returns the count. Safe to run concurrently or repeatedly: comments are
+    upserted by id, and the vehicle is only rewritten while it has no
+    commentCount, so a comment added meanwhile ($inc/$push) is never overwritten.
+    """
+    comments = vehicle.get("comments") or []
+    for comment in comments:
+        await db.garage_comments.update_one(
+            {"id": comment["id"], "vehicleId": vehicle["id"]},
+            {"$setOnInsert": {k: v for k, v in comment.items() if k != "id"}},
+            upsert=True
+        )
+    await db.garage.update_one(
+        {"id": vehicle["id"], "commentCount": {"$exists": False}},
+        {"$set": {"comments": comments[-COMMENTS_INLINE:], "commentCount": len(comments)}}
+    )
+    return len(comments)
+
+
+async def add_comment(db: AsyncIOMotorDatabase, vehicle: dict, comment: dict):
+    """Store a comment and update the vehicle's count and inline preview"""
+    if "commentCount" not in vehicle:
+        await migrate_document(db, vehicle)
+    await db.garage_comments.insert_one({**comment, "vehicleId": vehicle["id"]})
+    await db.garage.update_one(
+        {"id": vehicle["id"]},
+        {
+            "$inc": {"commentCount": 1},
+            "$push": {"comments": {"$each": [comment], "$slice": -COMMENTS_INLINE}},
+        }
+    )
+
+
+async def find_comment(db: AsyncIOMotorDatabase, vehicle: dict, comment_id: str) -> Optional[dict]:
+    if "commentCount" not in vehicle:
+        await migrate_document(db, vehicle)
+    return await db.garage_comments.find_one({"id": comment_id, "vehicleId": vehicle["id"]}, {"_id": 0})
+
+
+async def delete_comment(db: AsyncIOMotorDatabase, vehicle_id: str, comment_id: str):
+    """Remove a comment; the inline preview is refilled when it showed the comment"""
+    result = await db.garage_comments.delete_one({"id": comment_id, "vehicleId": vehicle_id})
+    if not result.deleted_count:
+        return
+    update = {"$inc": {"commentCount": -1}}
+    vehicle = await db.garage.find_one({"id": vehicle_id}, {"_id": 0, "comments": 1})
+    if vehicle and any(c["id"] == comment_id for c in vehicle.get("comments") or []):
+        update["$set"] = {"comments": await latest_comments(db, vehicle_id)}
+    await db.garage.update_one({"id": vehicle_id}, update)
+
+
+async def list_comments(db: AsyncIOMotorDatabase, vehicle: dict, limit: int = 20, after: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+    """A page of a vehicle's comments, newest first; returns (comments, next cursor)"""
+    if "commentCount" not in vehicle:
+        await migrate_document(db, vehicle)
+    query = after_query({"vehicleId": vehicle["id"]}, "createdAt", decode_cursor(after))
+    comments = await db.garage_comments.find(
+        query, COMMENT_FIELDS
+    ).sort(keyset_sort("createdAt")).limit(limit + 1).to_list(length=limit + 1)
+    return split_page(comments, limit, "createdAt")
+
+
+async def delete_vehicle_comments(db: AsyncIOMotorDatabase, vehicle_id: str):
+    """Drop the comments of a deleted garage vehicle"""
+    await db.garage_comments.delete_many({"vehicleId": vehicle_id})
@@ -0,0 +1,162 @@
+"""
+Per-endpoint latency budgets and hedged requests for Gemini calls.
+
+Every AI endpoint starts a Deadline from AI_LATENCY_BUDGETS. The remaining time
+bounds the Gemini HTTP timeout and the wait for the answer, and the endpoint's
+fallback (heuristic/static) runs inside what is left, so the worst case for a
+request is its budget instead of the 30 s client timeout.
+
+Hedging: for idempotent calls, once the endpoint's observed p95 latency has
+elapsed without an answer a second identical request is sent and the first
+successful response wins; the slower one is cancelled.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Seconds per endpoint, end to end (Gemini call(s) + fallback)
+AI_LATENCY_BUDGETS = {
+    "recommend": 15.0,
+    "chat": 45.0,
+    "summary": 15.0,
+    "snap": 12.0,
+    "snap-rate": 8.0,
+    "wizard": 20.0,
+    "compare": 25.0,
+}
+DEFAULT_LATENCY_BUDGET = 30.0
+
+HEDGING_ENABLED = os.environ.get("GEMINI_HEDGING", "1") != "0"
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.5
+
+# Local fallbacks (DB sampling, static answers) always get at least this long
+FALLBACK_FLOOR = 1.0
+
+
+class Deadline:
+    def __init__(self, seconds: float, name: str = ""):
+        self.name = name
+        self.budget = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def for_endpoint(cls, name: str) -> "Deadline":
+        return cls(AI_LATENCY_BUDGETS.get(name, DEFAULT_LATENCY_BUDGET), name)
+
+    @classmethod
+    def for_job(cls, name: str, timeout: float) -> "Deadline":
+        """Background job run: nobody waits on the request, so the budget is the job timeout (less the fallback floor)"""
+        return cls(max(timeout - FALLBACK_FLOOR, FALLBACK_FLOOR), name)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def httpx_timeout(self) -> httpx.Timeout:
+        """Client timeout that cannot outlive the deadline"""
+        left = max(self.remaining(), 0.01)
+        return httpx.Timeout(connect=min(5.0, left), read=left, write=min(10.0, left), pool=min(5.0, left))
+
+    async def run(self, awaitable, floor: float = 0.0):
+        """Await within the remaining budget, but at least `floor` seconds (asyncio.TimeoutError when it runs out)"""
+        return await asyncio.wait_for(awaitable, timeout=max(self.remaining(), floor))
+
+
+class LatencyTracker:
+    """Recent successful upstream latencies per endpoint, for the hedge delay"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples = {}  # endpoint -> deque of seconds
+
+    def record(self, endpoint: str, seconds: float):
+        self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, endpoint: str, q: float) -> Optional[float]:
+        samples = self._samples.get(endpoint)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def stats(self) -> dict:
+        return {
+            endpoint: {
+                "samples": len(samples),
+                "p50": self.percentile(endpoint, 0.50),
+                "p95": self.percentile(endpoint, 0.95),
+            }
+            for endpoint, samples in self._samples.items()
+        }
+
+
+class Hedger:
+    def __init__(self, tracker: LatencyTracker):
+        self.tracker = tracker
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    def hedge_delay(self, endpoint: str, deadline: Optional[Deadline]) -> Optional[float]:
+        """Seconds to wait before hedging, or None when hedging does not apply"""
+        if not HEDGING_ENABLED or not endpoint:
+            return None
+        p95 = self.tracker.percentile(endpoint, 0.95)
+        if p95 is None:
+            return None
+        delay = max(p95, HEDGE_MIN_DELAY)
+        if deadline and deadline.remaining() <= delay:
+            return None
+        return delay
+
+    async def run(self, endpoint: Optional[str], fn, deadline: Optional[Deadline] = None, hedge: bool = False):
+        """Call fn() and record its latency; with hedge=True, race a second fn() once the endpoint's p95 has passed"""
+        started = time.monotonic()
+        delay = self.hedge_delay(endpoint, deadline) if hedge else None
+        if delay is None:
+            result = await fn()
+            if endpoint:
+                self.tracker.record(endpoint, time.monotonic() - started)
+            return result
+
+        primary = asyncio.ensure_future(fn())
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedges_sent += 1
+                logger.info(f"Hedging '{endpoint}' after {delay:.2f}s")
+                tasks.add(asyncio.ensure_future(fn()))
+
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedges_won += 1
+                        self.tracker.record(endpoint, time.monotonic() - started)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {"enabled": HEDGING_ENABLED, "sent": self.hedges_sent, "won": self.hedges_won, "latency": self.tracker.stats()}
+
+
+# Singleton instances
+latency_tracker = LatencyTracker()
+hedger = Hedger(latency_tracker)
@@ -4,18 +4,23 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Optional
 from auth import decode_token
 from database import get_database
+from loaders import RequestLoaders
 
 async def get_db() -> AsyncIOMotorDatabase:
     """Get database connection"""
     return get_database()
 
 
+async def get_loaders(db: AsyncIOMotorDatabase = Depends(get_db)) -> RequestLoaders:
+    """Batching/memoizing lookups, one set per request"""
+    return RequestLoaders(db)
+
+
 security = HTTPBearer(auto_error=False)
 
 
 async def get_current_user(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
-    db: AsyncIOMotorDatabase = None
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ) -> Optional[dict]:
     """Get current user from JWT token - returns None if not authenticated"""
     if not credentials:
@@ -0,0 +1,124 @@
+"""
+Follow graph (db.garage_follows) with maintained follower/following counts.
+
+Each follow is one edge document {id, followerId, followingId, createdAt},
+unique per pair. The (followerId, createdAt, id) and (followingId, createdAt,
+id) indexes are the forward (following) and reverse (followers) adjacency
+lists, read a page at a time with keyset cursors instead of the old capped
+find plus count_documents scan.
+
+The users document keeps followerCount / followingCount. follow creates the
+edge with a single upsert and unfollow with a delete, and the counters only
+move ($inc) when an edge was really created or removed, so both are
+idempotent. Users without counters yet get them counted once, before their
+first change or read; rebuild_follow_counts.py recomputes them all.
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+from models import GarageFollow
+from pagination import decode_cursor, after_query, keyset_sort, split_page
+
+FOLLOW_PAGE_MAX = 100
+
+# (field matching the user, field holding the neighbor)
+FOLLOWERS = ("followingId", "followerId")
+FOLLOWING = ("followerId", "followingId")
+
+COUNT_FIELDS = {"_id": 0, "id": 1, "followerCount": 1, "followingCount": 1}
+
+
+async def count_follows(db: AsyncIOMotorDatabase, user_id: str) -> dict:
+    """followerCount / followingCount counted from the edges"""
+    return {
+        "followerCount": await db.garage_follows.count_documents({"followingId": user_id}),
+        "followingCount": await db.garage_follows.count_documents({"followerId": user_id}),
+    }
+
+
+async def ensure_counts(db: AsyncIOMotorDatabase, user_ids: Iterable[str]) -> Dict[str, dict]:
+    """
+    id -> counters for existing users, counting (once) those that have none yet.
+    A counter is only set while it is still missing, so a concurrent first
+    count or $inc is never overwritten.
+    """
+    ids = list(dict.fromkeys(user_ids))
+    users = await db.users.find({"id": {"$in": ids}}, COUNT_FIELDS).to_list(length=len(ids))
+    counts = {}
+    for user in users:
+        if "followerCount" not in user or "followingCount" not in user:
+            for field, value in (await count_follows(db, user["id"])).items():
+                await db.users.update_one({"id": user["id"], field: {"$exists": False}}, {"$set": {field: value}})
+            user = await db.users.find_one({"id": user["id"]}, COUNT_FIELDS)
+        counts[user["id"]] = {"followerCount": user["followerCount"], "followingCount": user["followingCount"]}
+    return counts
+
+
+async def _change_counts(db: AsyncIOMotorDatabase, follower_id: str, followee_id: str, delta: int):
+    await db.users.update_one({"id": follower_id}, {"$inc": {"followingCount": delta}})
+    await db.users.update_one({"id": followee_id}, {"$inc": {"followerCount": delta}})
+
+
+async def follow(db: AsyncIOMotorDatabase, follower_id: str, followee_id: str) -> bool:
+    """Create the edge unless it exists; True when it was new"""
+    await ensure_counts(db, [follower_id, followee_id])
+    edge = GarageFollow(followerId=follower_id, followingId=followee_id).model_dump()
+    try:
+        result = await db.garage_follows.update_one(
+            {"followerId": follower_id, "followingId": followee_id},
+            {"$setOnInsert": {"id": edge["id"], "createdAt": edge["createdAt"]}},
+            upsert=True
+        )
+    except DuplicateKeyError:  # a concurrent follow created it
+        return False
+    if result.upserted_id is None:
+        return False
+    await _change_counts(db, follower_id, followee_id, 1)
+    return True
+
+
+async def unfollow(db: AsyncIOMotorDatabase, follower_id: str, followee_id: str) -> bool:
+    """Remove the edge if it exists; True when it did"""
+    await ensure_counts(db, [follower_id, followee_id])
+    result = await db.garage_follows.delete_one({"followerId": follower_id, "followingId": followee_id})
+    if not result.deleted_count:
+        return False
+    await _change_counts(db, follower_id, followee_id, -1)
+    return True
+
+
+async def is_following(db: AsyncIOMotorDatabase, follower_id: str, followee_id: str) -> bool:
+    edge = await db.garage_follows.find_one({"followerId": follower_id, "followingId": followee_id}, {"_id": 0, "id": 1})
+    return edge is not None
+
+
+async def list_neighbors(db: AsyncIOMotorDatabase, user_id: str, side: Tuple[str, str], limit: int = 20, after: Optional[str] = None) -> Tuple[List[str], Optional[str]]:
+    """A page of follower (FOLLOWERS) or followee (FOLLOWING) ids, newest first; returns (ids, next cursor)"""
+    match_field, neighbor_field = side
+    query = after_query({match_field: user_id}, "createdAt", decode_cursor(after))
+    edges = await db.garage_follows.find(
+        query, {"_id": 0, "id": 1, "createdAt": 1, neighbor_field: 1}
+    ).sort(keyset_sort("createdAt")).limit(limit + 1).to_list(length=limit + 1)
+    page, next_cursor = split_page(edges, limit, "createdAt")
+    return [edge[neighbor_field] for edge in page], next_cursor
+
+
+async def rebuild_follow_counts(db: AsyncIOMotorDatabase) -> Tuple[int, int]:
+    """Drop duplicate edges and recount every user's counters; returns (users, duplicates removed)"""
+    seen = set()
+    duplicates = []
+    async for edge in db.garage_follows.find({}, {"_id": 1, "followerId": 1, "followingId": 1}).sort(keyset_sort("createdAt", 1)):
+        pair = (edge["followerId"], edge["followingId"])
+        if pair in seen:
+            duplicates.append(edge["_id"])
+        seen.add(pair)
+    for _id in duplicates:
+        await db.garage_follows.delete_one({"_id": _id})
+
+    users = 0
+    async for user in db.users.find({}, {"_id": 0, "id": 1}):
+        await db.users.update_one({"id": user["id"]}, {"$set": await count_follows(db, user["id"])})
+        users += 1
+    return users, len(duplicates)
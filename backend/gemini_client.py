@@ -0,0 +1,265 @@
+"""
+Shared HTTP client for Gemini REST calls.
+
+A single pooled httpx.AsyncClient is opened in the server lifespan and reused by
+every AI endpoint, so chat/snap/wizard/summary calls share keep-alive
+connections instead of paying a TLS handshake per request.
+Set GEMINI_API_BASE to point the backend at a local stub (see
+scripts/gemini_stub_server.py).
+"""
+import os
+import json
+import time
+import base64
+import asyncio
+import hashlib
+import logging
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+GEMINI_API_BASE = os.environ.get("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+
+# Connect fails fast, read stays generous for long generations
+GEMINI_TIMEOUT = httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=5.0)
+GEMINI_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0)
+
+# Gemini context caching (cachedContents) for large static system instructions
+GEMINI_CONTEXT_CACHE = os.environ.get("GEMINI_CONTEXT_CACHE", "1") != "0"
+GEMINI_CONTEXT_CACHE_TTL = int(os.environ.get("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+# cachedContents rejects smaller prompts (1024 tokens on 2.5 Flash)
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+
+
+def _http2_available() -> bool:
+    """HTTP/2 needs the optional 'h2' package (pip install httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class GeminiHttpClient:
+    client: httpx.AsyncClient = None
+
+    def connect(self):
+        if not self.client:
+            http2 = _http2_available()
+            self.client = httpx.AsyncClient(
+                http2=http2,
+                timeout=GEMINI_TIMEOUT,
+                limits=GEMINI_LIMITS,
+                headers={"Content-Type": "application/json"},
+            )
+            logger.info(f"Gemini HTTP client ready (http2={http2}, base={GEMINI_API_BASE})")
+
+    async def close(self):
+        if self.client:
+            logger.info("Closing Gemini HTTP client...")
+            await self.client.aclose()
+            self.client = None
+
+    def get_client(self) -> httpx.AsyncClient:
+        if not self.client:
+            self.connect()
+        return self.client
+
+
+# Singleton instance
+gemini_http = GeminiHttpClient()
+
+
+def get_gemini_client() -> httpx.AsyncClient:
+    return gemini_http.get_client()
+
+
+def gemini_url(path: str) -> str:
+    """Build a v1beta URL, e.g. gemini_url('models/gemini-2.5-flash:generateContent')"""
+    return f"{GEMINI_API_BASE}/v1beta/{path}"
+
+
+class Base64Blob:
+    """
+    Binary payload (e.g. a snap photo) that is base64-encoded only while the
+    request body is being sent, instead of being held as a second, 4/3-size
+    string copy inside the JSON payload.
+    """
+
+    CHUNK_SIZE = 48 * 1024  # multiple of 3, so chunk encodings concatenate cleanly
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()
+
+    @property
+    def cache_token(self) -> str:
+        """Stands in for the bytes in LLM cache / single-flight keys"""
+        return f"blob:{self.digest}"
+
+    @property
+    def encoded_length(self) -> int:
+        return 4 * ((len(self.data) + 2) // 3)
+
+    def iter_base64(self):
+        view = memoryview(self.data)
+        for start in range(0, len(view), self.CHUNK_SIZE):
+            yield base64.b64encode(view[start:start + self.CHUNK_SIZE])
+
+
+def _split_blobs(payload: dict):
+    """JSON-encode payload with each Base64Blob replaced by a marker; returns (json_text, blobs)"""
+    blobs = []
+
+    def default(value):
+        if isinstance(value, Base64Blob):
+            blobs.append(value)
+            return f"\u0000blob{len(blobs) - 1}\u0000"
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    return json.dumps(payload, default=default, ensure_ascii=False), blobs
+
+
+def request_body(payload: dict) -> dict:
+    """
+    httpx keyword arguments for a Gemini request body. Payloads without blobs go
+    as json=; payloads with blobs are streamed piece by piece with an exact
+    Content-Length, base64-encoding the blobs on the fly.
+    """
+    text, blobs = _split_blobs(payload)
+    if not blobs:
+        return {"json": payload}
+
+    pieces = []
+    for i, blob in enumerate(blobs):
+        # json.dumps escapes the NUL markers, so match the escaped form
+        marker = f"\\u0000blob{i}\\u0000"
+        before, text = text.split(marker, 1)
+        pieces.append(before.encode("utf-8"))
+        pieces.append(blob)
+    pieces.append(text.encode("utf-8"))
+
+    length = sum(p.encoded_length if isinstance(p, Base64Blob) else len(p) for p in pieces)
+
+    async def stream():
+        for piece in pieces:
+            if isinstance(piece, Base64Blob):
+                for chunk in piece.iter_base64():
+                    yield chunk
+            else:
+                yield piece
+
+    return {"content": stream(), "headers": {"Content-Length": str(length), "Content-Type": "application/json"}}
+
+
+class GeminiContextCache:
+    """
+    Keeps one Gemini cachedContents entry per prompt slot.
+    The cached context is created once per distinct system instruction - so once
+    per catalog version - referenced by name on every call and re-created shortly
+    before it expires. Instructions estimated below min_tokens are always sent
+    inline without asking the API; when creation is rejected anyway the slot
+    falls back to inline instructions for a while.
+    """
+
+    REFRESH_MARGIN = 60  # seconds before expiry we stop handing out a name
+    FAILURE_COOLDOWN = 600
+
+    def __init__(self, ttl_seconds: int = GEMINI_CONTEXT_CACHE_TTL, enabled: bool = GEMINI_CONTEXT_CACHE, min_tokens: int = GEMINI_CONTEXT_CACHE_MIN_TOKENS):
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self.min_tokens = min_tokens
+        self._slots = {}  # slot -> {"digest", "name", "expires_at"}
+        self._failures = {}  # digest -> retry_after
+        self._locks = {}
+        self.hits = 0
+        self.creates = 0
+        self.failures = 0
+        self.too_small = 0
+
+    @staticmethod
+    def _digest(model: str, system_instruction: str) -> str:
+        return hashlib.sha256(f"{model}\n{system_instruction}".encode("utf-8")).hexdigest()
+
+    async def get_name(self, slot: str, model: str, system_instruction: str, api_key: str) -> Optional[str]:
+        if not self.enabled or not system_instruction:
+            return None
+        if len(system_instruction) / 4 < self.min_tokens:  # ~4 characters per token
+            self.too_small += 1
+            return None
+
+        digest = self._digest(model, system_instruction)
+        entry = self._slots.get(slot)
+        if entry and entry["digest"] == digest and entry["expires_at"] - self.REFRESH_MARGIN > time.time():
+            self.hits += 1
+            return entry["name"]
+        if self._failures.get(digest, 0) > time.time():
+            return None
+
+        lock = self._locks.setdefault(slot, asyncio.Lock())
+        async with lock:
+            entry = self._slots.get(slot)
+            if entry and entry["digest"] == digest and entry["expires_at"] - self.REFRESH_MARGIN > time.time():
+                self.hits += 1
+                return entry["name"]
+
+            name = await self._create(model, system_instruction, api_key, slot)
+            if not name:
+                self._failures[digest] = time.time() + self.FAILURE_COOLDOWN
+                return None
+
+            if entry and entry["name"] != name:
+                # Previous catalog version is no longer referenced
+                asyncio.ensure_future(self._delete(entry["name"], api_key))
+            self._slots[slot] = {"digest": digest, "name": name, "expires_at": time.time() + self.ttl_seconds}
+            return name
+
+    def invalidate(self, slot: str):
+        """Forget a slot whose cached context the API no longer accepts"""
+        self._slots.pop(slot, None)
+
+    async def _create(self, model: str, system_instruction: str, api_key: str, slot: str) -> Optional[str]:
+        payload = {
+            "model": model,
+            "displayName": f"otorite-{slot}",
+            "systemInstruction": {"parts": [{"text": system_instruction}]},
+            "ttl": f"{self.ttl_seconds}s",
+        }
+        try:
+            response = await get_gemini_client().post(gemini_url(f"cachedContents?key={api_key}"), json=payload)
+        except httpx.HTTPError as e:
+            logger.warning(f"Context cache create failed for '{slot}': {e}")
+            self.failures += 1
+            return None
+
+        if response.status_code != 200:
+            logger.info(f"Context cache not created for '{slot}' ({response.status_code}): {response.text[:200]}")
+            self.failures += 1
+            return None
+
+        self.creates += 1
+        name = response.json().get("name")
+        logger.info(f"Context cache created for '{slot}': {name}")
+        return name
+
+    async def _delete(self, name: str, api_key: str):
+        try:
+            await get_gemini_client().delete(gemini_url(f"{name}?key={api_key}"))
+        except httpx.HTTPError as e:
+            logger.info(f"Context cache delete failed for {name}: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "slots": {slot: entry["name"] for slot, entry in self._slots.items()},
+            "hits": self.hits,
+            "creates": self.creates,
+            "failures": self.failures,
+            "tooSmall": self.too_small,
+        }
+
+
+# Singleton instance
+gemini_context_cache = GeminiContextCache()
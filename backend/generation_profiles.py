@@ -0,0 +1,119 @@
+"""
+Per-endpoint Gemini generation profiles.
+
+Every call used to send maxOutputTokens 8192 and free-form text, even /ai/snap
+which needs ~50 tokens of JSON. Each profile sets the output cap and
+temperature for its endpoint; structured endpoints also ask for
+responseMimeType application/json with a responseSchema, so the answer is
+parseable JSON without fence/brace repair. Thinking is switched off for the
+small structured profiles so it cannot eat their output budget.
+
+CONTEXT_TOKEN_BUDGETS caps how much catalog text a prompt may embed
+(estimated with catalog_context.estimate_tokens).
+"""
+import copy
+
+_BASE = {"topP": 0.8, "topK": 40}
+_NO_THINKING = {"thinkingConfig": {"thinkingBudget": 0}}
+
+
+def _string(nullable: bool = False) -> dict:
+    schema = {"type": "STRING"}
+    if nullable:
+        schema["nullable"] = True
+    return schema
+
+
+def _object(properties: dict, required: list = None) -> dict:
+    return {"type": "OBJECT", "properties": properties, "required": required or list(properties.keys())}
+
+
+SCORE = {"type": "NUMBER"}
+
+RECOMMEND_SCHEMA = _object({
+    "recommendations": {"type": "ARRAY", "items": _object({
+        "brand": _string(),
+        "model": _string(),
+        "year": {"type": "INTEGER"},
+        "reason": _string(),
+    })},
+    "general_advice": _string(),
+})
+
+SUMMARY_SCHEMA = _object({
+    "summary": _string(),
+    "highlight": _string(),
+})
+
+SNAP_SCHEMA = _object({
+    "brand": _string(),
+    "model": _string(),
+    "generation": _string(nullable=True),
+    "bodyType": _string(),
+    "confidence": {"type": "INTEGER"},
+}, required=["brand", "model", "bodyType", "confidence"])
+
+SNAP_RATE_SCHEMA = _object({
+    "reliability": SCORE,
+    "performance": SCORE,
+    "maintenance": SCORE,
+    "fuelEconomy": SCORE,
+    "userSatisfaction": SCORE,
+    "overallScore": SCORE,
+    "explanation": _string(),
+})
+
+WIZARD_SCHEMA = _object({
+    "aiSummary": _string(),
+    "recommendations": {"type": "ARRAY", "items": _object({
+        "brand": _string(),
+        "model": _string(),
+        "year": {"type": "INTEGER"},
+        "price_range": _string(),
+        "reason": _string(),
+        "pros": {"type": "ARRAY", "items": _string()},
+        "cons": {"type": "ARRAY", "items": _string()},
+        "specs": _object({
+            "engine": _string(),
+            "power": _string(),
+            "fuel": _string(),
+        }),
+        "isTopPick": {"type": "BOOLEAN"},
+    })},
+})
+
+
+def _json_profile(temperature: float, max_tokens: int, schema: dict) -> dict:
+    return {
+        **_BASE,
+        **_NO_THINKING,
+        "temperature": temperature,
+        "maxOutputTokens": max_tokens,
+        "responseMimeType": "application/json",
+        "responseSchema": schema,
+    }
+
+
+GENERATION_PROFILES = {
+    # Long free-form answers (chat keeps its multi-pass completion)
+    "default": {**_BASE, "temperature": 0.4, "maxOutputTokens": 8192},
+    "chat": {**_BASE, "temperature": 0.4, "maxOutputTokens": 8192},
+    "compare": {**_BASE, "temperature": 0.5, "maxOutputTokens": 2048},
+    # Structured JSON answers
+    "recommend": _json_profile(0.3, 1024, RECOMMEND_SCHEMA),
+    "summary": _json_profile(0.7, 512, SUMMARY_SCHEMA),
+    "snap": _json_profile(0.1, 256, SNAP_SCHEMA),
+    "snap-rate": _json_profile(0.2, 512, SNAP_RATE_SCHEMA),
+    "wizard": _json_profile(0.4, 2048, WIZARD_SCHEMA),
+}
+
+# Max estimated tokens of catalog listing embedded per prompt
+CONTEXT_TOKEN_BUDGETS = {
+    "recommend": 1500,
+    "chat": 1000,
+}
+
+
+def get_generation_config(profile: str = "default") -> dict:
+    """generationConfig for a profile (a copy, callers may tweak it)"""
+    return copy.deepcopy(GENERATION_PROFILES.get(profile, GENERATION_PROFILES["default"]))
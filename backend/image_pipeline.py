@@ -0,0 +1,154 @@
+"""
+Preprocessing for images sent to Gemini vision (/ai/snap).
+
+Phone photos arrive as multi-megabyte, full-resolution files, and were sent
+base64-encoded as-is and always labelled image/jpeg. prepare_image sniffs the
+real type from the magic bytes, applies the EXIF rotation, downsizes to
+SNAP_MAX_EDGE, re-encodes as JPEG at SNAP_JPEG_QUALITY and drops all metadata
+(EXIF/GPS). While the image is decoded anyway it also computes a 64-bit dHash
+for the near-duplicate cache (phash_cache). Pillow work is CPU-bound, so it
+runs in the default thread pool.
+"""
+import io
+import os
+import asyncio
+import logging
+from typing import Optional
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:  # Pillow missing: images are passed through untouched
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+SNAP_MAX_EDGE = int(os.environ.get("SNAP_MAX_EDGE", "1024"))
+SNAP_JPEG_QUALITY = int(os.environ.get("SNAP_JPEG_QUALITY", "82"))
+
+# Types Gemini accepts as inline image data
+GEMINI_IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/heic", "image/heif"}
+
+
+def sniff_image_mime(data: bytes) -> Optional[str]:
+    """MIME type from the file signature (the upload's Content-Type is not trusted)"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        brand = data[8:12]
+        if brand in (b"heic", b"heix", b"hevc", b"hevx"):
+            return "image/heic"
+        if brand in (b"mif1", b"msf1", b"heif"):
+            return "image/heif"
+    if data.startswith(b"BM"):
+        return "image/bmp"
+    return None
+
+
+def dhash(img, hash_size: int = 8) -> int:
+    """Difference hash: one bit per horizontally adjacent pixel pair of a (hash_size+1) x hash_size grayscale thumbnail"""
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class PreparedImage:
+    def __init__(self, data: bytes, mime_type: str, original_bytes: int, width: int = None, height: int = None, source_mime: str = None, phash: int = None):
+        self.data = data
+        self.mime_type = mime_type
+        self.original_bytes = original_bytes
+        self.width = width
+        self.height = height
+        self.source_mime = source_mime or mime_type
+        self.phash = phash  # None when the image could not be decoded
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+
+def preprocess_image(data: bytes, max_edge: int = SNAP_MAX_EDGE, quality: int = SNAP_JPEG_QUALITY) -> PreparedImage:
+    """Blocking: decode, orient, downsize and re-encode as metadata-free JPEG"""
+    source_mime = sniff_image_mime(data)
+    if source_mime is None:
+        raise ValueError("Desteklenmeyen veya bozuk görsel dosyası.")
+
+    if Image is None:
+        if source_mime not in GEMINI_IMAGE_TYPES:
+            raise ValueError("Desteklenmeyen görsel formatı.")
+        return PreparedImage(data, source_mime, len(data))
+
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            has_metadata = bool(img.info.get("exif") or img.getexif())
+            original_size = img.size
+            img = ImageOps.exif_transpose(img)  # keep orientation before EXIF is dropped
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            phash = dhash(img)
+            out = io.BytesIO()
+            # A fresh save without exif=/icc_profile= writes no metadata
+            img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+            encoded = out.getvalue()
+
+        # Small, metadata-free originals (e.g. a flat PNG) can beat the re-encode
+        if (len(encoded) >= len(data) and not has_metadata and img.size == original_size
+                and source_mime in GEMINI_IMAGE_TYPES):
+            return PreparedImage(data, source_mime, len(data), img.width, img.height, source_mime, phash)
+        return PreparedImage(encoded, "image/jpeg", len(data), img.width, img.height, source_mime, phash)
+    except Image.DecompressionBombError as e:
+        # Pixel count past Pillow's MAX_IMAGE_PIXELS guard; never sent on as-is either
+        raise ValueError("Görsel çözünürlüğü çok yüksek.") from e
+    except (UnidentifiedImageError, OSError) as e:
+        # e.g. HEIC without a Pillow plugin: Gemini can still read it as-is
+        if source_mime in GEMINI_IMAGE_TYPES:
+            logger.info(f"Image passed through undecoded ({source_mime}): {e}")
+            return PreparedImage(data, source_mime, len(data))
+        raise ValueError("Görsel işlenemedi.") from e
+
+
+class ImagePipelineStats:
+    def __init__(self):
+        self.images = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+
+    def record(self, image: PreparedImage):
+        self.images += 1
+        self.original_bytes += image.original_bytes
+        self.sent_bytes += len(image.data)
+
+    def stats(self) -> dict:
+        return {
+            "images": self.images,
+            "originalBytes": self.original_bytes,
+            "sentBytes": self.sent_bytes,
+            "bytesSaved": self.original_bytes - self.sent_bytes,
+        }
+
+
+# Singleton instance
+image_pipeline_stats = ImagePipelineStats()
+
+
+async def prepare_image(data: bytes) -> PreparedImage:
+    """preprocess_image off the event loop; logs the bytes saved"""
+    loop = asyncio.get_event_loop()
+    image = await loop.run_in_executor(None, preprocess_image, data)
+    image_pipeline_stats.record(image)
+    logger.info(
+        f"Snap image {image.source_mime} {image.original_bytes} B -> {image.mime_type} {len(image.data)} B "
+        f"({image.width}x{image.height}, saved {image.bytes_saved} B)"
+    )
+    return image
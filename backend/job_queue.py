@@ -0,0 +1,246 @@
+"""
+In-process background queue for slow AI generations.
+
+/ai/generate-summary, /ai/compare-analyst and /ai/wizard used to hold the HTTP
+request open for the whole Gemini call. With ?background=true they submit a
+job instead and answer 202 with its id right away; the client polls
+GET /ai/jobs/{id} or follows GET /ai/jobs/{id}/stream (SSE) for the result.
+
+Jobs run on AI_JOB_WORKERS worker tasks started in the app lifespan, taken from
+a bounded priority queue (lower number first, FIFO within a priority). Job state
+is kept in db.ai_jobs, so it survives the request and can be polled from any
+worker process; a stream served by another process than the one running the
+job picks up its changes by re-reading the document on every heartbeat.
+
+On start, queued jobs and jobs "running" for longer than AI_JOB_TIMEOUT (their
+process died) are queued again. A worker claims a job with a conditional
+update from queued to running, so a job is only ever run by one worker, even
+when several processes recover the same jobs.
+"""
+import os
+import uuid
+import asyncio
+import logging
+import itertools
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+AI_JOB_WORKERS = int(os.environ.get("AI_JOB_WORKERS", "2"))
+AI_JOB_QUEUE_MAX = int(os.environ.get("AI_JOB_QUEUE_MAX", "200"))
+AI_JOB_TIMEOUT = float(os.environ.get("AI_JOB_TIMEOUT", "120"))
+AI_JOB_TTL_SECONDS = int(os.environ.get("AI_JOB_TTL_SECONDS", str(24 * 3600)))  # finished jobs are removed by a TTL index
+
+# Lower runs first
+PRIORITY_HIGH = 0  # a user is waiting on screen (wizard)
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 10  # nice to have (garage summaries)
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+FINISHED_STATUSES = (STATUS_DONE, STATUS_FAILED)
+
+
+class JobQueueFull(HTTPException):
+    def __init__(self):
+        super().__init__(status_code=503, detail="Yapay zeka iş kuyruğu dolu. Lütfen birazdan tekrar deneyin.")
+
+
+def check_job_access(job: dict, user: Optional[dict]):
+    """Jobs submitted by a signed-in user are only visible to that user"""
+    if job.get("userId") and (not user or user["id"] != job["userId"]):
+        raise HTTPException(status_code=403, detail="Bu işe erişim yetkiniz yok")
+
+
+def job_to_response(job: dict) -> dict:
+    """Public view of a job document"""
+    return {
+        "jobId": job["id"],
+        "kind": job.get("kind"),
+        "status": job.get("status"),
+        "result": job.get("result"),
+        "error": job.get("error"),
+        "createdAt": job.get("createdAt"),
+        "startedAt": job.get("startedAt"),
+        "finishedAt": job.get("finishedAt"),
+    }
+
+
+class JobQueue:
+    def __init__(self, workers: int = AI_JOB_WORKERS, max_size: int = AI_JOB_QUEUE_MAX, timeout: float = AI_JOB_TIMEOUT):
+        self.worker_count = workers
+        self.max_size = max_size
+        self.timeout = timeout
+        self._handlers = {}  # kind -> async fn(payload, db) -> result dict
+        self._queue = None
+        self._workers = []
+        self._listeners = {}  # job id -> set of asyncio.Queue (SSE subscribers)
+        self._seq = itertools.count()
+        self.db = None
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def register(self, kind: str, handler):
+        self._handlers[kind] = handler
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    async def start(self, db):
+        """Start the workers and queue again the jobs a previous run left unfinished"""
+        self.db = db
+        self._queue = asyncio.PriorityQueue(maxsize=self.max_size)
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+
+        # A job running for longer than the timeout has lost its worker; younger ones may be live elsewhere
+        stale = {"status": STATUS_RUNNING, "startedAt": {"$lt": datetime.utcnow() - timedelta(seconds=self.timeout)}}
+        pending = await db.ai_jobs.find(
+            {"$or": [{"status": STATUS_QUEUED}, stale]}
+        ).to_list(length=self.max_size)
+        for job in pending:
+            if job["status"] == STATUS_RUNNING:
+                result = await db.ai_jobs.update_one(
+                    {"id": job["id"], **stale},
+                    {"$set": {"status": STATUS_QUEUED, "startedAt": None}}
+                )
+                if not result.modified_count:
+                    continue
+            self._queue.put_nowait((job.get("priority", PRIORITY_NORMAL), next(self._seq), job["id"]))
+        logger.info(f"AI job queue started: {self.worker_count} workers, {len(pending)} jobs recovered")
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        logger.info("AI job queue stopped")
+
+    async def submit(self, kind: str, payload: dict, priority: int = PRIORITY_NORMAL, user_id: str = None) -> dict:
+        """Persist a queued job and schedule it; raises JobQueueFull when the backlog is at its limit"""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if not self.running:
+            raise HTTPException(status_code=503, detail="Yapay zeka iş kuyruğu çalışmıyor.")
+        if self._queue.full():
+            self.rejected += 1
+            raise JobQueueFull()
+
+        job = {
+            "id": str(uuid.uuid4()),
+            "kind": kind,
+            "status": STATUS_QUEUED,
+            "priority": priority,
+            "userId": user_id,
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "createdAt": datetime.utcnow(),
+            "startedAt": None,
+            "finishedAt": None,
+        }
+        await self.db.ai_jobs.insert_one(job)
+        self._queue.put_nowait((priority, next(self._seq), job["id"]))
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.db.ai_jobs.find_one({"id": job_id})
+
+    async def subscribe(self, job_id: str, heartbeat: float = 15.0):
+        """
+        Yield the job document now and after every status change until it finishes;
+        None while idle (heartbeat). Changes made in this process arrive right away,
+        those of a job run elsewhere when the document is re-read on the heartbeat.
+        """
+        listener = asyncio.Queue()
+        self._listeners.setdefault(job_id, set()).add(listener)
+        try:
+            job = await self.get(job_id)
+            if job is None:
+                return
+            status = job.get("status")
+            yield job
+            # Changes published while the document was being read arrive again: skip repeats
+            while status not in FINISHED_STATUSES:
+                try:
+                    job = await asyncio.wait_for(listener.get(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    job = await self.get(job_id)
+                    if job is None:
+                        return
+                    if job.get("status") == status:
+                        yield None
+                        continue
+                if job.get("status") != status:
+                    status = job.get("status")
+                    yield job
+        finally:
+            listeners = self._listeners.get(job_id)
+            if listeners is not None:
+                listeners.discard(listener)
+                if not listeners:
+                    del self._listeners[job_id]
+
+    async def _update(self, job: dict, **changes):
+        job.update(changes)
+        await self.db.ai_jobs.update_one({"id": job["id"]}, {"$set": changes})
+        for listener in self._listeners.get(job["id"], ()):
+            listener.put_nowait(job)
+
+    async def _worker(self, index: int):
+        while True:
+            _, _, job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"AI job worker {index} crashed on {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str):
+        # Claim: only the worker whose update moves the job out of "queued" runs it
+        started = datetime.utcnow()
+        claimed = await self.db.ai_jobs.update_one(
+            {"id": job_id, "status": STATUS_QUEUED},
+            {"$set": {"status": STATUS_RUNNING, "startedAt": started}}
+        )
+        if not claimed.modified_count:
+            return
+        job = await self.get(job_id)
+        if job is None:
+            return
+        await self._update(job, status=STATUS_RUNNING, startedAt=started)
+        try:
+            result = await asyncio.wait_for(self._handlers[job["kind"]](job["payload"], self.db), timeout=self.timeout)
+        except asyncio.CancelledError:
+            raise  # shutdown: left "running", queued again on the next start
+        except Exception as e:
+            self.failed += 1
+            detail = e.detail if isinstance(e, HTTPException) else (str(e) or type(e).__name__)
+            logger.warning(f"AI job {job_id} ({job['kind']}) failed: {detail}")
+            await self._update(job, status=STATUS_FAILED, error=detail, finishedAt=datetime.utcnow())
+        else:
+            self.completed += 1
+            await self._update(job, status=STATUS_DONE, result=result, finishedAt=datetime.utcnow())
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._workers),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "maxQueued": self.max_size,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+        }
+
+
+# Singleton instance
+ai_job_queue = JobQueue()
@@ -2,29 +2,76 @@
 import json
 import os
 import asyncio
+import heapq
+from functools import cmp_to_key
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 import logging
 import uuid
+import random
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+def _sort_value(value):
+    """Order key for mixed types: None first, numbers numerically, the rest (datetimes too) by their str form as saved to disk"""
+    if value is None:
+        return (0, 0, "")
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (1, value, "")
+    return (2, 0, str(value))
+
+def _order_key(get_value, keys):
+    """Sort key for a [(field, direction), ...] spec"""
+    def compare(a, b):
+        for field, direction in keys:
+            va, vb = _sort_value(get_value(a, field)), _sort_value(get_value(b, field))
+            if va != vb:
+                return direction if va > vb else -direction
+        return 0
+    return cmp_to_key(compare)
+
+def _comparable(item_value, op_val):
+    """Datetimes come back from disk as str: compare a datetime with a str in that str form"""
+    if isinstance(item_value, datetime) and isinstance(op_val, str):
+        return str(item_value), op_val
+    if isinstance(op_val, datetime) and isinstance(item_value, str):
+        return item_value, str(op_val)
+    return item_value, op_val
+
+def _project(item, projection):
+    """Apply a Mongo-style top-level projection ({"name": 1} or {"password": 0}); returns a copy"""
+    if not projection:
+        return item
+    if isinstance(projection, (list, tuple)):
+        projection = {k: 1 for k in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if any(fields.values()):
+        doc = {k: item[k] for k in fields if k in item}
+    else:
+        doc = {k: v for k, v in item.items() if k not in fields}
+    if include_id and "_id" in item:
+        doc["_id"] = item["_id"]
+    else:
+        doc.pop("_id", None)
+    return doc
+
 class AsyncJsonCollection:
     def __init__(self, db, name):
         self.db = db
         self.name = name
 
-    async def find_one(self, filter_doc: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    async def find_one(self, filter_doc: Dict[str, Any], projection: Dict[str, Any] = None) -> Optional[Dict[str, Any]]:
         data = self.db._get_collection_data(self.name)
         for item in data:
             if self._matches(item, filter_doc):
-                return item
+                return _project(item, projection)
         return None
 
-    def find(self, filter_doc: Dict[str, Any] = None):
+    def find(self, filter_doc: Dict[str, Any] = None, projection: Dict[str, Any] = None):
         # Returns a cursor-like object
-        return AsyncJsonCursor(self.db, self.name, filter_doc)
+        return AsyncJsonCursor(self.db, self.name, filter_doc, projection)
 
     async def insert_one(self, document: Dict[str, Any]):
         if "_id" not in document:
@@ -50,15 +97,37 @@ class AsyncJsonCollection:
         await self.db._save()
         return InsertManyResult(ids)
 
-    async def update_one(self, filter_doc: Dict[str, Any], update_doc: Dict[str, Any]):
+    async def update_one(self, filter_doc: Dict[str, Any], update_doc: Dict[str, Any], upsert: bool = False):
         data = self.db._get_collection_data(self.name)
         for item in data:
             if self._matches(item, filter_doc):
                 self._apply_update(item, update_doc)
                 await self.db._save()
                 return UpdateResult(1)
+        if upsert:
+            # New document from the filter's equality fields, $setOnInsert and the update
+            document = {}
+            for k, v in filter_doc.items():
+                if not k.startswith("$") and not isinstance(v, dict):
+                    self._set_nested_value(document, k, v)
+            for k, v in update_doc.get("$setOnInsert", {}).items():
+                self._set_nested_value(document, k, v)
+            self._apply_update(document, update_doc)
+            result = await self.insert_one(document)
+            return UpdateResult(0, upserted_id=result.inserted_id)
         return UpdateResult(0)
 
+    async def update_many(self, filter_doc: Dict[str, Any], update_doc: Dict[str, Any]):
+        data = self.db._get_collection_data(self.name)
+        modified = 0
+        for item in data:
+            if self._matches(item, filter_doc):
+                self._apply_update(item, update_doc)
+                modified += 1
+        if modified:
+            await self.db._save()
+        return UpdateResult(modified)
+
     async def delete_one(self, filter_doc: Dict[str, Any]):
         data = self.db._get_collection_data(self.name)
         for i, item in enumerate(data):
@@ -68,6 +137,15 @@ class AsyncJsonCollection:
                 return DeleteResult(1)
         return DeleteResult(0)
     
+    async def delete_many(self, filter_doc: Dict[str, Any]):
+        data = self.db._get_collection_data(self.name)
+        kept = [item for item in data if not self._matches(item, filter_doc)]
+        deleted = len(data) - len(kept)
+        if deleted:
+            data[:] = kept
+            await self.db._save()
+        return DeleteResult(deleted)
+    
     async def count_documents(self, filter_doc: Dict[str, Any]) -> int:
         data = self.db._get_collection_data(self.name)
         count = 0
@@ -76,9 +154,13 @@ class AsyncJsonCollection:
                 count += 1
         return count
 
-    async def create_index(self, keys, unique=False):
+    def aggregate(self, pipeline: List[Dict[str, Any]]):
+        # Minimal pipeline support: $match, $sample, $limit
+        return AsyncJsonAggregateCursor(self, pipeline)
+
+    async def create_index(self, keys, unique=False, **kwargs):
         # Check uniqueness immediately if data exists? 
-        # For MVP, we just log it.
+        # For MVP, we just log it (options such as expireAfterSeconds are ignored).
         logger.info(f"Mock Index created on {self.name}: {keys} (unique={unique})")
         return "index_name"
 
@@ -115,6 +197,8 @@ class AsyncJsonCollection:
             # If v is a dict, it contains operators
             if isinstance(v, dict):
                 for op, op_val in v.items():
+                    if op in ("$gte", "$lte", "$gt", "$lt", "$ne"):
+                        item_value, op_val = _comparable(self._get_nested_value(item, k), op_val)
                     if op == "$regex":
                         import re
                         flags = 0
@@ -140,11 +224,15 @@ class AsyncJsonCollection:
                     elif op == "$in":
                         if item_value not in op_val:
                             return False
+                    elif op == "$exists":
+                        if self._has_nested_value(item, k) != bool(op_val):
+                            return False
                     elif op == "$options":
                         # This is handled with $regex
                         pass
             else:
                 # Simple equality check
+                item_value, v = _comparable(item_value, v)
                 if item_value != v:
                     return False
         return True
@@ -160,21 +248,55 @@ class AsyncJsonCollection:
                 return None
         return value
 
+    def _has_nested_value(self, item, key):
+        """Whether the (dotted) field is present at all, even when it holds None"""
+        for k in key.split('.'):
+            if not isinstance(item, dict) or k not in item:
+                return False
+            item = item[k]
+        return True
+
+    def _set_nested_value(self, item, key, value):
+        # Dotted keys ("histogram.8") create intermediate dicts like Mongo
+        parts = key.split(".")
+        for part in parts[:-1]:
+            if not isinstance(item.get(part), dict):
+                item[part] = {}
+            item = item[part]
+        item[parts[-1]] = value
+
     def _apply_update(self, item, update_doc):
-        # Support only $set for now
         if "$set" in update_doc:
             for k, v in update_doc["$set"].items():
-                item[k] = v
+                self._set_nested_value(item, k, v)
         # Support $inc
         if "$inc" in update_doc:
             for k, v in update_doc["$inc"].items():
-                item[k] = item.get(k, 0) + v
-        # Support $push
+                self._set_nested_value(item, k, (self._get_nested_value(item, k) or 0) + v)
+        # Support $push (with $each / $position / $sort / $slice modifiers)
         if "$push" in update_doc:
             for k, v in update_doc["$push"].items():
                 if k not in item:
                     item[k] = []
-                if isinstance(item[k], list):
+                if not isinstance(item[k], list):
+                    continue
+                if isinstance(v, dict) and "$each" in v:
+                    position = v.get("$position")
+                    if position is None:
+                        item[k].extend(v["$each"])
+                    else:
+                        item[k][position:position] = v["$each"]
+                    if "$sort" in v:
+                        sort_spec = v["$sort"]
+                        if isinstance(sort_spec, dict):
+                            for field, direction in reversed(list(sort_spec.items())):
+                                item[k].sort(key=lambda e: _sort_value(self._get_nested_value(e, field)), reverse=direction == -1)
+                        else:
+                            item[k].sort(key=_sort_value, reverse=sort_spec == -1)
+                    if "$slice" in v:
+                        n = v["$slice"]
+                        item[k][:] = item[k][:n] if n >= 0 else item[k][n:]
+                else:
                     item[k].append(v)
         # Support $pull
         if "$pull" in update_doc:
@@ -199,10 +321,11 @@ class AsyncJsonCollection:
                       item[k] = new_list
 
 class AsyncJsonCursor:
-    def __init__(self, db, name, filter_doc):
+    def __init__(self, db, name, filter_doc, projection=None):
         self.db = db
         self.name = name
         self.filter_doc = filter_doc
+        self.projection = projection
         self._limit = 0
         self._skip = 0
         self._sort = None
@@ -223,26 +346,23 @@ class AsyncJsonCursor:
         data = self.db._get_collection_data(self.name)
         filtered = []
         for item in data:
-            # We need to access the collection helper to use _matches logic properly
-            # but for simplicity I duplicated basic logic or could move it to DB
              if self._matches(item, self.filter_doc):
                  filtered.append(item)
         
         # Sort
         if self._sort:
             # Handle list of tuples vs single key
-            key, direction = self._sort if isinstance(self._sort, tuple) else (self._sort, 1)
-            # Very basic sort
-            if isinstance(key, str):
-                def get_sort_key(item):
-                    val = item.get(key)
-                    if val is None:
-                        return ""
-                    return str(val)
-                filtered.sort(key=get_sort_key, reverse=(direction == -1))
-            elif isinstance(key, list):
-                 # Support list of tuples for sort
-                 pass 
+            key, direction = self._sort
+            keys = key if isinstance(key, list) else [(key, direction)]
+            # Numbers compare numerically (likeCount 10 > 9), everything else as text
+            order = _order_key(self._get_nested_value, keys)
+            # Only the first skip + limit documents are returned: keep those in a bounded
+            # heap instead of sorting every match, so a keyset page costs the same at any depth
+            wanted = self._skip + (length if length is not None else self._limit)
+            if wanted and wanted < len(filtered):
+                filtered = heapq.nsmallest(wanted, filtered, key=order)
+            else:
+                filtered.sort(key=order)
 
         # Skip & Limit
         if self._skip > 0:
@@ -252,86 +372,16 @@ class AsyncJsonCursor:
              filtered = filtered[:length]
         elif self._limit > 0:
              filtered = filtered[:self._limit]
+
+        if self.projection:
+            filtered = [_project(item, self.projection) for item in filtered]
              
         return filtered
 
-    def _matches(self, item, filter_doc):
-        if not filter_doc:
-            return True
-        
-        for k, v in filter_doc.items():
-            # Support $or operator
-            if k == "$or":
-                if not isinstance(v, list):
-                    return False
-                or_match = False
-                for sub_filter in v:
-                    if self._matches(item, sub_filter):
-                        or_match = True
-                        break
-                if not or_match:
-                    return False
-                continue
-            
-            # Support $and operator
-            if k == "$and":
-                if not isinstance(v, list):
-                    return False
-                for sub_filter in v:
-                    if not self._matches(item, sub_filter):
-                        return False
-                continue
-            
-            # Get the value from item (support nested keys like "scores.overall.score")
-            item_value = self._get_nested_value(item, k)
-            
-            # If v is a dict, it contains operators
-            if isinstance(v, dict):
-                for op, op_val in v.items():
-                    if op == "$regex":
-                        import re
-                        flags = 0
-                        if "$options" in v and "i" in v["$options"]:
-                            flags = re.IGNORECASE
-                        if item_value is None or not re.search(op_val, str(item_value), flags):
-                            return False
-                    elif op == "$gte":
-                        if item_value is None or item_value < op_val:
-                            return False
-                    elif op == "$lte":
-                        if item_value is None or item_value > op_val:
-                            return False
-                    elif op == "$gt":
-                        if item_value is None or item_value <= op_val:
-                            return False
-                    elif op == "$lt":
-                        if item_value is None or item_value >= op_val:
-                            return False
-                    elif op == "$ne":
-                        if item_value == op_val:
-                            return False
-                    elif op == "$in":
-                        if item_value not in op_val:
-                            return False
-                    elif op == "$options":
-                        # This is handled with $regex
-                        pass
-            else:
-                # Simple equality check
-                if item_value != v:
-                    return False
-        return True
-    
-    def _get_nested_value(self, item, key):
-        """Get value from nested dict using dot notation like 'scores.overall.score'"""
-        keys = key.split('.')
-        value = item
-        for k in keys:
-            if isinstance(value, dict) and k in value:
-                value = value[k]
-            else:
-                return None
-        return value
+    # Same matching rules as the collection
+    _matches = AsyncJsonCollection._matches
+    _get_nested_value = AsyncJsonCollection._get_nested_value
+    _has_nested_value = AsyncJsonCollection._has_nested_value
     
     def __aiter__(self):
         # To support "async for doc in cursor"
@@ -350,6 +400,36 @@ class AsyncJsonCursor:
         else:
             raise StopAsyncIteration
 
+class AsyncJsonAggregateCursor:
+    def __init__(self, collection, pipeline):
+        self.collection = collection
+        self.pipeline = pipeline
+
+    async def to_list(self, length=None):
+        docs = list(self.collection.db._get_collection_data(self.collection.name))
+        for stage in self.pipeline:
+            if "$match" in stage:
+                docs = [d for d in docs if self.collection._matches(d, stage["$match"])]
+            elif "$sample" in stage:
+                size = stage["$sample"].get("size", len(docs))
+                docs = random.sample(docs, min(size, len(docs)))
+            elif "$limit" in stage:
+                docs = docs[:stage["$limit"]]
+            else:
+                logger.warning(f"Unsupported aggregation stage ignored: {list(stage.keys())}")
+        return docs[:length] if length is not None else docs
+
+    def __aiter__(self):
+        self._iter_data = None
+        return self
+
+    async def __anext__(self):
+        if self._iter_data is None:
+            self._iter_data = await self.to_list()
+        if not self._iter_data:
+            raise StopAsyncIteration
+        return self._iter_data.pop(0)
+
 class AsyncJsonDatabase:
     def __init__(self, file_path="local_db.json"):
         self.file_path = file_path
@@ -416,8 +496,9 @@ class InsertResult:
         self.inserted_id = inserted_id
 
 class UpdateResult:
-    def __init__(self, modified_count):
+    def __init__(self, modified_count, upserted_id=None):
         self.modified_count = modified_count
+        self.upserted_id = upserted_id
 
 class DeleteResult:
     def __init__(self, deleted_count):
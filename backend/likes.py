@@ -0,0 +1,113 @@
+"""
+Likes for reviews and garage vehicles.
+
+Likes used to be an unbounded `likes` array of user ids on each review/garage
+document: every toggle was an O(n) membership test plus a rewrite of the whole
+array, and "helpful" sorting had no number to sort on. Each like is now its own
+document in db.likes {targetType, targetId, userId}, unique per user and
+target, and the liked document keeps a likeCount maintained with $inc.
+
+Documents written before this still carry the legacy array (and no
+likeCount); they are moved over on their next toggle, and all at once by
+migrate_legacy_likes at startup (or migrate_likes.py). The "helpful" review
+sort reads likeCount, where a missing one would rank a liked legacy review
+below reviews with no likes at all.
+
+Responses keep their `likes` list for the frontend's likes.includes(user.id)
+check, but it now only ever contains the requesting user (when they liked it).
+"""
+from datetime import datetime
+from typing import Iterable, Optional, Set
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+REVIEW = "review"
+GARAGE = "garage"
+
+# targetType -> collection holding the liked documents
+TARGET_COLLECTIONS = {REVIEW: "reviews", GARAGE: "garage"}
+
+
+def like_count(doc: dict) -> int:
+    if "likeCount" in doc:
+        return doc["likeCount"]
+    return len(doc.get("likes") or [])
+
+
+def viewer_likes(doc: dict, liked: bool, viewer_id: Optional[str]) -> list:
+    """The `likes` list sent to clients: just the viewer, if they liked the document"""
+    if viewer_id and (liked or viewer_id in (doc.get("likes") or [])):
+        return [viewer_id]
+    return []
+
+
+async def liked_target_ids(db: AsyncIOMotorDatabase, target_type: str, target_ids: Iterable[str], user_id: Optional[str]) -> Set[str]:
+    """Which of target_ids the user liked, in one query"""
+    target_ids = list(target_ids)
+    if not user_id or not target_ids:
+        return set()
+    likes = await db.likes.find(
+        {"targetType": target_type, "userId": user_id, "targetId": {"$in": target_ids}},
+        {"_id": 0, "targetId": 1}
+    ).to_list(length=len(target_ids))
+    return {like["targetId"] for like in likes}
+
+
+async def migrate_document(db: AsyncIOMotorDatabase, target_type: str, doc: dict) -> int:
+    """
+    Move a legacy likes array into db.likes and set likeCount; returns the count.
+    Likes are upserted and the document is only rewritten while it has no
+    likeCount, so a concurrent toggle's $inc is never overwritten.
+    """
+    collection = db[TARGET_COLLECTIONS[target_type]]
+    count = 0
+    for user_id in dict.fromkeys(doc.get("likes") or []):
+        await db.likes.update_one(
+            {"targetType": target_type, "targetId": doc["id"], "userId": user_id},
+            {"$setOnInsert": {"createdAt": datetime.utcnow()}},
+            upsert=True
+        )
+        count += 1
+    await collection.update_one({"id": doc["id"], "likeCount": {"$exists": False}}, {"$set": {"likes": [], "likeCount": count}})
+    return count
+
+
+async def migrate_legacy_likes(db: AsyncIOMotorDatabase) -> dict:
+    """Migrate every document still without a likeCount; returns collection -> (documents, likes)"""
+    migrated = {}
+    for target_type, collection in TARGET_COLLECTIONS.items():
+        documents = likes = 0
+        async for doc in db[collection].find({"likeCount": {"$exists": False}}, {"_id": 0, "id": 1, "likes": 1}):
+            likes += await migrate_document(db, target_type, doc)
+            documents += 1
+        migrated[collection] = (documents, likes)
+    return migrated
+
+
+async def toggle_like(db: AsyncIOMotorDatabase, target_type: str, doc: dict, user_id: str) -> tuple:
+    """Like or unlike `doc` for the user; returns (liked, likeCount)"""
+    collection = db[TARGET_COLLECTIONS[target_type]]
+    if "likeCount" not in doc:
+        await migrate_document(db, target_type, doc)
+
+    key = {"targetType": target_type, "targetId": doc["id"], "userId": user_id}
+    removed = await db.likes.delete_one(key)
+    if removed.deleted_count:
+        liked, delta = False, -1
+    else:
+        try:
+            await db.likes.insert_one({**key, "createdAt": datetime.utcnow()})
+            liked, delta = True, 1
+        except DuplicateKeyError:  # a concurrent toggle already liked it
+            liked, delta = True, 0
+    if delta:
+        await collection.update_one({"id": doc["id"]}, {"$inc": {"likeCount": delta}})
+
+    updated = await collection.find_one({"id": doc["id"]}, {"_id": 0, "likeCount": 1})
+    return liked, max(0, (updated or {}).get("likeCount", 0))
+
+
+async def delete_likes(db: AsyncIOMotorDatabase, target_type: str, target_id: str):
+    """Drop the like documents of a deleted review/garage vehicle"""
+    await db.likes.delete_many({"targetType": target_type, "targetId": target_id})
@@ -0,0 +1,184 @@
+"""
+Content-addressed cache for Gemini responses.
+
+Keys are a hash of (model, system_instruction, contents, generationConfig) with
+whitespace in the text parts normalized, so the same prompt always maps to the
+same entry. Entries live in an in-memory LRU with a TTL; setting LLM_CACHE_DIR
+adds an on-disk tier that survives restarts. SingleFlight uses the same keys to
+collapse concurrent identical calls into one upstream request.
+"""
+import os
+import json
+import time
+import hashlib
+import asyncio
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_DIR = os.environ.get("LLM_CACHE_DIR")
+
+
+def _normalize(value):
+    """Collapse whitespace in every string so prompt indentation does not change the key"""
+    if hasattr(value, "cache_token"):
+        # Streamed binary parts (gemini_client.Base64Blob) are keyed by their digest
+        return value.cache_token
+    if isinstance(value, str):
+        return " ".join(value.split())
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def make_cache_key(model: str, system_instruction: Optional[str], contents: list, generation_config: dict) -> str:
+    material = {
+        "model": model,
+        "system_instruction": _normalize(system_instruction or ""),
+        "contents": _normalize(contents),
+        "generationConfig": generation_config,
+    }
+    raw = json.dumps(material, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl_seconds: int = LLM_CACHE_TTL, disk_dir: Optional[str] = LLM_CACHE_DIR):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry:
+            expires_at, value = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        if self.disk_dir:
+            loop = asyncio.get_event_loop()
+            stored = await loop.run_in_executor(None, self._read_disk, key)
+            if stored:
+                self._remember(key, stored["value"], stored["expiresAt"])
+                self.disk_hits += 1
+                return stored["value"]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str):
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        if self.disk_dir:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, self._write_disk, key, value, expires_at)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxEntries": self.max_entries,
+            "ttlSeconds": self.ttl_seconds,
+            "hits": self.hits,
+            "diskHits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "diskTier": str(self.disk_dir) if self.disk_dir else None,
+        }
+
+    def _remember(self, key: str, value: str, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.json"
+
+    def _read_disk(self, key: str) -> Optional[dict]:
+        path = self._disk_path(key)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                stored = json.load(f)
+        except Exception as e:
+            logger.warning(f"Unreadable LLM cache file {path}: {e}")
+            return None
+        if stored.get("expiresAt", 0) <= time.time():
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return stored
+
+    def _write_disk(self, key: str, value: str, expires_at: float):
+        path = self._disk_path(key)
+        tmp_path = path.with_suffix(".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"value": value, "expiresAt": expires_at}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Could not write LLM cache file {path}: {e}")
+
+
+class SingleFlight:
+    """
+    Request coalescing: concurrent callers with the same key await one shared
+    in-flight call instead of each hitting the upstream.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> asyncio.Task
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn):
+        task = self._inflight.get(key)
+        if task is None:
+            # Run as its own task so one caller disconnecting does not cancel the others
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller went away
+
+    def stats(self) -> dict:
+        return {"inFlight": len(self._inflight), "upstreamCalls": self.calls, "coalesced": self.shared}
+
+
+# Singleton instances
+llm_cache = LLMResponseCache()
+single_flight = SingleFlight()
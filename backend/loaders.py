@@ -0,0 +1,134 @@
+"""
+Batched lookups: author hydration for list endpoints and request-scoped
+DataLoaders.
+
+Pages of garage vehicles, comments and reviews used to look up their author
+with one db.users.find_one per item. load_user_names collects the distinct
+user ids of a page and fetches them with a single $in query that projects only
+the fields needed, so the number of user queries no longer grows with the
+page size.
+
+DataLoader does the same for lookups spread over a request: loads issued in
+the same event-loop tick (e.g. the reviews of a page, converted with
+asyncio.gather) are sent as one $in query, and results are memoized for the
+rest of the request. RequestLoaders bundles the loaders a request needs; get
+one per request through dependencies.get_loaders. Both only use find with $in,
+so they work on Motor and on json_db.
+"""
+import asyncio
+from typing import Dict, Iterable
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+UNKNOWN_AUTHOR = "Bilinmeyen"
+
+
+async def load_users(db: AsyncIOMotorDatabase, user_ids: Iterable[str], fields: Iterable[str] = ("name",)) -> Dict[str, dict]:
+    """id -> user document (only `fields`) for the given ids, in one query"""
+    ids = list(dict.fromkeys(uid for uid in user_ids if uid))
+    if not ids:
+        return {}
+    projection = {"_id": 0, "id": 1}
+    projection.update({field: 1 for field in fields})
+    users = await db.users.find({"id": {"$in": ids}}, projection).to_list(length=len(ids))
+    return {user["id"]: user for user in users}
+
+
+async def load_user_names(db: AsyncIOMotorDatabase, user_ids: Iterable[str], default: str = UNKNOWN_AUTHOR) -> Dict[str, str]:
+    """id -> display name for the given ids; missing users get `default`"""
+    user_ids = list(user_ids)
+    users = await load_users(db, user_ids)
+    return {uid: users.get(uid, {}).get("name") or default for uid in user_ids}
+
+
+
+class DataLoader:
+    """
+    Request-scoped batching loader. load(key) calls made in the same event-loop
+    tick are collected and resolved by a single batch_fn(keys) -> {key: value}
+    call; every key is memoized (None included) for the loader's lifetime.
+    """
+
+    def __init__(self, batch_fn, max_batch_size: int = 100):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self._cache = {}  # key -> Future
+        self._pending = []
+        self.batches = 0
+
+    def load(self, key) -> asyncio.Future:
+        future = self._cache.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._cache[key] = future
+            if not self._pending:
+                # Runs after the callbacks already queued, i.e. the other gathered loads
+                loop.call_soon(self._dispatch)
+            self._pending.append(key)
+        return future
+
+    async def load_many(self, keys: Iterable) -> list:
+        return list(await asyncio.gather(*[self.load(key) for key in keys]))
+
+    def prime(self, key, value):
+        """Seed the cache with a value that is already known"""
+        if key not in self._cache:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(value)
+            self._cache[key] = future
+
+    def _dispatch(self):
+        keys, self._pending = self._pending, []
+        for i in range(0, len(keys), self.max_batch_size):
+            asyncio.ensure_future(self._run_batch(keys[i:i + self.max_batch_size]))
+
+    async def _run_batch(self, keys: list):
+        self.batches += 1
+        try:
+            results = await self.batch_fn(keys)
+        except Exception as e:
+            for key in keys:
+                future = self._cache.pop(key)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key in keys:
+            future = self._cache[key]
+            if not future.done():
+                future.set_result(results.get(key))
+
+
+class RequestLoaders:
+    """The DataLoaders of one request (see dependencies.get_loaders)"""
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.db = db
+        self.users = DataLoader(self._users_by_id)
+        self.vehicles = DataLoader(self._vehicles_by_id_or_slug)
+        self.garages = DataLoader(self._garages_by_user)
+
+    async def _users_by_id(self, ids: list) -> Dict[str, dict]:
+        users = await self.db.users.find({"id": {"$in": ids}}, {"_id": 0, "password_hash": 0}).to_list(length=len(ids))
+        return {user["id"]: user for user in users}
+
+    async def _vehicles_by_id_or_slug(self, keys: list) -> Dict[str, dict]:
+        vehicles = await self.db.vehicles.find(
+            {"$or": [{"id": {"$in": keys}}, {"slug": {"$in": keys}}]}
+        ).to_list(length=len(keys) * 2)
+        found = {}
+        for vehicle in vehicles:
+            for key in (vehicle.get("id"), vehicle.get("slug")):
+                if key in keys:
+                    found[key] = vehicle
+        return found
+
+    async def _garages_by_user(self, user_ids: list) -> Dict[str, list]:
+        """userId -> that user's garage vehicles (brand/model only)"""
+        vehicles = await self.db.garage.find(
+            {"userId": {"$in": user_ids}}, {"_id": 0, "userId": 1, "brand": 1, "model": 1}
+        ).to_list(length=None)
+        garages = {uid: [] for uid in user_ids}
+        for vehicle in vehicles:
+            garages[vehicle["userId"]].append(vehicle)
+        return garages
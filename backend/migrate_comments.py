@@ -0,0 +1,29 @@
+"""
+Move legacy embedded `comments` arrays on garage vehicles into
+db.garage_comments, set commentCount and keep only the latest comments inline
+(see comments.py). Vehicles already migrated are skipped, so the script can be
+run repeatedly.
+
+    python migrate_comments.py
+"""
+import asyncio
+
+from database import db_instance
+from comments import migrate_document
+
+
+async def main():
+    db_instance.connect()
+    db = db_instance.get_db()
+    migrated = comments = 0
+    async for vehicle in db.garage.find({}, {"_id": 0, "id": 1, "comments": 1, "commentCount": 1}):
+        if "commentCount" in vehicle:
+            continue
+        comments += await migrate_document(db, vehicle)
+        migrated += 1
+    print(f"garage: {migrated} vehicles migrated ({comments} comments)")
+    db_instance.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,23 @@
+"""
+Move legacy `likes` arrays on reviews and garage vehicles into db.likes and
+set likeCount (see likes.py). The server does the same at startup; documents
+already migrated are skipped, so the script can be run repeatedly.
+
+    python migrate_likes.py
+"""
+import asyncio
+
+from database import db_instance
+from likes import migrate_legacy_likes
+
+
+async def main():
+    db_instance.connect()
+    db = db_instance.get_db()
+    for collection, (migrated, likes) in (await migrate_legacy_likes(db)).items():
+        print(f"{collection}: {migrated} documents migrated ({likes} likes)")
+    db_instance.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
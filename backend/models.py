@@ -229,6 +229,7 @@ class VehicleInDB(BaseModel):
 class VehicleListResponse(BaseModel):
     vehicles: List[VehicleResponse]
     total: int
+    nextCursor: Optional[str] = None
 
 
 # ============ Brand Models ============
@@ -268,6 +269,13 @@ class GarageComment(BaseModel):
     createdAt: datetime = Field(default_factory=utc_now)
 
 
+class GarageCommentListResponse(BaseModel):
+    """Garaj aracı yorumları sayfası (en yeniler önce)"""
+    comments: List[GarageComment]
+    total: int
+    nextCursor: Optional[str] = None
+
+
 class GarageVehicleCreate(BaseModel):
     """Kullanıcının garajına araç ekleme"""
     brand: str = Field(..., min_length=1)
@@ -365,8 +373,9 @@ class GarageVehicleInDB(BaseModel):
     fuelType: str = ""
     bodyType: str = ""
     aiSummary: str = ""
-    likes: List[str] = []  # Beğenen kullanıcı ID'leri
-    comments: List[Dict[str, Any]] = []
+    likeCount: int = 0  # Beğeniler db.likes koleksiyonunda (likes.py)
+    comments: List[Dict[str, Any]] = []  # Sadece son yorumlar; tümü db.garage_comments koleksiyonunda (comments.py)
+    commentCount: int = 0
     createdAt: datetime = Field(default_factory=utc_now)
     updatedAt: datetime = Field(default_factory=utc_now)
 
@@ -375,6 +384,7 @@ class GarageListResponse(BaseModel):
     """Garaj araçları liste response"""
     vehicles: List[GarageVehicleResponse]
     total: int
+    nextCursor: Optional[str] = None
 
 
 # ============ Activity & Social Models ============
@@ -452,6 +462,7 @@ class NewsUpdate(BaseModel):
 class NewsListResponse(BaseModel):
     news: List[NewsItem]
     total: int
+    nextCursor: Optional[str] = None
 
 
 # ============ Vehicle Review Models ============
@@ -502,7 +513,8 @@ class VehicleReviewInDB(BaseModel):
     content: str
     pros: List[str] = []
     cons: List[str] = []
-    likes: List[str] = []  # Beğenen kullanıcı ID'leri
+    isVerifiedOwner: bool = False  # review_ownership ile güncel tutulur
+    likeCount: int = 0  # Beğeniler db.likes koleksiyonunda (likes.py)
     createdAt: datetime = Field(default_factory=datetime.utcnow)
     updatedAt: datetime = Field(default_factory=datetime.utcnow)
 
@@ -0,0 +1,96 @@
+"""
+Opaque keyset (cursor) pagination helpers.
+
+skip/limit makes the database walk past every skipped document, so deep pages
+get slower and rows shift when new ones are inserted between requests. A
+keyset cursor instead remembers the sort values of the last item returned and
+the next page starts strictly after them. Cursors are the urlsafe base64 of a
+JSON list of those values; datetimes are kept as {"$date": iso} so they
+round-trip as datetimes.
+
+List endpoints sort by (sortKey, id), accept the cursor of the previous page
+as ?after= and return the next one as nextCursor (or an X-Next-Cursor header
+where the response is a bare list). skip still works for old clients but is
+ignored once a cursor is given. Each sort has a matching (filter..., sortKey,
+id) index in server.py, so a page costs the same at any depth.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+
+INVALID_CURSOR = "Geçersiz sayfa imleci"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and "$date" in value:
+        return datetime.fromisoformat(value["$date"])
+    return value
+
+
+def encode_cursor(values: list) -> str:
+    raw = json.dumps([_encode_value(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[List]:
+    """The sort values encoded in `cursor` (None for no cursor); 400 on a malformed one"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list):
+            raise ValueError(values)
+        return [_decode_value(v) for v in values]
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail=INVALID_CURSOR)
+
+
+def keyset_filter(field: str, value, last_id: str, direction: int = -1) -> dict:
+    """
+    Documents strictly after (value, last_id) in (field, id) order; direction -1 is
+    newest first. A null/missing field sorts before every value (Mongo and json_db),
+    i.e. last when descending and first when ascending, and $lt/$gt never match
+    it, so the null rows get their own branch.
+    """
+    op = "$lt" if direction == -1 else "$gt"
+    same_value = {field: value, "id": {op: last_id}}
+    if direction == -1:
+        if value is None:
+            return same_value  # already among the trailing nulls
+        return {"$or": [{field: {op: value}}, same_value, {field: None}]}
+    if value is None:
+        return {"$or": [same_value, {field: {"$ne": None}}]}
+    return {"$or": [{field: {op: value}}, same_value]}
+
+
+def keyset_sort(field: str, direction: int = -1) -> list:
+    """Sort spec for (field, id) keyset pages"""
+    return [(field, direction), ("id", direction)]
+
+
+def after_query(query: dict, field: str, after: Optional[list], direction: int = -1) -> dict:
+    """`query` restricted to documents after the decoded cursor (unchanged without one)"""
+    if not after:
+        return query
+    if len(after) != 2:
+        raise HTTPException(status_code=400, detail=INVALID_CURSOR)
+    keyset = keyset_filter(field, after[0], after[1], direction)
+    return {"$and": [query, keyset]} if query else keyset
+
+
+def split_page(docs: List[dict], limit: int, field: str) -> Tuple[List[dict], Optional[str]]:
+    """Split limit + 1 fetched documents into the page and the cursor of the next one (None on the last page)"""
+    if len(docs) <= limit:
+        return docs, None
+    page = docs[:limit]
+    return page, encode_cursor([page[-1].get(field), page[-1]["id"]])
@@ -0,0 +1,133 @@
+"""
+Near-duplicate cache for /ai/snap identifications.
+
+The same viral car photos (and re-crops / re-compressions of them) are uploaded
+again and again. Answers are keyed by the image's 64-bit dHash
+(image_pipeline.dhash); a new upload within SNAP_PHASH_THRESHOLD differing bits
+of a cached hash reuses that SnapResponse instead of calling Gemini.
+
+Neighbours are found with a BK-tree over Hamming distance. The cache is a
+bounded LRU; evicted hashes are only tombstoned in the tree, which is rebuilt
+from the live entries once tombstones pile up.
+"""
+import os
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SNAP_PHASH_THRESHOLD = int(os.environ.get("SNAP_PHASH_THRESHOLD", "8"))
+SNAP_PHASH_MAX_ENTRIES = int(os.environ.get("SNAP_PHASH_MAX_ENTRIES", "2000"))
+# Answers below this confidence are not worth replaying
+SNAP_PHASH_MIN_CONFIDENCE = 50
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Metric tree: each child edge is labelled with its distance to the parent"""
+
+    def __init__(self):
+        self.root = None  # [hash, {distance: node}]
+        self.size = 0
+
+    def add(self, value: int):
+        if self.root is None:
+            self.root = [value, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value: int, threshold: int):
+        """(distance, hash) pairs within threshold"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= threshold:
+                found.append((distance, node_value))
+            # Triangle inequality: only children in [d - t, d + t] can match
+            for edge, child in children.items():
+                if distance - threshold <= edge <= distance + threshold:
+                    stack.append(child)
+        return found
+
+
+class PerceptualHashCache:
+    def __init__(self, max_entries: int = SNAP_PHASH_MAX_ENTRIES, threshold: int = SNAP_PHASH_THRESHOLD):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries = OrderedDict()  # hash -> cached response dict
+        self._tree = BKTree()
+        self._tombstones = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, phash: int) -> Optional[Tuple[dict, int]]:
+        """(cached response, Hamming distance) of the closest live entry, or None"""
+        candidates = [(d, h) for d, h in self._tree.search(phash, self.threshold) if h in self._entries]
+        if not candidates:
+            self.misses += 1
+            return None
+        distance, match = min(candidates)
+        self._entries.move_to_end(match)
+        self.hits += 1
+        return self._entries[match], distance
+
+    def set(self, phash: int, response: dict):
+        if phash not in self._entries:
+            self._tree.add(phash)
+        self._entries[phash] = response
+        self._entries.move_to_end(phash)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+            self._tombstones += 1
+        if self._tombstones > self.max_entries:
+            self._rebuild()
+
+    def _rebuild(self):
+        tree = BKTree()
+        for phash in self._entries:
+            tree.add(phash)
+        self._tree = tree
+        self._tombstones = 0
+        logger.info(f"Snap pHash BK-tree rebuilt with {tree.size} hashes")
+
+    def clear(self):
+        self._entries.clear()
+        self._tree = BKTree()
+        self._tombstones = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxEntries": self.max_entries,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+# Singleton instance
+snap_phash_cache = PerceptualHashCache()
@@ -0,0 +1,22 @@
+"""
+Recompute every user's followerCount / followingCount from db.garage_follows,
+dropping duplicate follow edges first (they block the unique pair index).
+
+    python rebuild_follow_counts.py
+"""
+import asyncio
+
+from database import db_instance
+from follow_graph import rebuild_follow_counts
+
+
+async def main():
+    db_instance.connect()
+    db = db_instance.get_db()
+    users, duplicates = await rebuild_follow_counts(db)
+    print(f"Rebuilt follow counts for {users} users ({duplicates} duplicate follows removed).")
+    db_instance.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,24 @@
+"""
+Rebuild the materialized review statistics (db.review_stats) from the reviews.
+
+    python rebuild_review_stats.py             # every vehicle
+    python rebuild_review_stats.py <vehicleId> # one vehicle
+"""
+import sys
+import asyncio
+
+from database import db_instance
+from review_stats import rebuild_review_stats
+
+
+async def main(vehicle_id: str = None):
+    db_instance.connect()
+    db = db_instance.get_db()
+    rebuilt = await rebuild_review_stats(db, vehicle_id)
+    reviews = sum(stats["count"] for stats in rebuilt.values())
+    print(f"Rebuilt review stats for {len(rebuilt)} vehicles ({reviews} reviews).")
+    db_instance.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1] if len(sys.argv) > 1 else None))
@@ -0,0 +1,198 @@
+"""
+Upstream protection for Gemini calls: a circuit breaker plus an AIMD
+concurrency limiter.
+
+Without them every /ai/* request waits out the httpx read timeout while Gemini
+is slow or failing, tying up workers. The breaker opens after consecutive
+upstream failures and rejects calls immediately (the endpoints then use their
+heuristic/static fallbacks); after a cool-down it lets a single probe through
+(half-open) and closes again when that succeeds. The limiter caps concurrent
+upstream calls: +1 slot per successful call, halved on a failure or a slow
+call, so the backend backs off while Gemini is degraded. A streamed call is
+judged by its time to first chunk, since a long answer streams for a long time
+on a perfectly healthy upstream.
+"""
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+import httpx
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("GEMINI_BREAKER_FAILURES", "5"))
+BREAKER_OPEN_SECONDS = float(os.environ.get("GEMINI_BREAKER_OPEN_SECONDS", "30"))
+LIMITER_INITIAL = int(os.environ.get("GEMINI_LIMIT_INITIAL", "10"))
+LIMITER_MAX = int(os.environ.get("GEMINI_LIMIT_MAX", "50"))  # matches the pooled client's max_connections
+LIMITER_SLOW_SECONDS = float(os.environ.get("GEMINI_LIMIT_SLOW_SECONDS", "15"))
+
+
+class UpstreamUnavailable(HTTPException):
+    """Raised without calling Gemini while the breaker is open or the limiter is full"""
+
+    def __init__(self, reason: str):
+        super().__init__(status_code=503, detail=f"Yapay zeka servisi geçici olarak kullanılamıyor ({reason}).")
+        self.reason = reason
+
+
+def is_upstream_failure(exc: BaseException) -> bool:
+    """Errors that say the upstream is unhealthy (not our own bad request)"""
+    if isinstance(exc, UpstreamUnavailable):
+        return False
+    if isinstance(exc, HTTPException):
+        return exc.status_code >= 500 or exc.status_code == 429
+    return isinstance(exc, (httpx.HTTPError, asyncio.TimeoutError))
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, open_seconds: float = BREAKER_OPEN_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.clock = clock
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self.rejected = 0
+        self.trips = 0
+
+    def before_call(self):
+        """Raise UpstreamUnavailable unless a call may go upstream now"""
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                raise UpstreamUnavailable("circuit open")
+            self.state = self.HALF_OPEN
+            logger.info("Gemini circuit half-open, probing upstream")
+
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                self.rejected += 1
+                raise UpstreamUnavailable("circuit half-open")
+            self._probe_in_flight = True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Gemini circuit closed")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+                logger.warning(f"Gemini circuit open after {self.consecutive_failures} failures")
+            self.state = self.OPEN
+            self.opened_at = self.clock()
+
+    def record_ignored(self):
+        """Call finished without telling us anything about upstream health"""
+        self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutiveFailures": self.consecutive_failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+        }
+
+
+class AIMDLimiter:
+    """Additive-increase / multiplicative-decrease cap on concurrent upstream calls"""
+
+    def __init__(self, initial: int = LIMITER_INITIAL, max_limit: int = LIMITER_MAX, min_limit: int = 1, slow_seconds: float = LIMITER_SLOW_SECONDS):
+        self.limit = float(initial)
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.slow_seconds = slow_seconds
+        self.in_flight = 0
+        self.rejected = 0
+
+    def acquire(self):
+        if self.in_flight >= int(self.limit):
+            self.rejected += 1
+            raise UpstreamUnavailable("concurrency limit")
+        self.in_flight += 1
+
+    def release(self, latency: float, failed: bool):
+        self.in_flight -= 1
+        if failed or latency > self.slow_seconds:
+            self.limit = max(self.min_limit, self.limit / 2)
+        else:
+            # +1 per "window" of limit successful calls
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def release_ignored(self):
+        self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {"limit": int(self.limit), "inFlight": self.in_flight, "rejected": self.rejected}
+
+
+class CallTiming:
+    """Latency of one guarded call; streams mark their first chunk to stop the clock there"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.started = clock()
+        self.first_chunk_at = None
+
+    def first_chunk(self):
+        if self.first_chunk_at is None:
+            self.first_chunk_at = self.clock()
+
+    def latency(self) -> float:
+        return (self.clock() if self.first_chunk_at is None else self.first_chunk_at) - self.started
+
+
+class UpstreamGuard:
+    def __init__(self, breaker: CircuitBreaker = None, limiter: AIMDLimiter = None, clock=time.monotonic):
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.limiter = limiter or AIMDLimiter()
+        self.clock = clock
+
+    @asynccontextmanager
+    async def call(self):
+        """
+        Wrap one upstream call; raises UpstreamUnavailable instead of calling when
+        unhealthy. Yields the call's CallTiming.
+        """
+        self.breaker.before_call()
+        try:
+            self.limiter.acquire()
+        except UpstreamUnavailable:
+            self.breaker.record_ignored()
+            raise
+
+        timing = CallTiming(self.clock)
+        try:
+            yield timing
+        except BaseException as e:
+            if is_upstream_failure(e):
+                self.limiter.release(timing.latency(), failed=True)
+                self.breaker.record_failure()
+            else:
+                self.limiter.release_ignored()
+                self.breaker.record_ignored()
+            raise
+        else:
+            self.limiter.release(timing.latency(), failed=False)
+            self.breaker.record_success()
+
+    def stats(self) -> dict:
+        return {"breaker": self.breaker.stats(), "limiter": self.limiter.stats()}
+
+
+# Singleton instance
+gemini_guard = UpstreamGuard()
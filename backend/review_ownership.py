@@ -0,0 +1,54 @@
+"""
+Verified-owner flags for vehicle reviews.
+
+A review counts as written by a verified owner when the reviewer's garage
+holds a vehicle whose brand and model contain the reviewed vehicle's (case
+insensitive). This used to be worked out for every review on every page render
+(a vehicle lookup plus a regex scan of the garage). The flag is now stored on
+the review as isVerifiedOwner: set when the review is created, and recomputed
+for all of a user's reviews by refresh_verified_owner whenever their garage
+changes (add, update, delete).
+"""
+import re
+from typing import List
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+GARAGE_MODEL_FIELDS = {"_id": 0, "brand": 1, "model": 1}
+
+
+def owns_model(garage: List[dict], vehicle: dict) -> bool:
+    """Does any garage vehicle match the catalog vehicle's brand and model?"""
+    brand = re.compile(re.escape(vehicle.get("brand", "")), re.IGNORECASE)
+    model = re.compile(re.escape(vehicle.get("model", "")), re.IGNORECASE)
+    return any(brand.search(g.get("brand", "")) and model.search(g.get("model", "")) for g in garage)
+
+
+async def compute_verified_owner(db: AsyncIOMotorDatabase, user_id: str, vehicle: dict) -> bool:
+    garage = await db.garage.find({"userId": user_id}, GARAGE_MODEL_FIELDS).to_list(length=None)
+    return owns_model(garage, vehicle)
+
+
+async def refresh_verified_owner(db: AsyncIOMotorDatabase, user_id: str) -> int:
+    """Recompute isVerifiedOwner on all of a user's reviews after a garage change; returns how many changed"""
+    reviews = await db.reviews.find(
+        {"userId": user_id}, {"_id": 0, "id": 1, "vehicleId": 1, "isVerifiedOwner": 1}
+    ).to_list(length=None)
+    if not reviews:
+        return 0
+
+    garage = await db.garage.find({"userId": user_id}, GARAGE_MODEL_FIELDS).to_list(length=None)
+    vehicle_ids = list({r["vehicleId"] for r in reviews})
+    vehicles = await db.vehicles.find(
+        {"id": {"$in": vehicle_ids}}, {"_id": 0, "id": 1, "brand": 1, "model": 1}
+    ).to_list(length=len(vehicle_ids))
+    vehicles = {v["id"]: v for v in vehicles}
+
+    changed = 0
+    for review in reviews:
+        vehicle = vehicles.get(review["vehicleId"])
+        verified = bool(vehicle) and owns_model(garage, vehicle)
+        if review.get("isVerifiedOwner") != verified:
+            await db.reviews.update_one({"id": review["id"]}, {"$set": {"isVerifiedOwner": verified}})
+            changed += 1
+    return changed
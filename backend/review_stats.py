@@ -0,0 +1,90 @@
+"""
+Materialized review statistics per vehicle (db.review_stats).
+
+get_vehicle_review_stats used to load up to 1000 reviews and recount them on
+every request, and was silently wrong past 1000 reviews. Each vehicle now has
+one document {vehicleId, count, sum, histogram: {"1".."10": n}} that
+create/update/delete_review keep current with $inc, so reading stats is a
+single find_one and exact at any volume. rebuild_review_stats recomputes the
+documents from the reviews collection (see rebuild_review_stats.py); a vehicle
+without a stats document yet is rebuilt on first read.
+"""
+from datetime import datetime
+from typing import Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+RATINGS = range(1, 11)
+
+
+def empty_stats(vehicle_id: str) -> dict:
+    return {
+        "vehicleId": vehicle_id,
+        "count": 0,
+        "sum": 0,
+        "histogram": {str(r): 0 for r in RATINGS},
+        "updatedAt": datetime.utcnow(),
+    }
+
+
+async def record_rating_change(db: AsyncIOMotorDatabase, vehicle_id: str, old_rating: Optional[int] = None, new_rating: Optional[int] = None):
+    """Apply one review write, after it happened: create (new only), rating change (old and new) or delete (old only)"""
+    if old_rating == new_rating:
+        return
+    if await db.review_stats.find_one({"vehicleId": vehicle_id}, {"_id": 1}) is None:
+        # First write for this vehicle: counting the reviews already includes this one
+        await rebuild_review_stats(db, vehicle_id)
+        return
+
+    inc = {}
+    if old_rating is not None:
+        inc["count"] = inc.get("count", 0) - 1
+        inc["sum"] = inc.get("sum", 0) - old_rating
+        inc[f"histogram.{old_rating}"] = -1
+    if new_rating is not None:
+        inc["count"] = inc.get("count", 0) + 1
+        inc["sum"] = inc.get("sum", 0) + new_rating
+        inc[f"histogram.{new_rating}"] = inc.get(f"histogram.{new_rating}", 0) + 1
+    await db.review_stats.update_one(
+        {"vehicleId": vehicle_id},
+        {"$inc": inc, "$set": {"updatedAt": datetime.utcnow()}}
+    )
+
+
+async def get_review_stats(db: AsyncIOMotorDatabase, vehicle_id: str) -> dict:
+    stats = await db.review_stats.find_one({"vehicleId": vehicle_id}, {"_id": 0})
+    if stats is None:
+        stats = (await rebuild_review_stats(db, vehicle_id)).get(vehicle_id) or empty_stats(vehicle_id)
+    return stats
+
+
+async def rebuild_review_stats(db: AsyncIOMotorDatabase, vehicle_id: str = None) -> dict:
+    """Recompute stats from the reviews (one vehicle, or all when vehicle_id is None); returns vehicleId -> stats"""
+    query = {"vehicleId": vehicle_id} if vehicle_id else {}
+    rebuilt = {vehicle_id: empty_stats(vehicle_id)} if vehicle_id else {}
+    async for review in db.reviews.find(query, {"_id": 0, "vehicleId": 1, "rating": 1}):
+        stats = rebuilt.setdefault(review["vehicleId"], empty_stats(review["vehicleId"]))
+        stats["count"] += 1
+        stats["sum"] += review["rating"]
+        stats["histogram"][str(review["rating"])] += 1
+
+    if not vehicle_id:
+        # Vehicles whose reviews are all gone
+        async for stale in db.review_stats.find({}, {"_id": 0, "vehicleId": 1}):
+            rebuilt.setdefault(stale["vehicleId"], empty_stats(stale["vehicleId"]))
+
+    for vid, stats in rebuilt.items():
+        fields = {k: v for k, v in stats.items() if k != "vehicleId"}
+        await db.review_stats.update_one({"vehicleId": vid}, {"$set": fields}, upsert=True)
+    return rebuilt
+
+
+def stats_summary(stats: dict) -> dict:
+    """averageRating / totalReviews / ratingDistribution (non-empty buckets) for VehicleReviewStats"""
+    count = stats.get("count", 0)
+    return {
+        "vehicleId": stats["vehicleId"],
+        "averageRating": round(stats.get("sum", 0) / count, 1) if count > 0 else 0.0,
+        "totalReviews": count,
+        "ratingDistribution": {r: n for r, n in stats.get("histogram", {}).items() if n > 0},
+    }
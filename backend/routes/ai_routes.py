@@ -1,6 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Body
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Body, Response
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from pydantic import BaseModel
 import random
 import asyncio
@@ -8,12 +10,21 @@ import json
 import os
 from pathlib import Path
 import httpx
-import base64
 import re
 import difflib
-
-
-from dependencies import get_db
+from datetime import datetime
+
+
+from dependencies import get_db, get_admin_user, get_current_user
+from gemini_client import get_gemini_client, gemini_url, gemini_context_cache, request_body, Base64Blob
+from llm_cache import llm_cache, single_flight, make_cache_key
+from catalog_context import catalog_context
+from resilience import gemini_guard, UpstreamUnavailable
+from deadlines import Deadline, hedger, FALLBACK_FLOOR
+from generation_profiles import get_generation_config, CONTEXT_TOKEN_BUDGETS
+from image_pipeline import prepare_image, image_pipeline_stats
+from phash_cache import snap_phash_cache, SNAP_PHASH_MIN_CONFIDENCE
+from job_queue import ai_job_queue, job_to_response, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, FINISHED_STATUSES, AI_JOB_TIMEOUT, check_job_access
 from models import VehicleResponse
 
 router = APIRouter(prefix="/ai", tags=["ai"])
@@ -57,37 +68,26 @@ def slugify(text: str) -> str:
 def get_gemini_api_key():
     return _get_api_key_from_env()
 
-async def find_vehicle_in_db(brand: str, model: str, db: AsyncIOMotorDatabase):
+# Helper to clean model of generic terms for better matching
+GENERIC_TERMS = {"model", "series", "class", "generation", "long", "range", "performance", "awd", "rwd", "fwd", "phev", "hybrid", "electric", "ev"}
+
+def get_core_model_tokens(m_str):
+    # Split by non-alphanumeric to handle "C-Class", "E-200" etc.
+    raw_tokens = re.split(r'[^a-zA-Z0-9]+', m_str.lower())
+    tokens = [t for t in raw_tokens if t and t not in GENERIC_TERMS]
+    return tokens
+
+def _brand_key(brand: str) -> str:
+    """First word of the brand, used to pick same-brand candidates"""
+    return brand.lower().strip().split('-')[0].split(' ')[0]
+
+def _best_fuzzy_match(model: str, candidates: list):
     """
-    Robustly find a vehicle in the database using multiple matching strategies.
-    Uses fuzzy logic and filters generic car terms to avoid false positives.
+    Pick the best same-brand candidate for a model name.
+    Returns None when nothing scores above the match threshold.
     """
-    brand_clean = brand.lower().strip()
     model_clean = model.lower().strip()
-    
-    # 1. Direct Slug Match (Fastest & most accurate)
-    target_slug = slugify(f"{brand} {model}")
-    matched = await db.vehicles.find_one({"slug": target_slug})
-    if matched: return matched
-    
-    # Helper to clean model of generic terms for better matching
-    GENERIC_TERMS = {"model", "series", "class", "generation", "long", "range", "performance", "awd", "rwd", "fwd", "phev", "hybrid", "electric", "ev"}
-    def get_core_model_tokens(m_str):
-        # Split by non-alphanumeric to handle "C-Class", "E-200" etc.
-        raw_tokens = re.split(r'[^a-zA-Z0-9]+', m_str.lower())
-        tokens = [t for t in raw_tokens if t and t not in GENERIC_TERMS]
-        return tokens
-
     core_tokens = get_core_model_tokens(model_clean)
-    
-    # 2. Advanced Similarity Search
-    # Fetch all candidates from the same brand
-    brand_regex = f"^{brand_clean.split('-')[0].split(' ')[0]}$"
-    cursor = db.vehicles.find({"brand": {"$regex": brand_regex, "$options": "i"}})
-    candidates = await cursor.to_list(length=100)
-    
-    if not candidates:
-        return None
 
     best_v = None
     max_score = 0.0
@@ -128,6 +128,70 @@ async def find_vehicle_in_db(brand: str, model: str, db: AsyncIOMotorDatabase):
                 
     return None
 
+async def find_vehicle_in_db(brand: str, model: str, db: AsyncIOMotorDatabase):
+    """
+    Robustly find a vehicle in the database using multiple matching strategies.
+    Uses fuzzy logic and filters generic car terms to avoid false positives.
+    """
+    # 1. Direct Slug Match (Fastest & most accurate)
+    target_slug = slugify(f"{brand} {model}")
+    matched = await db.vehicles.find_one({"slug": target_slug})
+    if matched: return matched
+    
+    # 2. Advanced Similarity Search
+    # Fetch all candidates from the same brand
+    brand_regex = f"^{_brand_key(brand)}$"
+    cursor = db.vehicles.find({"brand": {"$regex": brand_regex, "$options": "i"}})
+    candidates = await cursor.to_list(length=100)
+    
+    if not candidates:
+        return None
+
+    return _best_fuzzy_match(model, candidates)
+
+async def find_vehicles_in_db(pairs: List[Tuple[str, str]], db: AsyncIOMotorDatabase) -> List[Optional[dict]]:
+    """
+    Batch version of find_vehicle_in_db.
+    Resolves every (brand, model) pair with a single query and returns
+    the matches aligned with the input (None where nothing matched).
+    """
+    pairs = [(b or "", m or "") for b, m in pairs]
+    if not pairs:
+        return []
+
+    slugs = list({slugify(f"{b} {m}") for b, m in pairs})
+    brand_keys = sorted({_brand_key(b) for b, _ in pairs if _brand_key(b)})
+
+    query = {"slug": {"$in": slugs}}
+    if brand_keys:
+        brand_regex = "^(" + "|".join(re.escape(k) for k in brand_keys) + ")$"
+        query = {"$or": [query, {"brand": {"$regex": brand_regex, "$options": "i"}}]}
+
+    candidates = await db.vehicles.find(query).to_list(length=100 * (len(brand_keys) + 1))
+
+    by_slug = {}
+    by_brand = {}
+    for v in candidates:
+        if v.get("slug"):
+            by_slug.setdefault(v["slug"], v)
+        by_brand.setdefault(v.get("brand", "").lower(), []).append(v)
+
+    results = []
+    for brand, model in pairs:
+        matched = by_slug.get(slugify(f"{brand} {model}"))
+        if not matched:
+            matched = _best_fuzzy_match(model, by_brand.get(_brand_key(brand), []))
+        results.append(matched)
+    return results
+
+async def get_vehicles_by_ids(ids: List[str], db: AsyncIOMotorDatabase) -> List[Optional[dict]]:
+    """Fetch vehicles with one $in query, aligned with the given ids"""
+    if not ids:
+        return []
+    vehicles = await db.vehicles.find({"id": {"$in": list(set(ids))}}).to_list(length=len(ids))
+    by_id = {v["id"]: v for v in vehicles}
+    return [by_id.get(vid) for vid in ids]
+
 # --- UTILS ---
 def clean_json_string(text: str) -> str:
     """
@@ -152,72 +216,254 @@ def clean_json_string(text: str) -> str:
         
     return text
 
+
+def parse_json_response(text: str) -> dict:
+    """
+    Structured profiles return bare JSON (responseMimeType); clean_json_string
+    is only a fallback for answers that still arrive fenced or wrapped.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(clean_json_string(text))
+
 # --- GEMINI REST CLIENT ---
 # Using stable Gemini 1.5 Flash for high reliability and speed
 TARGET_MODEL = "models/gemini-2.5-flash" 
 
-async def call_gemini_rest(contents: list, api_key: str, system_instruction: str = None) -> str:
-    """
-    Direct REST call to Gemini API using httpx.
-    """
-    url = f"https://generativelanguage.googleapis.com/v1beta/{TARGET_MODEL}:generateContent?key={api_key}"
-    
+# Per-endpoint generationConfig lives in generation_profiles
+GENERATION_CONFIG = get_generation_config("default")
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
+]
+
+def build_gemini_payload(contents: list, system_instruction: str = None, cached_content: str = None, generation_config: dict = None) -> dict:
     payload = {
         "contents": contents,
-        "generationConfig": {
-            "temperature": 0.4,
-            "maxOutputTokens": 8192,
-            "topP": 0.8,
-            "topK": 40
-        },
-        "safetySettings": [
-            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
-        ]
+        "generationConfig": generation_config or GENERATION_CONFIG,
+        "safetySettings": SAFETY_SETTINGS
     }
 
-    if system_instruction:
+    if cached_content:
+        # System instruction already lives in the cached context
+        payload["cachedContent"] = cached_content
+    elif system_instruction:
         payload["system_instruction"] = {
             "parts": [{"text": system_instruction}]
         }
+    return payload
 
-    async with httpx.AsyncClient() as client:
-        try:
-            print(f"DEBUG: Calling Gemini REST: {url.split('?')[0]}...")
-            response = await client.post(
-                url, 
-                json=payload,
-                headers={"Content-Type": "application/json"},
-                timeout=30.0
-            )
+
+async def resolve_cached_context(context_slot: str, system_instruction: str, api_key: str) -> Optional[str]:
+    """Name of the Gemini cached context holding system_instruction, or None to send it inline"""
+    if not context_slot or not system_instruction:
+        return None
+    return await gemini_context_cache.get_name(context_slot, TARGET_MODEL, system_instruction, api_key)
+
+
+def is_cached_context_error(status_code: int) -> bool:
+    """Expired / deleted cached contexts come back as 4xx; retry those inline"""
+    return status_code in (400, 403, 404)
+
+
+async def call_gemini_rest(contents: list, api_key: str, system_instruction: str = None, cache: bool = False, context_slot: str = None, deadline: Deadline = None, hedge: bool = False, profile: str = "default") -> str:
+    """
+    Direct REST call to Gemini API using the shared httpx client.
+    Concurrent identical calls share one upstream request (single-flight).
+    With cache=True, identical prompts are answered from the LLM response cache.
+    With context_slot, the system instruction is sent once as a Gemini cached
+    context and referenced by name afterwards.
+    Raises UpstreamUnavailable (503) without calling Gemini while the circuit
+    breaker is open or the concurrency limit is reached.
+    With a deadline, the HTTP timeout and the wait are capped by the endpoint's
+    remaining budget (asyncio.TimeoutError when it runs out); hedge=True sends a
+    second request once the endpoint's p95 latency has passed. Each request,
+    the hedge included, takes its own guard slot.
+    profile selects the generation profile (output cap, temperature, JSON schema).
+    """
+    generation_config = get_generation_config(profile)
+    cache_key = make_cache_key(TARGET_MODEL, system_instruction, contents, generation_config)
+    if cache:
+        cached = await llm_cache.get(cache_key)
+        if cached is not None:
+            print("DEBUG: Gemini response served from cache")
+            return cached
+
+    async def attempt():
+        async with gemini_guard.call():
+            cached_content = await resolve_cached_context(context_slot, system_instruction, api_key)
+            try:
+                return await _post_generate_content(contents, api_key, system_instruction, cached_content, deadline, generation_config)
+            except HTTPException as e:
+                if not cached_content or not is_cached_context_error(e.status_code):
+                    raise
+                print(f"WARNING: Cached context {cached_content} rejected, retrying inline")
+                gemini_context_cache.invalidate(context_slot)
+                return await _post_generate_content(contents, api_key, system_instruction, deadline=deadline, generation_config=generation_config)
+
+    async def fetch():
+        text = await hedger.run(deadline.name if deadline else None, attempt, deadline, hedge)
+        if cache and text:
+            await llm_cache.set(cache_key, text)
+        return text
+
+    if deadline:
+        # Only this caller stops waiting; a shared in-flight call keeps running for the others
+        return await deadline.run(single_flight.do(cache_key, fetch))
+    return await single_flight.do(cache_key, fetch)
+
+
+async def _post_generate_content(contents: list, api_key: str, system_instruction: str = None, cached_content: str = None, deadline: Deadline = None, generation_config: dict = None) -> str:
+    url = gemini_url(f"{TARGET_MODEL}:generateContent?key={api_key}")
+    payload = build_gemini_payload(contents, system_instruction, cached_content, generation_config)
+
+    client = get_gemini_client()
+    try:
+        print(f"DEBUG: Calling Gemini REST: {url.split('?')[0]}...")
+        timeout = deadline.httpx_timeout() if deadline else httpx.USE_CLIENT_DEFAULT
+        response = await client.post(url, timeout=timeout, **request_body(payload))
+        
+        if response.status_code != 200:
+            print(f"ERROR: Gemini API returned {response.status_code}")
+            print(f"Response Body: {response.text}")
+            raise HTTPException(status_code=response.status_code, detail=f"Gemini API Error: {response.text}")
+
+        data = response.json()
+        # Extract text
+        if "candidates" in data and len(data["candidates"]) > 0:
+            candidate = data["candidates"][0]
+            finish_reason = candidate.get("finishReason")
+            if finish_reason and finish_reason != "STOP":
+                print(f"WARNING: Gemini Finish Reason: {finish_reason}")
             
-            if response.status_code != 200:
-                print(f"ERROR: Gemini API returned {response.status_code}")
-                print(f"Response Body: {response.text}")
-                raise HTTPException(status_code=response.status_code, detail=f"Gemini API Error: {response.text}")
-
-            data = response.json()
-            # Extract text
-            if "candidates" in data and len(data["candidates"]) > 0:
-                candidate = data["candidates"][0]
-                finish_reason = candidate.get("finishReason")
-                if finish_reason and finish_reason != "STOP":
-                    print(f"WARNING: Gemini Finish Reason: {finish_reason}")
-                
-                parts = candidate["content"]["parts"]
-                text = "".join([part.get("text", "") for part in parts])
-                return text
-            else:
-                 print(f"ERROR: No candidates in response: {data}")
-                 return ""
+            parts = candidate["content"]["parts"]
+            text = "".join([part.get("text", "") for part in parts])
+            return text
+        else:
+             print(f"ERROR: No candidates in response: {data}")
+             return ""
+
+    except Exception as e:
+        print(f"EXCEPTION in call_gemini_rest: {e}")
+        import traceback
+        traceback.print_exc()
+        raise e
 
+
+def _candidate_text(data: dict) -> str:
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return "".join([part.get("text", "") for part in parts])
+
+
+async def stream_gemini_rest(contents: list, api_key: str, system_instruction: str = None, cache: bool = False, context_slot: str = None, deadline: Deadline = None, profile: str = "default"):
+    """
+    Streaming REST call (streamGenerateContent, SSE). Yields text chunks as they
+    arrive. With cache=True a cached answer is replayed as a single chunk and
+    the full text is written to the LLM response cache at the end.
+    context_slot, the upstream guard, deadline and profile work as in
+    call_gemini_rest; the guard judges the stream by its time to first chunk,
+    and the deadline bounds the whole stream (asyncio.TimeoutError), not just
+    each read.
+    """
+    generation_config = get_generation_config(profile)
+    cache_key = make_cache_key(TARGET_MODEL, system_instruction, contents, generation_config)
+    if cache:
+        cached = await llm_cache.get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+
+    chunks = []
+    async with gemini_guard.call() as timing:
+        cached_content = await resolve_cached_context(context_slot, system_instruction, api_key)
+        try:
+            async for text in within_deadline(_stream_generate_content(contents, api_key, system_instruction, cached_content, deadline, generation_config), deadline):
+                timing.first_chunk()
+                chunks.append(text)
+                yield text
+        except HTTPException as e:
+            # Status errors are raised before the first chunk, so retrying inline is safe
+            if chunks or not cached_content or not is_cached_context_error(e.status_code):
+                raise
+            print(f"WARNING: Cached context {cached_content} rejected, retrying inline")
+            gemini_context_cache.invalidate(context_slot)
+            async for text in within_deadline(_stream_generate_content(contents, api_key, system_instruction, deadline=deadline, generation_config=generation_config), deadline):
+                timing.first_chunk()
+                chunks.append(text)
+                yield text
+
+    full_text = "".join(chunks)
+    if cache and full_text:
+        await llm_cache.set(cache_key, full_text)
+
+
+async def within_deadline(chunks, deadline: Deadline = None):
+    """
+    Re-yield an async generator's items until the deadline passes, then raise
+    asyncio.TimeoutError. The per-read HTTP timeout alone lets a slow trickle of
+    chunks run past the budget. The generator is drained in its own task, so an
+    abandoned stream is cancelled and closed there.
+    """
+    if deadline is None:
+        async for item in chunks:
+            yield item
+        return
+
+    queue = asyncio.Queue(maxsize=1)
+
+    async def pump():
+        try:
+            async for item in chunks:
+                await queue.put(("item", item))
+            await queue.put(("end", None))
         except Exception as e:
-            print(f"EXCEPTION in call_gemini_rest: {e}")
-            import traceback
-            traceback.print_exc()
-            raise e
+            await queue.put(("error", e))
+        finally:
+            await chunks.aclose()
+
+    task = asyncio.ensure_future(pump())
+    try:
+        while True:
+            kind, value = await deadline.run(queue.get())
+            if kind == "error":
+                raise value
+            if kind == "end":
+                return
+            yield value
+    finally:
+        task.cancel()
+
+
+async def _stream_generate_content(contents: list, api_key: str, system_instruction: str = None, cached_content: str = None, deadline: Deadline = None, generation_config: dict = None):
+    url = gemini_url(f"{TARGET_MODEL}:streamGenerateContent?alt=sse&key={api_key}")
+    payload = build_gemini_payload(contents, system_instruction, cached_content, generation_config)
+
+    client = get_gemini_client()
+    print(f"DEBUG: Streaming Gemini REST: {url.split('?')[0]}...")
+    timeout = deadline.httpx_timeout() if deadline else httpx.USE_CLIENT_DEFAULT
+    async with client.stream("POST", url, timeout=timeout, **request_body(payload)) as response:
+        if response.status_code != 200:
+            body = (await response.aread()).decode("utf-8", errors="replace")
+            print(f"ERROR: Gemini stream returned {response.status_code}: {body}")
+            raise HTTPException(status_code=response.status_code, detail=f"Gemini API Error: {body}")
+
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            try:
+                data = json.loads(line[len("data:"):].strip())
+            except json.JSONDecodeError:
+                continue
+            text = _candidate_text(data)
+            if text:
+                yield text
 
 
 # Helper function
@@ -240,19 +486,15 @@ async def recommend_vehicles(
     request: AIRecommendationRequest = Body(...),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
+    deadline = Deadline.for_endpoint("recommend")
     api_key = get_gemini_api_key()
     if not api_key:
         return await heuristic_recommend(request.query, db)
 
     try:
-        # 1. Fetch simplified vehicle list
-        cursor = db.vehicles.find({})
-        vehicles = await cursor.to_list(length=50) # Limit context
-        
-        vehicle_context = "\n".join([
-            f"- {v.get('brand')} {v.get('model')} ({v.get('year')}): {v.get('price')} TL, {v.get('engine', {}).get('fuel')}, {v.get('engine', {}).get('transmission')}" 
-            for v in vehicles
-        ])
+        # 1. Simplified vehicle list: the catalog entries most relevant to the query (BM25)
+        catalog = await catalog_context.get_snapshot(db)
+        vehicle_context = catalog.recommend_text_for(request.query, max_tokens=CONTEXT_TOKEN_BUDGETS["recommend"])
 
         system_instruction = "Sen OTORITE AI, uzman bir otomobil danışmanısın. Verilen araç listesinden kullanıcının isteğine en uygun 3 aracı seç ve JSON formatında döndür."
         
@@ -273,28 +515,19 @@ async def recommend_vehicles(
         """
         
         contents = [{"role": "user", "parts": [{"text": prompt}]}]
-        response_text = await call_gemini_rest(contents, api_key, system_instruction)
-        
-        # Parse JSON
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0]
-        elif "```" in response_text:
-             response_text = response_text.split("```")[1].split("```")[0]
-             
-        data = json.loads(response_text)
+        response_text = await call_gemini_rest(contents, api_key, system_instruction, deadline=deadline, hedge=True, profile="recommend")
+        data = parse_json_response(response_text)
         
         # Fetch full objects
+        recs = data.get("recommendations", [])
+        matches = await find_vehicles_in_db([(rec.get("brand"), rec.get("model")) for rec in recs], db)
         recommended_vehicles = []
-        for rec in data.get("recommendations", []):
-            vehicle = await db.vehicles.find_one({
-                "brand": rec["brand"], 
-                "model": rec["model"]
-            })
-            if vehicle:
+        for vehicle in matches:
+            if vehicle and vehicle not in recommended_vehicles:
                 recommended_vehicles.append(vehicle)
                 
         if not recommended_vehicles:
-             return await heuristic_recommend(request.query, db)
+             return await heuristic_recommend(request.query, db, deadline)
 
         return AIRecommendationResponse(
             vehicles=[vehicle_to_response(v) for v in recommended_vehicles],
@@ -303,15 +536,15 @@ async def recommend_vehicles(
 
     except Exception as e:
         print(f"Recommend Error: {e}")
-        return await heuristic_recommend(request.query, db)
+        return await heuristic_recommend(request.query, db, deadline)
 
 
 # === IDENTIFY (VISION) ===
 # Note: Identify logic is heavy, keeping simplified for now or need to send image bytes
 @router.post("/identify")
-async def identify_vehicle(file: UploadFile = File(...), db: AsyncIOMotorDatabase = Depends(get_db)):
+async def identify_vehicle(response: Response, file: UploadFile = File(...), db: AsyncIOMotorDatabase = Depends(get_db)):
     # ... legacy implementation mostly, let's focus on chat/snap ...
-    return await snap_identify(file)
+    return await snap_identify(response, file)
 
 
 # === CHAT ===
@@ -324,26 +557,25 @@ class AIChatResponse(BaseModel):
     response: str
     recommendations: Optional[List[dict]] = None
 
-@router.post("/chat", response_model=AIChatResponse)
-async def chat_consultant(
-    request: AIChatRequest = Body(...),
-    db: AsyncIOMotorDatabase = Depends(get_db)
-):
-    print(f"--- CHAT REQUEST (REST): {request.message} ---")
-    
-    api_key = get_gemini_api_key()
-    if not api_key:
-        return AIChatResponse(response="Sistem Hatası: API Anahtarı bulunamadı.")
 
-    try:
-        if request.garageContext:
-            print(f"DEBUG: Using Garage Context with {len(request.garageContext)} vehicles")
-            # Format user's garage
-            user_garage_str = "\n".join([
-                f"- {v.get('brand')} {v.get('model')} ({v.get('year')}) - {v.get('fuelType', '')}" 
-                for v in request.garageContext
-            ])
-            garage_instruction = f"""
+async def build_chat_contents(request: AIChatRequest, db: AsyncIOMotorDatabase) -> list:
+    """
+    User turn for the chat: the catalog vehicles relevant to the message (and the
+    user's garage), the garage itself, then the message. Keeping these out of the
+    system instruction lets it stay identical for every user. The instruction
+    alone is well below Gemini's minimum cacheable size, so chat sends it inline
+    rather than through a context slot.
+    """
+    retrieval_query = request.message
+    garage_instruction = ""
+    if request.garageContext:
+        print(f"DEBUG: Using Garage Context with {len(request.garageContext)} vehicles")
+        # Format user's garage
+        user_garage_str = "\n".join([
+            f"- {v.get('brand')} {v.get('model')} ({v.get('year')}) - {v.get('fuelType', '')}" 
+            for v in request.garageContext
+        ])
+        garage_instruction = f"""
 ========================
 KULLANICININ GARAJI (Sorular bu araçlarla ilgili olabilir)
 ========================
@@ -351,31 +583,36 @@ KULLANICININ GARAJI (Sorular bu araçlarla ilgili olabilir)
 
 Eğer kullanıcı "Arabam", "Aracım" veya spesifik bir modelden (örn: "BMW'm") bahsederse, yukarıdaki listedeki ilgili aracı baz al.
 """
-        else:
-            garage_instruction = ""
+        retrieval_query += " " + " ".join(f"{v.get('brand', '')} {v.get('model', '')}" for v in request.garageContext)
 
-        # Fetch catalog for general knowledge
-        cursor = db.vehicles.find({})
-        db_vehicles = await cursor.to_list(length=50) # Reduced for performance
-        vehicle_catalog = "\n".join([
-            f"- {v.get('brand')} {v.get('model')} (Slug: {v.get('slug')})"
-            for v in db_vehicles
-        ])
+    # Catalog for general knowledge (pre-rendered, BM25-selected for this message)
+    catalog = await catalog_context.get_snapshot(db)
+    vehicle_catalog = catalog.chat_text_for(retrieval_query, max_tokens=CONTEXT_TOKEN_BUDGETS["chat"])
+    catalog_instruction = f"""
+========================
+VERİTABANIMIZDAKİ ARAÇLAR (Referans)
+========================
+{vehicle_catalog}
+"""
 
-        system_instruction = f"""
+    parts = [{"text": catalog_instruction}]
+    if garage_instruction:
+        parts.append({"text": garage_instruction})
+    parts.append({"text": request.message})
+    return [{"role": "user", "parts": parts}]
+
+
+CHAT_UNAVAILABLE_MESSAGE = "Yapay zeka danışmanı şu an yoğun. Lütfen birazdan tekrar deneyin."
+
+# Chat persona + rules (same for every user and every catalog version)
+CHAT_SYSTEM_INSTRUCTION = """
 SEN BİR CHAT BOT DEĞİLSİN.
 SEN OTORITE SİTESİNİN DİJİTAL OTOMOBİL DANIŞMANISIN.
-{garage_instruction}
 
 KISMİ, EKSİK, YARIM CEVAP VEREMEZSİN.
 TEK MODEL YAZIP DURAMAZSIN.
 MADDEYİ YARIDA KESERSEN BU BİR HATADIR.
 
-========================
-VERİTABANIMIZDAKİ ARAÇLAR (Referans)
-========================
-{vehicle_catalog}
-
 ========================
 GENEL KURAL
 ========================
@@ -387,10 +624,10 @@ TEK SATIRLIK CEVAP YASAK. SADECE MODEL ADI YAZMAK YASAK.
 ========================
 VERİTABANI ÖNCELİĞİ (existsInDB)
 ========================
-Eğer önerdiğin araç yukarıdaki veritabanı listesinde VARSA:
+Eğer önerdiğin araç mesajla birlikte verilen veritabanı listesinde VARSA:
 → ŞUNU YAZ: “Bu araç OTORITE’de incelenmiştir”
 → PUANI DB’DEN GÖSTER
-→ LİNK VER: /vehicles/{{slug}}
+→ LİNK VER: /vehicles/{slug}
 
 Eğer veritabanında YOKSA:
 → “Henüz editör incelemesi yok” DE ve TAHMİNİ puan ver.
@@ -417,34 +654,83 @@ EĞER CEVAP çok kısa olduysa veya linkler eksikse BU BİR HATADIR.
 Görevin KULLANICIYI DOĞRU ARACIN İNCELEMESİNE GÖTÜRMEK yani bir “yönlendirme makinesi” olmaktır.
 Türkçe konuş.
 """
+
+
+def is_truncated_answer(response_text: str) -> bool:
+    """Check for truncation indicators: ends with bullet, number, conjunction, or doesn't end with punctuation"""
+    return (
+        response_text.strip().endswith(("*", "-", "1.", "2.", "3.", "ve", "veya", "olun", "arasında", ":", ",")) or
+        not any(response_text.strip().endswith(p) for p in (".", "!", "?", "...", ")"))
+    )
+
+
+def build_continuation_contents(contents: list, response_text: str) -> list:
+    continuation_prompt = f"Cevabın yarıda kesildi. Lütfen kaldığın yerden ('{response_text.strip()[-30:]}') başlayarak hiçbir şeyi tekrarlamadan sadece mesajın kalanını tamamla."
+    
+    # Append context for continuation
+    return contents + [
+        {"role": "model", "parts": [{"text": response_text}]},
+        {"role": "user", "parts": [{"text": continuation_prompt}]}
+    ]
+
+
+async def extract_chat_cards(response_text: str, db: AsyncIOMotorDatabase) -> List[dict]:
+    """Extract vehicles mentioned in the answer and turn them into DB cards"""
+    recommendations = []
+    try:
+        # We fetch all vehicles to cross-reference
+        # In a real app, we'd use more efficient NLP, but for MVP we match tokens
+        cursor = db.vehicles.find({})
+        all_vehicles = await cursor.to_list(length=100)
         
-        contents = [{
-            "role": "user", 
-            "parts": [{"text": request.message}]
-        }]
+        for v in all_vehicles:
+            v_name = f"{v.get('brand')} {v.get('model')}".lower()
+            # If AI response contains the car name, add to cards
+            if v_name in response_text.lower() or (v.get('model').lower() in response_text.lower() and len(v.get('model')) > 3):
+                recommendations.append({
+                    "brand": v.get("brand"),
+                    "model": v.get("model"),
+                    "slug": v.get("slug"),
+                    "image": v.get("image"),
+                    "year": v.get("year"),
+                    "overallScore": v.get("scores", {}).get("overall", {}).get("score", 0)
+                })
+                if len(recommendations) >= 4: break # Limit cards
+    except Exception as e:
+        print(f"Card Fetch Error: {e}")
+    return recommendations
+
+
+@router.post("/chat", response_model=AIChatResponse)
+async def chat_consultant(
+    request: AIChatRequest = Body(...),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    print(f"--- CHAT REQUEST (REST): {request.message} ---")
+    deadline = Deadline.for_endpoint("chat")
+    
+    api_key = get_gemini_api_key()
+    if not api_key:
+        return AIChatResponse(response="Sistem Hatası: API Anahtarı bulunamadı.")
+
+    try:
+        system_instruction = CHAT_SYSTEM_INSTRUCTION
+        contents = await build_chat_contents(request, db)
         
         # --- ROBUST FIX: Multi-Pass Completion Loop ---
-        response_text = await call_gemini_rest(contents, api_key, system_instruction)
+        response_text = await call_gemini_rest(contents, api_key, system_instruction, deadline=deadline, profile="chat")
         
         max_retries = 2
         for _ in range(max_retries):
-            # Check for truncation indicators: ends with bullet, number, conjunction, or doesn't end with punctuation
-            is_truncated = (
-                response_text.strip().endswith(("*", "-", "1.", "2.", "3.", "ve", "veya", "olun", "arasında", ":", ",")) or
-                not any(response_text.strip().endswith(p) for p in (".", "!", "?", "...", ")"))
-            )
-            
-            if is_truncated:
+            if is_truncated_answer(response_text) and not deadline.expired:
                 print(f"DEBUG: Truncation detected at: '{response_text.strip()[-10:]}'. Requesting continuation...")
-                continuation_prompt = f"Cevabın yarıda kesildi. Lütfen kaldığın yerden ('{response_text.strip()[-30:]}') başlayarak hiçbir şeyi tekrarlamadan sadece mesajın kalanını tamamla."
-                
-                # Append context for continuation
-                continuation_contents = contents + [
-                    {"role": "model", "parts": [{"text": response_text}]},
-                    {"role": "user", "parts": [{"text": continuation_prompt}]}
-                ]
+                continuation_contents = build_continuation_contents(contents, response_text)
                 
-                continuation_text = await call_gemini_rest(continuation_contents, api_key, system_instruction)
+                try:
+                    continuation_text = await call_gemini_rest(continuation_contents, api_key, system_instruction, deadline=deadline, profile="chat")
+                except (UpstreamUnavailable, asyncio.TimeoutError):
+                    # Keep the partial answer rather than failing the whole turn
+                    break
                 if continuation_text:
                     response_text = response_text.strip() + " " + continuation_text.strip()
                 else:
@@ -453,30 +739,13 @@ Türkçe konuş.
                 break
 
         # --- FEATURE: Extract Mentions & Fetch DB Cards ---
-        recommendations = []
-        try:
-            # We fetch all vehicles to cross-reference
-            # In a real app, we'd use more efficient NLP, but for MVP we match tokens
-            cursor = db.vehicles.find({})
-            all_vehicles = await cursor.to_list(length=100)
-            
-            for v in all_vehicles:
-                v_name = f"{v.get('brand')} {v.get('model')}".lower()
-                # If AI response contains the car name, add to cards
-                if v_name in response_text.lower() or (v.get('model').lower() in response_text.lower() and len(v.get('model')) > 3):
-                    recommendations.append({
-                        "brand": v.get("brand"),
-                        "model": v.get("model"),
-                        "slug": v.get("slug"),
-                        "image": v.get("image"),
-                        "year": v.get("year"),
-                        "overallScore": v.get("scores", {}).get("overall", {}).get("score", 0)
-                    })
-                    if len(recommendations) >= 4: break # Limit cards
-        except Exception as e:
-            print(f"Card Fetch Error: {e}")
+        recommendations = await extract_chat_cards(response_text, db)
 
         return AIChatResponse(response=response_text, recommendations=recommendations)
+
+    except (UpstreamUnavailable, asyncio.TimeoutError) as e:
+        print(f"Chat: Gemini unavailable ({e!r}), failing fast")
+        return AIChatResponse(response=CHAT_UNAVAILABLE_MESSAGE)
         
     except Exception as e:
         import traceback
@@ -484,28 +753,90 @@ Türkçe konuş.
         return AIChatResponse(response=f"HATA: {str(e)}")
 
 
+def sse_event(data: dict, event: str = None) -> str:
+    """Format one Server-Sent Events frame"""
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+@router.post("/chat/stream")
+async def chat_consultant_stream(
+    request: AIChatRequest = Body(...),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Streaming variant of /chat. Emits `data: {"text": ...}` chunks as Gemini
+    generates them, then an `event: done` frame carrying the vehicle cards.
+    """
+    print(f"--- CHAT STREAM REQUEST: {request.message} ---")
+    deadline = Deadline.for_endpoint("chat")
+    api_key = get_gemini_api_key()
+
+    async def events():
+        if not api_key:
+            yield sse_event({"text": "Sistem Hatası: API Anahtarı bulunamadı."})
+            yield sse_event({"recommendations": []}, event="done")
+            return
+        try:
+            system_instruction = CHAT_SYSTEM_INSTRUCTION
+            contents = await build_chat_contents(request, db)
+
+            response_text = ""
+            async for chunk in stream_gemini_rest(contents, api_key, system_instruction, deadline=deadline, profile="chat"):
+                response_text += chunk
+                yield sse_event({"text": chunk})
+
+            # Same multi-pass completion as /chat, streamed as it arrives
+            for _ in range(2):
+                if not is_truncated_answer(response_text) or deadline.expired:
+                    break
+                continuation_contents = build_continuation_contents(contents, response_text)
+                continuation_text = ""
+                async for chunk in stream_gemini_rest(continuation_contents, api_key, system_instruction, deadline=deadline, profile="chat"):
+                    if not continuation_text:
+                        chunk = " " + chunk.lstrip()
+                    continuation_text += chunk
+                    yield sse_event({"text": chunk})
+                if not continuation_text:
+                    break
+                response_text = response_text.strip() + continuation_text
+
+            recommendations = await extract_chat_cards(response_text, db)
+            yield sse_event({"recommendations": recommendations}, event="done")
+        except (UpstreamUnavailable, httpx.TimeoutException, asyncio.TimeoutError) as e:
+            print(f"Chat Stream: Gemini unavailable ({e!r}), failing fast")
+            yield sse_event({"text": CHAT_UNAVAILABLE_MESSAGE})
+            yield sse_event({"recommendations": []}, event="done")
+        except Exception as e:
+            print(f"Chat Stream Error: {e}")
+            yield sse_event({"detail": f"HATA: {str(e)}"}, event="error")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 
 # === SUMMARY GENERATION ===
 
 class AISummaryRequest(BaseModel):
     vehicle: dict
+    garageVehicleId: Optional[str] = None  # background jobs save the summary to this garage vehicle
 
 class AISummaryResponse(BaseModel):
     summary: str
     highlight: str
 
-@router.post("/generate-summary", response_model=AISummaryResponse)
-async def generate_summary(request: AISummaryRequest):
-    api_key = get_gemini_api_key()
-    if not api_key:
-        return AISummaryResponse(
-            summary="Yapay zeka servisine erişilemiyor. Lütfen manuel açıklama girin.",
-            highlight="Bağlantı Hatası"
-        )
 
-    try:
-        v = request.vehicle
-        vehicle_info = f"""
+def job_accepted(job: dict) -> JSONResponse:
+    """202 answer for a request handed to the background job queue"""
+    return JSONResponse(status_code=202, content=jsonable_encoder(job_to_response(job)))
+
+
+async def build_summary(vehicle: dict, deadline: Deadline, api_key: str) -> AISummaryResponse:
+    v = vehicle
+    vehicle_info = f"""
 Marka: {v.get('brand')}
 Model: {v.get('model')}
 Yıl: {v.get('year')}
@@ -518,7 +849,7 @@ Puan: {v.get('ownerRating')}/10
 Satılık mı: {'Evet' if v.get('isForSale') else 'Hayır'}
 """
 
-        prompt = f"""
+    prompt = f"""
 Aşağıdaki araç verilerine dayanarak Türkçe, etkileyici ve akıcı bir "Garaj Hikayesi/Özeti" yaz.
 Araç sahibinin ağzından yazılmış gibi samimi ama profesyonel olsun.
 Aracın özelliklerini metne yedir.
@@ -532,13 +863,59 @@ ARAÇ BİLGİLERİ:
   "highlight": "Aracın en dikkat çekici özelliği veya durumu (Kısa bir cümle, örn: 'Titizlikle bakılmış bir klasik' veya 'Pist günlerine hazır canavar')"
 }}
 """
-        contents = [{"role": "user", "parts": [{"text": prompt}]}]
-        response_text = await call_gemini_rest(contents, api_key)
-        
-        cleaned_json = clean_json_string(response_text)
-        data = json.loads(cleaned_json)
-        
-        return AISummaryResponse(**data)
+    contents = [{"role": "user", "parts": [{"text": prompt}]}]
+    response_text = await call_gemini_rest(contents, api_key, cache=True, deadline=deadline, hedge=True, profile="summary")
+    data = parse_json_response(response_text)
+    return AISummaryResponse(**data)
+
+
+async def run_summary_job(payload: dict, db: AsyncIOMotorDatabase) -> dict:
+    """Background summary; unlike the endpoint it fails instead of returning placeholder text"""
+    api_key = get_gemini_api_key()
+    if not api_key:
+        raise HTTPException(status_code=503, detail="Yapay zeka servisine erişilemiyor.")
+    request = AISummaryRequest(**payload)
+    result = await build_summary(request.vehicle, Deadline.for_job("summary", AI_JOB_TIMEOUT), api_key)
+    if request.garageVehicleId:
+        await db.garage.update_one(
+            {"id": request.garageVehicleId},
+            {"$set": {"aiSummary": result.summary, "updatedAt": datetime.utcnow()}}
+        )
+    return result.dict()
+
+
+@router.post("/generate-summary", response_model=AISummaryResponse)
+async def generate_summary(
+    request: AISummaryRequest,
+    background: bool = False,
+    current_user: Optional[dict] = Depends(get_current_user),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Garage story for a vehicle. With ?background=true the generation is queued and
+    the job id returned (202); the finished summary is written to the garage
+    vehicle's aiSummary when garageVehicleId is given.
+    """
+    if background:
+        if request.garageVehicleId:
+            garage_vehicle = await db.garage.find_one({"id": request.garageVehicleId})
+            if not garage_vehicle:
+                raise HTTPException(status_code=404, detail="Araç bulunamadı")
+            if not current_user or garage_vehicle["userId"] != current_user["id"]:
+                raise HTTPException(status_code=403, detail="Bu aracı düzenleme yetkiniz yok")
+        job = await ai_job_queue.submit("summary", request.dict(), PRIORITY_LOW, user_id=current_user["id"] if current_user else None)
+        return job_accepted(job)
+
+    deadline = Deadline.for_endpoint("summary")
+    api_key = get_gemini_api_key()
+    if not api_key:
+        return AISummaryResponse(
+            summary="Yapay zeka servisine erişilemiyor. Lütfen manuel açıklama girin.",
+            highlight="Bağlantı Hatası"
+        )
+
+    try:
+        return await build_summary(request.vehicle, deadline, api_key)
         
     except Exception as e:
         print(f"Summary Gen Error: {e}")
@@ -557,16 +934,56 @@ class SnapResponse(BaseModel):
     bodyType: str
     confidence: int
 
+SNAP_MAX_UPLOAD_BYTES = int(os.environ.get("SNAP_MAX_UPLOAD_BYTES", str(15 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+async def read_upload_capped(file: UploadFile, max_bytes: int = SNAP_MAX_UPLOAD_BYTES) -> bytearray:
+    """
+    Read an upload into a single buffer in chunks, rejecting it (413) once it
+    passes max_bytes. Starlette has already spooled the whole body by then, so
+    the cap bounds what is read into memory, not what the client may send.
+    """
+    too_large = f"Görsel çok büyük (en fazla {max_bytes / (1024 * 1024):.3g} MB)."
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(status_code=413, detail=too_large)
+    content = bytearray()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if len(content) + len(chunk) > max_bytes:
+            raise HTTPException(status_code=413, detail=too_large)
+        content += chunk
+    return content
+
+
 @router.post("/snap", response_model=SnapResponse)
-async def snap_identify(file: UploadFile = File(...)):
+async def snap_identify(response: Response, file: UploadFile = File(...)):
+    deadline = Deadline.for_endpoint("snap")
     api_key = get_gemini_api_key()
     if not api_key:
          raise HTTPException(status_code=500, detail="API Key missing")
          
     try:
-        content = await file.read()
-        # Convert to base64
-        b64_image = base64.b64encode(content).decode('utf-8')
+        content = await read_upload_capped(file)
+        # Real MIME type, max edge, re-encode, no EXIF (thread pool)
+        try:
+            image = await prepare_image(content)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        del content  # only the (much smaller) processed image is kept from here on
+        response.headers["X-Image-Bytes-Saved"] = str(image.bytes_saved)
+
+        # Near-duplicate of a photo we already identified?
+        if image.phash is not None:
+            cached = snap_phash_cache.get(image.phash)
+            if cached:
+                data, distance = cached
+                print(f"DEBUG: Snap served from pHash cache (distance {distance})")
+                response.headers["X-Snap-Cache"] = "hit"
+                return SnapResponse(**data)
+
         
         prompt = """
         Analyze this car. Return STRICT JSON:
@@ -585,22 +1002,23 @@ async def snap_identify(file: UploadFile = File(...)):
             "parts": [
                 {"text": prompt},
                 {"inline_data": {
-                    "mime_type": "image/jpeg", # Assuming jpeg for simplicity, or detect
-                    "data": b64_image
+                    "mime_type": image.mime_type,
+                    "data": Base64Blob(image.data)  # base64-encoded while the request streams
                 }}
             ]
         }]
         
-        response_text = await call_gemini_rest(contents, api_key)
-        
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0]
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0]
-            
-        data = json.loads(response_text)
-        return SnapResponse(**data)
+        response_text = await call_gemini_rest(contents, api_key, deadline=deadline, hedge=True, profile="snap")
+        data = parse_json_response(response_text)
+        result = SnapResponse(**data)
+        if image.phash is not None and result.confidence >= SNAP_PHASH_MIN_CONFIDENCE:
+            snap_phash_cache.set(image.phash, result.dict())
+        return result
         
+    except (UpstreamUnavailable, asyncio.TimeoutError):
+        raise HTTPException(status_code=503, detail="Araç tanıma servisi şu an yanıt vermiyor. Lütfen tekrar deneyin.")
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Snap Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -613,6 +1031,7 @@ async def snap_rate(
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     print(f"DEBUG: Snap-Rate Request -> Brand: {brand}, Model: {model}, Gen: {generation}")
+    deadline = Deadline.for_endpoint("snap-rate")
     try:
         # --- 1. SEARCH DATABASE FIRST ---
         matched_vehicle = await find_vehicle_in_db(brand, model, db)
@@ -665,14 +1084,8 @@ async def snap_rate(
         prompt = f"Act as an automotive expert. Rate this car: {full_name}. Return STRICT JSON with: reliability, performance, maintenance, fuelEconomy, userSatisfaction, overallScore, explanation (in Turkish)."
         contents = [{"role": "user", "parts": [{"text": prompt}]}]
         
-        response_text = await call_gemini_rest(contents, api_key)
-        
-        if "```json" in response_text:
-            response_text = response_text.split("```json")[1].split("```")[0]
-        elif "```" in response_text:
-            response_text = response_text.split("```")[1].split("```")[0]
-            
-        data = json.loads(response_text)
+        response_text = await call_gemini_rest(contents, api_key, cache=True, deadline=deadline, hedge=True, profile="snap-rate")
+        data = parse_json_response(response_text)
         data["source"] = "ai"
         data["isExactMatch"] = False
         data["explanation"] = "Bu araç için henüz resmi bir inceleme bulunmuyor. İşte yapay zeka tarafından üretilen tahmini veriler."
@@ -706,10 +1119,24 @@ class WizardRequest(BaseModel):
 @router.post("/wizard")
 async def wizard_recommend(
     request: WizardRequest = Body(...),
+    background: bool = False,
+    current_user: Optional[dict] = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """8 adımlı sihirbaz için AI destekli araç önerisi"""
+    """8 adımlı sihirbaz için AI destekli araç önerisi (?background=true: iş kuyruğuna alınır, 202 + jobId)"""
+    if background:
+        job = await ai_job_queue.submit("wizard", request.dict(), PRIORITY_HIGH, user_id=current_user["id"] if current_user else None)
+        return job_accepted(job)
+    return await build_wizard_recommendation(request, db)
+
+
+async def run_wizard_job(payload: dict, db: AsyncIOMotorDatabase) -> dict:
+    return await build_wizard_recommendation(WizardRequest(**payload), db, Deadline.for_job("wizard", AI_JOB_TIMEOUT))
+
+
+async def build_wizard_recommendation(request: WizardRequest, db: AsyncIOMotorDatabase, deadline: Deadline = None) -> dict:
     print(f"--- WIZARD REQUEST ---")
+    deadline = deadline or Deadline.for_endpoint("wizard")
     
     api_key = get_gemini_api_key()
     if not api_key:
@@ -747,7 +1174,6 @@ KURALLAR:
 ÇOK ÖNEMLİ:
 - SADECE VE SADECE JSON DÖNDÜR.
 - JSON DIŞINDA HİÇBİR AÇIKLAMA, YORUM VEYA METİN YAZMA.
-- CEVABIN ```json İLE BAŞLAYIP ``` İLE BİTSİN.
 
 CEVAP FORMATI (Doğrudan JSON):
 {
@@ -781,29 +1207,24 @@ Sadece JSON döndür.
 """
 
         contents = [{"role": "user", "parts": [{"text": prompt}]}]
-        response_text = await call_gemini_rest(contents, api_key, system_instruction)
+        response_text = await call_gemini_rest(contents, api_key, system_instruction, cache=True, deadline=deadline, hedge=True, profile="wizard")
         
-        # Parse JSON
-        # Robust JSON Parsing
-        cleaned_json = clean_json_string(response_text)
+        # Parse JSON (schema-constrained, repair only as a fallback)
         try:
-            data = json.loads(cleaned_json)
+            data = parse_json_response(response_text)
         except json.JSONDecodeError as je:
             print(f"JSON DECODE ERROR: {je}")
             print(f"Original Text: {response_text}")
-            print(f"Cleaned Text: {cleaned_json}")
             
             # Fallback Retry Strategy could be added here, but for now return a safe error
             raise ValueError("AI yanıtı uygun formatta değildi.")
-            
-        data = json.loads(cleaned_json)
         
-        # Post-Process: Check Database for Matches
-        for rec in data.get("recommendations", []):
+        # Post-Process: Check Database for Matches (one batched lookup)
+        recs = data.get("recommendations", [])
+        db_matches = await find_vehicles_in_db([(rec.get('brand'), rec.get('model')) for rec in recs], db)
+        for rec, db_match in zip(recs, db_matches):
             rec["in_inventory"] = False # Default assumes we don't have it
             
-            db_match = await find_vehicle_in_db(rec.get('brand'), rec.get('model'), db)
-            
             if db_match:
                 print(f"DEBUG: Match Found for {rec.get('brand')} {rec.get('model')} -> {db_match.get('slug')}")
                 rec["in_inventory"] = True
@@ -832,7 +1253,8 @@ Sadece JSON döndür.
         
         try:
             pipeline = [{"$sample": {"size": 3}}]
-            fallback_vehicles = await db.vehicles.aggregate(pipeline).to_list(length=3)
+            # Whatever is left of the budget (at least FALLBACK_FLOOR); the static list below covers a timeout
+            fallback_vehicles = await deadline.run(db.vehicles.aggregate(pipeline).to_list(length=3), floor=FALLBACK_FLOOR)
             
             recommendations = []
             for v in fallback_vehicles:
@@ -898,91 +1320,216 @@ Sadece JSON döndür.
 
 
 # === FALLBACK ===
-async def heuristic_recommend(query: str, db: AsyncIOMotorDatabase):
+async def heuristic_recommend(query: str, db: AsyncIOMotorDatabase, deadline: Deadline = None):
     # Simple fallback logic
     pipeline = [{"$sample": {"size": 3}}]
-    vehicles = await db.vehicles.aggregate(pipeline).to_list(length=3)
+    sample = db.vehicles.aggregate(pipeline).to_list(length=3)
+    vehicles = await (deadline.run(sample, floor=FALLBACK_FLOOR) if deadline else sample)
     return AIRecommendationResponse(
         vehicles=[vehicle_to_response(v) for v in vehicles],
         explanation="Şu anda yapay zeka servisine erişilemiyor (Fallback Mode)."
     )
 
+# Analyst persona used for every comparison
+COMPARE_SYSTEM_INSTRUCTION = """
+        Sen OTORİTE AI, dünyanın en saygın otomobil dergilerinden ve analiz platformlarından biri olan 'Otorite'nin kıdemli kıyaslama uzmanısın.
+        Görevin, sana verilen araç verilerini analiz edip kullanıcıya objektif, teknik temelli ama akıcı bir karşılaştırma raporu sunmaktır.
+        
+        Kullanıcının arasından seçim yapmaya çalıştığı bu araçlar için:
+        1. Araçların temel karakter farklarını belirt (Örn: Biri konfor diğeri sürüş keyfi odaklı).
+        2. Karşılaştırılan kategorilerde (Performans, İç mekan, Teknoloji vb.) kimin önde olduğunu açıkla.
+        3. Farklı kullanıcı profilleri için hangisinin daha mantıklı olduğunu söyle (Aileler için X, gençler için Y gibi).
+        4. Otorite kararı olarak objektif bir tavsiye ver.
+        
+        Yanıtın profesyonel, anlaşılır ve ikna edici olmalı. Markdown formatında başlıklar ve listeler kullanarak şık bir rapor üret.
+        Yalnızca TÜRKÇE cevap ver.
+        """
+
+
+def build_compare_prompt(vehicles: List[dict]) -> str:
+    """Prepare context for AI"""
+    vehicle_details = []
+    for v in vehicles:
+        details = {
+            "name": f"{v.get('brand')} {v.get('model')} ({v.get('year')})",
+            "specs": v.get("specs", {}),
+            "scores": {k: v.get("scores", {}).get(k, {}).get("score") for k in v.get("scores", {})} if v.get("scores") else {},
+            "strengths": v.get("strengths", {}).get("tr", []),
+            "weaknesses": v.get("weaknesses", {}).get("tr", []),
+            "bestFor": v.get("bestFor", {}).get("tr", ""),
+            "verdict": v.get("editorial", {}).get("verdict", {}).get("tr", "")
+        }
+        vehicle_details.append(details)
+
+    return f"Aşağıdaki araçları detaylıca kıyasla ve kullanıcıya hangisini seçmesi gerektiği konusunda rehberlik et:\n\n{json.dumps(vehicle_details, indent=2, ensure_ascii=False)}"
+
+
+def static_compare_analysis(vehicles: List[dict]) -> str:
+    """Fallback: Scrappy heuristic analysis if AI is offline"""
+    v1, v2 = vehicles[0], vehicles[1]
+    analysis = f"### Otorite Karşılaştırma Analizi (Statik Mod)\n\n"
+    analysis += f"**{v1['brand'].upper()} {v1['model']}** ve **{v2['brand'].upper()} {v2['model']}** kıyaslandığında:\n\n"
+    
+    s1 = v1.get("scores", {}).get("overall", {}).get("score", 0)
+    s2 = v2.get("scores", {}).get("overall", {}).get("score", 0)
+    
+    if s1 > s2:
+        analysis += f"- Genel Otorite puanlamasında **{v1['model']}** ({s1}) daha yüksek bir skora sahip.\n"
+    else:
+        analysis += f"- Genel Otorite puanlamasında **{v2['model']}** ({s2}) daha yüksek bir skora sahip.\n"
+    
+    analysis += "\nLütfen teknik tabloyu inceleyerek önceliklerinize göre karar veriniz. AI servisi şu an kısıtlı olduğundan detaylı rapor sunulamıyor."
+    return analysis
+
+
+async def load_compare_vehicles(request: AICompareRequest, db: AsyncIOMotorDatabase) -> List[dict]:
+    if not request.vehicleIds or len(request.vehicleIds) < 2:
+        raise HTTPException(status_code=400, detail="Analiz için en az iki araç seçilmelidir.")
+
+    vehicles = [v for v in await get_vehicles_by_ids(request.vehicleIds, db) if v]
+    
+    if len(vehicles) < 2:
+        raise HTTPException(status_code=404, detail="Seçilen araçlar veritabanında bulunamadı.")
+    return vehicles
+
+
 @router.post("/compare-analyst")
 async def compare_analyst(
     request: AICompareRequest = Body(...),
+    background: bool = False,
+    current_user: Optional[dict] = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """
     Analyzes multiple vehicles and provides a comparative review for the user.
+    With ?background=true the analysis is queued and the job id returned (202).
     """
     if not request.vehicleIds or len(request.vehicleIds) < 2:
         raise HTTPException(status_code=400, detail="Analiz için en az iki araç seçilmelidir.")
 
+    if background:
+        job = await ai_job_queue.submit("compare", request.dict(), PRIORITY_NORMAL, user_id=current_user["id"] if current_user else None)
+        return job_accepted(job)
+    return await build_compare_analysis(request, db)
+
+
+async def run_compare_job(payload: dict, db: AsyncIOMotorDatabase) -> dict:
+    return await build_compare_analysis(AICompareRequest(**payload), db, Deadline.for_job("compare", AI_JOB_TIMEOUT))
+
+
+async def build_compare_analysis(request: AICompareRequest, db: AsyncIOMotorDatabase, deadline: Deadline = None) -> dict:
+    deadline = deadline or Deadline.for_endpoint("compare")
     api_key = get_gemini_api_key()
     
     try:
         # 1. Fetch vehicle data
-        vehicles = []
-        for vid in request.vehicleIds:
-            v = await db.vehicles.find_one({"id": vid})
-            if v:
-                vehicles.append(v)
-        
-        if len(vehicles) < 2:
-            raise HTTPException(status_code=404, detail="Seçilen araçlar veritabanında bulunamadı.")
+        vehicles = await load_compare_vehicles(request, db)
 
         # 2. Prepare context for AI
-        vehicle_details = []
-        for v in vehicles:
-            details = {
-                "name": f"{v.get('brand')} {v.get('model')} ({v.get('year')})",
-                "specs": v.get("specs", {}),
-                "scores": {k: v.get("scores", {}).get(k, {}).get("score") for k in v.get("scores", {})} if v.get("scores") else {},
-                "strengths": v.get("strengths", {}).get("tr", []),
-                "weaknesses": v.get("weaknesses", {}).get("tr", []),
-                "bestFor": v.get("bestFor", {}).get("tr", ""),
-                "verdict": v.get("editorial", {}).get("verdict", {}).get("tr", "")
-            }
-            vehicle_details.append(details)
-
-        # 3. Call Gemini
-        system_instruction = """
-        Sen OTORİTE AI, dünyanın en saygın otomobil dergilerinden ve analiz platformlarından biri olan 'Otorite'nin kıdemli kıyaslama uzmanısın.
-        Görevin, sana verilen araç verilerini analiz edip kullanıcıya objektif, teknik temelli ama akıcı bir karşılaştırma raporu sunmaktır.
-        
-        Kullanıcının arasından seçim yapmaya çalıştığı bu araçlar için:
-        1. Araçların temel karakter farklarını belirt (Örn: Biri konfor diğeri sürüş keyfi odaklı).
-        2. Karşılaştırılan kategorilerde (Performans, İç mekan, Teknoloji vb.) kimin önde olduğunu açıkla.
-        3. Farklı kullanıcı profilleri için hangisinin daha mantıklı olduğunu söyle (Aileler için X, gençler için Y gibi).
-        4. Otorite kararı olarak objektif bir tavsiye ver.
-        
-        Yanıtın profesyonel, anlaşılır ve ikna edici olmalı. Markdown formatında başlıklar ve listeler kullanarak şık bir rapor üret.
-        Yalnızca TÜRKÇE cevap ver.
-        """
-        
-        prompt = f"Aşağıdaki araçları detaylıca kıyasla ve kullanıcıya hangisini seçmesi gerektiği konusunda rehberlik et:\n\n{json.dumps(vehicle_details, indent=2, ensure_ascii=False)}"
+        prompt = build_compare_prompt(vehicles)
         
+        # 3. Call Gemini
         if api_key:
             contents = [{"parts": [{"text": prompt}]}]
-            ai_response = await call_gemini_rest(contents, api_key, system_instruction)
+            ai_response = await call_gemini_rest(contents, api_key, COMPARE_SYSTEM_INSTRUCTION, cache=True, deadline=deadline, hedge=True, profile="compare")
             return {"analysis": ai_response}
         else:
-            # Fallback: Scrappy heuristic analysis if AI is offline
-            v1, v2 = vehicles[0], vehicles[1]
-            analysis = f"### Otorite Karşılaştırma Analizi (Statik Mod)\n\n"
-            analysis += f"**{v1['brand'].upper()} {v1['model']}** ve **{v2['brand'].upper()} {v2['model']}** kıyaslandığında:\n\n"
-            
-            s1 = v1.get("scores", {}).get("overall", {}).get("score", 0)
-            s2 = v2.get("scores", {}).get("overall", {}).get("score", 0)
-            
-            if s1 > s2:
-                analysis += f"- Genel Otorite puanlamasında **{v1['model']}** ({s1}) daha yüksek bir skora sahip.\n"
-            else:
-                analysis += f"- Genel Otorite puanlamasında **{v2['model']}** ({s2}) daha yüksek bir skora sahip.\n"
-            
-            analysis += "\nLütfen teknik tabloyu inceleyerek önceliklerinize göre karar veriniz. AI servisi şu an kısıtlı olduğundan detaylı rapor sunulamıyor."
-            return {"analysis": analysis}
+            return {"analysis": static_compare_analysis(vehicles)}
 
+    except (UpstreamUnavailable, asyncio.TimeoutError):
+        return {"analysis": static_compare_analysis(vehicles)}
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in compare_analyst: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/compare-analyst/stream")
+async def compare_analyst_stream(
+    request: AICompareRequest = Body(...),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Streaming variant of /compare-analyst (Server-Sent Events).
+    """
+    deadline = Deadline.for_endpoint("compare")
+    vehicles = await load_compare_vehicles(request, db)
+    api_key = get_gemini_api_key()
+
+    async def events():
+        if not api_key:
+            yield sse_event({"text": static_compare_analysis(vehicles)})
+            yield sse_event({}, event="done")
+            return
+        try:
+            contents = [{"parts": [{"text": build_compare_prompt(vehicles)}]}]
+            async for chunk in stream_gemini_rest(contents, api_key, COMPARE_SYSTEM_INSTRUCTION, cache=True, deadline=deadline, profile="compare"):
+                yield sse_event({"text": chunk})
+            yield sse_event({}, event="done")
+        except (UpstreamUnavailable, httpx.TimeoutException, asyncio.TimeoutError):
+            yield sse_event({"text": static_compare_analysis(vehicles)})
+            yield sse_event({}, event="done")
+        except Exception as e:
+            print(f"Error in compare_analyst_stream: {e}")
+            yield sse_event({"detail": str(e)}, event="error")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# === BACKGROUND JOBS ===
+ai_job_queue.register("summary", run_summary_job)
+ai_job_queue.register("wizard", run_wizard_job)
+ai_job_queue.register("compare", run_compare_job)
+
+
+@router.get("/jobs/{job_id}")
+async def get_ai_job(job_id: str, current_user: Optional[dict] = Depends(get_current_user)):
+    """Poll a background AI job: status queued/running/done/failed, result once done"""
+    job = await ai_job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="İş bulunamadı")
+    check_job_access(job, current_user)
+    return jsonable_encoder(job_to_response(job))
+
+
+@router.get("/jobs/{job_id}/stream")
+async def stream_ai_job(job_id: str, current_user: Optional[dict] = Depends(get_current_user)):
+    """
+    Follow a background AI job (Server-Sent Events): an `event: status` frame per
+    state change, then `event: done` (or `event: error`) with the final job.
+    """
+    job = await ai_job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="İş bulunamadı")
+    check_job_access(job, current_user)
+
+    async def events():
+        async for job in ai_job_queue.subscribe(job_id):
+            if job is None:
+                yield ": keepalive\n\n"
+                continue
+            data = jsonable_encoder(job_to_response(job))
+            if job["status"] in FINISHED_STATUSES:
+                yield sse_event(data, event="done" if job["status"] == "done" else "error")
+            else:
+                yield sse_event(data, event="status")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# === METRICS ===
+@router.get("/metrics")
+async def ai_metrics(admin: dict = Depends(get_admin_user)):
+    """Cache, coalescing, catalog context, upstream health and latency statistics for the AI layer (Admin only)"""
+    return {
+        "llmCache": llm_cache.stats(),
+        "singleFlight": single_flight.stats(),
+        "catalogContext": catalog_context.stats(),
+        "contextCache": gemini_context_cache.stats(),
+        "upstream": gemini_guard.stats(),
+        "latency": hedger.stats(),
+        "imagePipeline": image_pipeline_stats.stats(),
+        "snapPhashCache": snap_phash_cache.stats(),
+        "jobQueue": ai_job_queue.stats()
+    }
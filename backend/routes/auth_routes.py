@@ -10,6 +10,7 @@ from models import (
 )
 from auth import get_password_hash, verify_password, create_access_token
 from dependencies import get_current_user_required
+from pagination import decode_cursor, after_query, keyset_sort, split_page
 
 from fastapi import Request
 from slowapi import Limiter
@@ -329,17 +330,24 @@ async def resend_verification(request: Request, current_user: dict = Depends(get
 
 @router.get("/users", response_model=List[UserResponse])
 async def list_users(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    after: Optional[str] = None,
     current_user: dict = Depends(get_current_user_required)
 ):
-    """List all users (Admin only)"""
+    """List all users (Admin only); the next page's cursor is in X-Next-Cursor"""
     if not current_user.get("isAdmin"):
         raise HTTPException(status_code=403, detail="Yetkisiz işlem")
         
     db = get_db()
-    cursor = db.users.find({}).sort("createdAt", -1).skip(skip).limit(limit)
-    users = await cursor.to_list(length=limit)
+    after_values = decode_cursor(after)
+    cursor = db.users.find(after_query({}, "createdAt", after_values)).sort(keyset_sort("createdAt"))
+    if after_values is None:
+        cursor = cursor.skip(skip)
+    users, next_cursor = split_page(await cursor.limit(limit + 1).to_list(length=limit + 1), limit, "createdAt")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     return [
         UserResponse(
@@ -6,6 +6,7 @@ from pydantic import BaseModel, Field
 import uuid
 
 from dependencies import get_admin_user, get_current_user
+from pagination import decode_cursor, after_query, keyset_sort, split_page
 
 router = APIRouter(prefix="/blog", tags=["Blog"])
 
@@ -78,6 +79,7 @@ class BlogPostResponse(BaseModel):
 class BlogListResponse(BaseModel):
     posts: List[BlogPostResponse]
     total: int
+    nextCursor: Optional[str] = None
 
 
 @router.get("", response_model=BlogListResponse)
@@ -87,9 +89,10 @@ async def list_blog_posts(
     featured: Optional[bool] = None,
     published: str = Query("true", description="Filter by published status: 'true', 'false', or 'all'"),
     skip: int = 0,
-    limit: int = 20
+    limit: int = 20,
+    after: Optional[str] = None
 ):
-    """List blog posts with filters"""
+    """List blog posts with filters (pass nextCursor as `after` for the next page)"""
     db = get_db()
     
     query = {}
@@ -107,12 +110,16 @@ async def list_blog_posts(
     # If published == "all", we don't filter
     
     total = await db.blog_posts.count_documents(query)
-    cursor = db.blog_posts.find(query).sort("createdAt", -1).skip(skip).limit(limit)
-    posts = await cursor.to_list(length=limit)
+    after_values = decode_cursor(after)
+    cursor = db.blog_posts.find(after_query(query, "createdAt", after_values)).sort(keyset_sort("createdAt"))
+    if after_values is None:
+        cursor = cursor.skip(skip)
+    posts, next_cursor = split_page(await cursor.limit(limit + 1).to_list(length=limit + 1), limit, "createdAt")
     
     return BlogListResponse(
         posts=[BlogPostResponse(**p) for p in posts],
-        total=total
+        total=total,
+        nextCursor=next_cursor
     )
 
 
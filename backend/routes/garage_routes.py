@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Response, Query
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from datetime import datetime, timezone
 import json
@@ -10,15 +10,28 @@ from models import (
     GarageVehicleResponse,
     GarageVehicleInDB,
     GarageComment,
+    GarageCommentListResponse,
     GarageListResponse,
     GarageListResponse,
     GarageActivity,
     GarageActivityType,
-    GarageFollow,
     generate_id
 )
 from typing import Optional, List
-from dependencies import get_db, get_current_user_required
+from dependencies import get_db, get_current_user, get_current_user_required
+from loaders import load_user_names, UNKNOWN_AUTHOR
+from review_ownership import refresh_verified_owner
+from likes import GARAGE, like_count, viewer_likes, liked_target_ids, toggle_like as toggle_target_like, delete_likes
+from timelines import (
+    FEED_READ_MODE, record_activity, read_timeline, merge_feed, feed_cursor,
+    on_follow, on_unfollow, remove_vehicle_activities
+)
+from comments import (
+    COMMENT_PAGE_MAX, comment_count, inline_comments, find_comment, list_comments,
+    add_comment as store_comment, delete_comment as remove_comment, delete_vehicle_comments
+)
+from follow_graph import FOLLOWERS, FOLLOWING, FOLLOW_PAGE_MAX, follow, unfollow, is_following, list_neighbors, ensure_counts
+from pagination import encode_cursor, decode_cursor, after_query, keyset_sort, split_page
 
 router = APIRouter(prefix="/garage", tags=["garage"])
 
@@ -57,8 +70,43 @@ def calculate_badges(vehicle: dict) -> List[str]:
     return badges
 
 
-def vehicle_to_response(vehicle: dict, user_name: str = "") -> GarageVehicleResponse:
-    """Convert database vehicle to response model"""
+async def record_vehicle_activity(db: AsyncIOMotorDatabase, vehicle: dict, user: dict, activity_type: GarageActivityType, title: str, description: str = "", data: Optional[dict] = None):
+    """Publish an activity for a public garage vehicle to the followers' timelines"""
+    if not vehicle.get("isPublic", True):
+        return
+    activity = GarageActivity(
+        userId=user["id"],
+        userName=user["name"],
+        vehicleId=vehicle["id"],
+        vehicleBrand=vehicle["brand"],
+        vehicleModel=vehicle["model"],
+        vehicleImage=vehicle.get("image", ""),
+        type=activity_type,
+        title=title,
+        description=description,
+        data=data or {}
+    )
+    await record_activity(db, activity.model_dump())
+
+
+def vehicle_author_ids(vehicles: List[dict]) -> List[str]:
+    """Owner and comment author ids of a page of vehicles, for one load_user_names call"""
+    ids = []
+    for vehicle in vehicles:
+        ids.append(vehicle["userId"])
+        ids.extend(c["userId"] for c in inline_comments(vehicle))
+    return ids
+
+
+def viewer_id_of(user_info: Optional[dict]) -> Optional[str]:
+    return user_info["id"] if user_info else None
+
+
+def vehicle_to_response(vehicle: dict, user_name: str = "", author_names: Optional[dict] = None, viewer_id: Optional[str] = None, liked: bool = False) -> GarageVehicleResponse:
+    """Convert database vehicle to response model (author_names refreshes comment userNames; likes only lists the viewer)"""
+    comments = inline_comments(vehicle)
+    if author_names:
+        comments = [{**c, "userName": author_names.get(c["userId"]) or c["userName"]} for c in comments]
     return GarageVehicleResponse(
         id=vehicle["id"],
         userId=vehicle["userId"],
@@ -72,10 +120,10 @@ def vehicle_to_response(vehicle: dict, user_name: str = "") -> GarageVehicleResp
         description=vehicle.get("description", ""),
         modifications=vehicle.get("modifications", []),
         isPublic=vehicle.get("isPublic", True),
-        likes=vehicle.get("likes", []),
-        likeCount=len(vehicle.get("likes", [])),
-        comments=[GarageComment(**c) for c in vehicle.get("comments", [])],
-        commentCount=len(vehicle.get("comments", [])),
+        likes=viewer_likes(vehicle, liked, viewer_id),
+        likeCount=like_count(vehicle),
+        comments=[GarageComment(**c) for c in comments],
+        commentCount=comment_count(vehicle),
         createdAt=vehicle["createdAt"],
         updatedAt=vehicle["updatedAt"],
         ownershipDate=vehicle.get("ownershipDate"),
@@ -98,9 +146,11 @@ async def explore_garage(
     year: Optional[int] = None,
     skip: int = 0,
     limit: int = 20,
+    after: Optional[str] = None,
+    viewer: Optional[dict] = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """Get all public garage vehicles for exploration"""
+    """Get all public garage vehicles for exploration (pass nextCursor as `after` for the next page)"""
     query = {"isPublic": True}
     
     if brand:
@@ -112,23 +162,29 @@ async def explore_garage(
     total = await db.garage.count_documents(query)
     
     # Get vehicles with pagination, sorted by newest first
-    cursor = db.garage.find(query).sort("createdAt", -1).skip(skip).limit(limit)
-    vehicles = await cursor.to_list(length=limit)
+    after_values = decode_cursor(after)
+    cursor = db.garage.find(after_query(query, "createdAt", after_values)).sort(keyset_sort("createdAt"))
+    if after_values is None:
+        cursor = cursor.skip(skip)
+    vehicles, next_cursor = split_page(await cursor.limit(limit + 1).to_list(length=limit + 1), limit, "createdAt")
     
-    # Get user names for each vehicle
-    response_vehicles = []
-    for vehicle in vehicles:
-        user = await db.users.find_one({"id": vehicle["userId"]})
-        user_name = user["name"] if user else "Bilinmeyen"
-        response_vehicles.append(vehicle_to_response(vehicle, user_name))
+    # Get user names for the whole page in one query
+    names = await load_user_names(db, vehicle_author_ids(vehicles), default=None)
+    viewer_id = viewer_id_of(viewer)
+    liked = await liked_target_ids(db, GARAGE, [v["id"] for v in vehicles], viewer_id)
+    response_vehicles = [
+        vehicle_to_response(vehicle, names.get(vehicle["userId"]) or UNKNOWN_AUTHOR, names, viewer_id, vehicle["id"] in liked)
+        for vehicle in vehicles
+    ]
     
-    return GarageListResponse(vehicles=response_vehicles, total=total)
+    return GarageListResponse(vehicles=response_vehicles, total=total, nextCursor=next_cursor)
 
 
 # ============ Get User's Garage (Public) ============
 @router.get("/user/{user_id}", response_model=GarageListResponse)
 async def get_user_garage(
     user_id: str,
+    viewer: Optional[dict] = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Get a specific user's public garage"""
@@ -143,7 +199,9 @@ async def get_user_garage(
     cursor = db.garage.find({"userId": user_id, "isPublic": True}).sort("createdAt", -1)
     vehicles = await cursor.to_list(length=100)
     
-    response_vehicles = [vehicle_to_response(v, user_name) for v in vehicles]
+    viewer_id = viewer_id_of(viewer)
+    liked = await liked_target_ids(db, GARAGE, [v["id"] for v in vehicles], viewer_id)
+    response_vehicles = [vehicle_to_response(v, user_name, viewer_id=viewer_id, liked=v["id"] in liked) for v in vehicles]
     
     return GarageListResponse(vehicles=response_vehicles, total=len(response_vehicles))
 
@@ -160,15 +218,45 @@ async def get_my_garage(
     cursor = db.garage.find({"userId": current_user["id"]}).sort("createdAt", -1)
     vehicles = await cursor.to_list(length=100)
     
-    response_vehicles = [vehicle_to_response(v, current_user["name"]) for v in vehicles]
+    liked = await liked_target_ids(db, GARAGE, [v["id"] for v in vehicles], current_user["id"])
+    response_vehicles = [vehicle_to_response(v, current_user["name"], viewer_id=current_user["id"], liked=v["id"] in liked) for v in vehicles]
     
     return GarageListResponse(vehicles=response_vehicles, total=len(response_vehicles))
 
 
+# ============ Activity Feed ============
+# Declared before /{vehicle_id}, which would otherwise match /feed
+@router.get("/feed", response_model=List[GarageActivity])
+async def get_activity_feed(
+    response: Response,
+    skip: int = 0,
+    limit: int = 20,
+    after: Optional[str] = None,
+    user_info: dict = Depends(get_current_user_required),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """
+    Get activity feed for the current user.
+    Includes activities from followed users (precomputed timeline, or merged at
+    read time, see timelines.py). Pass the X-Next-Cursor header of a page as
+    `after` to get the next one; skip is ignored once a cursor is given.
+    """
+    cursor = decode_cursor(after)
+    if cursor is not None or FEED_READ_MODE == "merge":
+        activities, next_cursor = await merge_feed(db, user_info["id"], limit, cursor, skip=0 if cursor else skip)
+    else:
+        activities = await read_timeline(db, user_info["id"], skip, limit)
+        next_cursor = feed_cursor(activities, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_cursor)
+    return activities
+
+
 # ============ Get Single Vehicle ============
 @router.get("/{vehicle_id}", response_model=GarageVehicleResponse)
 async def get_garage_vehicle(
     vehicle_id: str,
+    viewer: Optional[dict] = Depends(get_current_user),
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Get a single garage vehicle by ID"""
@@ -177,11 +265,12 @@ async def get_garage_vehicle(
     if not vehicle:
         raise HTTPException(status_code=404, detail="Araç bulunamadı")
     
-    # Get user name
-    user = await db.users.find_one({"id": vehicle["userId"]})
-    user_name = user["name"] if user else "Bilinmeyen"
+    # Get owner and comment author names
+    names = await load_user_names(db, vehicle_author_ids([vehicle]), default=None)
+    viewer_id = viewer_id_of(viewer)
+    liked = await liked_target_ids(db, GARAGE, [vehicle_id], viewer_id)
     
-    return vehicle_to_response(vehicle, user_name)
+    return vehicle_to_response(vehicle, names.get(vehicle["userId"]) or UNKNOWN_AUTHOR, names, viewer_id, vehicle_id in liked)
 
 
 # ============ Add Vehicle to Garage ============
@@ -219,6 +308,11 @@ async def add_vehicle(
     )
     
     await db.garage.insert_one(vehicle_in_db.model_dump())
+    await refresh_verified_owner(db, current_user["id"])
+    await record_vehicle_activity(
+        db, vehicle_in_db.model_dump(), current_user, GarageActivityType.STATUS_UPDATE,
+        "Garaja Yeni Araç Eklendi", vehicle_in_db.description or f"{vehicle_in_db.brand} {vehicle_in_db.model} artık garajda!"
+    )
     
     return vehicle_to_response(vehicle_in_db.model_dump(), current_user["name"])
 
@@ -247,10 +341,29 @@ async def update_vehicle(
         if value is not None:
             update_data[field] = value
     
+    # What changed, for the followers' feeds (read before the update mutates anything)
+    was_for_sale = vehicle.get("isForSale", False)
+    new_modifications = [m for m in update_data.get("modifications", []) if m not in vehicle.get("modifications", [])]
+    new_maintenance = [m for m in update_data.get("maintenanceHistory", []) if m not in vehicle.get("maintenanceHistory", [])]
+    new_images = [i for i in update_data.get("images", []) if i not in vehicle.get("images", [])]
+    
     await db.garage.update_one({"id": vehicle_id}, {"$set": update_data})
+    if "brand" in update_data or "model" in update_data:
+        await refresh_verified_owner(db, vehicle["userId"])
     
     updated_vehicle = await db.garage.find_one({"id": vehicle_id})
-    return vehicle_to_response(updated_vehicle, current_user["name"])
+    
+    if update_data.get("isForSale") and not was_for_sale:
+        await record_vehicle_activity(db, updated_vehicle, current_user, GarageActivityType.FOR_SALE, "Araç Satışa Çıktı")
+    if new_modifications:
+        await record_vehicle_activity(db, updated_vehicle, current_user, GarageActivityType.MODIFICATION, "Yeni Modifikasyon", ", ".join(new_modifications))
+    if new_maintenance:
+        await record_vehicle_activity(db, updated_vehicle, current_user, GarageActivityType.MAINTENANCE, "Bakım Yapıldı", ", ".join(new_maintenance))
+    if new_images:
+        await record_vehicle_activity(db, updated_vehicle, current_user, GarageActivityType.PHOTO_ADDED, "Yeni Fotoğraf Eklendi", data={"images": new_images})
+    
+    liked = await liked_target_ids(db, GARAGE, [vehicle_id], current_user["id"])
+    return vehicle_to_response(updated_vehicle, current_user["name"], viewer_id=current_user["id"], liked=vehicle_id in liked)
 
 
 # ============ Delete Vehicle ============
@@ -271,6 +384,10 @@ async def delete_vehicle(
         raise HTTPException(status_code=403, detail="Bu aracı silme yetkiniz yok")
     
     await db.garage.delete_one({"id": vehicle_id})
+    await delete_likes(db, GARAGE, vehicle_id)
+    await delete_vehicle_comments(db, vehicle_id)
+    await remove_vehicle_activities(db, vehicle_id)
+    await refresh_verified_owner(db, vehicle["userId"])
     
     return {"message": "Araç silindi"}
 
@@ -288,24 +405,9 @@ async def toggle_like(
     if not vehicle:
         raise HTTPException(status_code=404, detail="Araç bulunamadı")
     
-    user_id = user_info["id"]
-    likes = vehicle.get("likes", [])
+    liked, count = await toggle_target_like(db, GARAGE, vehicle, user_info["id"])
     
-    if user_id in likes:
-        # Unlike
-        likes.remove(user_id)
-        liked = False
-    else:
-        # Like
-        likes.append(user_id)
-        liked = True
-    
-    await db.garage.update_one(
-        {"id": vehicle_id},
-        {"$set": {"likes": likes}}
-    )
-    
-    return {"liked": liked, "likeCount": len(likes)}
+    return {"liked": liked, "likeCount": count}
 
 
 # ============ Add Comment ============
@@ -335,14 +437,35 @@ async def add_comment(
         content=content.strip()
     )
     
-    await db.garage.update_one(
-        {"id": vehicle_id},
-        {"$push": {"comments": comment.model_dump()}}
-    )
+    await store_comment(db, vehicle, comment.model_dump())
     
     return comment
 
 
+# ============ List Comments ============
+@router.get("/{vehicle_id}/comments", response_model=GarageCommentListResponse)
+async def get_comments(
+    vehicle_id: str,
+    limit: int = Query(20, ge=1, le=COMMENT_PAGE_MAX),
+    after: Optional[str] = None,
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """A page of a garage vehicle's comments, newest first (pass nextCursor as `after`)"""
+    vehicle = await db.garage.find_one({"id": vehicle_id})
+    
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Araç bulunamadı")
+    
+    comments, next_cursor = await list_comments(db, vehicle, limit, after)
+    names = await load_user_names(db, [c["userId"] for c in comments], default=None)
+    
+    return GarageCommentListResponse(
+        comments=[GarageComment(**{**c, "userName": names.get(c["userId"]) or c["userName"]}) for c in comments],
+        total=comment_count(vehicle),
+        nextCursor=next_cursor
+    )
+
+
 # ============ Delete Comment ============
 @router.delete("/{vehicle_id}/comment/{comment_id}")
 async def delete_comment(
@@ -358,13 +481,7 @@ async def delete_comment(
     if not vehicle:
         raise HTTPException(status_code=404, detail="Araç bulunamadı")
     
-    comments = vehicle.get("comments", [])
-    comment_to_delete = None
-    
-    for comment in comments:
-        if comment["id"] == comment_id:
-            comment_to_delete = comment
-            break
+    comment_to_delete = await find_comment(db, vehicle, comment_id)
     
     if not comment_to_delete:
         raise HTTPException(status_code=404, detail="Yorum bulunamadı")
@@ -377,42 +494,12 @@ async def delete_comment(
     if not (is_comment_owner or is_vehicle_owner or is_admin):
         raise HTTPException(status_code=403, detail="Bu yorumu silme yetkiniz yok")
     
-    await db.garage.update_one(
-        {"id": vehicle_id},
-        {"$pull": {"comments": {"id": comment_id}}}
-    )
+    await remove_comment(db, vehicle_id, comment_id)
     
     return {"message": "Yorum silindi"}
 
 
-# ============ Activity & Feed Endpoints ============
-@router.get("/feed", response_model=List[GarageActivity])
-async def get_activity_feed(
-    skip: int = 0,
-    limit: int = 20,
-    user_info: dict = Depends(get_current_user_required),
-    db: AsyncIOMotorDatabase = Depends(get_db)
-):
-    """
-    Get activity feed for the current user.
-    Includes activities from followed users.
-    """
-    # 1. Get List of followed user IDs
-    follows = await db.garage_follows.find({"followerId": user_info["id"]}).to_list(length=1000)
-    following_ids = [f["followingId"] for f in follows]
-    
-    # 2. Add current user id to see own activities too
-    following_ids.append(user_info["id"])
-    
-    # 3. Fetch activities
-    cursor = db.garage_activities.find(
-        {"userId": {"$in": following_ids}}
-    ).sort("createdAt", -1).skip(skip).limit(limit)
-    
-    activities = await cursor.to_list(length=limit)
-    return activities
-
-
+# ============ Follow Endpoints ============
 @router.post("/follow/{user_id}")
 async def follow_user(
     user_id: str,
@@ -428,21 +515,11 @@ async def follow_user(
     if not target_user:
         raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
         
-    # Check if already following
-    existing = await db.garage_follows.find_one({
-        "followerId": user_info["id"],
-        "followingId": user_id
-    })
-    
-    if existing:
+    # Idempotent: an existing follow is left as is
+    if not await follow(db, user_info["id"], user_id):
         return {"message": "Zaten takip ediyorsunuz", "following": True}
-        
-    follow = GarageFollow(
-        followerId=user_info["id"],
-        followingId=user_id
-    )
     
-    await db.garage_follows.insert_one(follow.model_dump())
+    await on_follow(db, user_info["id"], user_id)
     return {"message": "Takip edildi", "following": True}
 
 
@@ -453,34 +530,47 @@ async def unfollow_user(
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
     """Unfollow a user"""
-    result = await db.garage_follows.delete_one({
-        "followerId": user_info["id"],
-        "followingId": user_id
-    })
-    
-    if result.deleted_count == 0:
+    if not await unfollow(db, user_info["id"], user_id):
         return {"message": "Takip etmiyordunuz", "following": False}
+    
+    await on_unfollow(db, user_info["id"], user_id)
         
     return {"message": "Takip bırakıldı", "following": False}
 
 
+@router.get("/follow/{user_id}")
+async def get_follow_status(
+    user_id: str,
+    user_info: dict = Depends(get_current_user_required),
+    db: AsyncIOMotorDatabase = Depends(get_db)
+):
+    """Does the current user follow this user?"""
+    return {"following": await is_following(db, user_info["id"], user_id)}
+
+
 @router.get("/user/{user_id}/followers")
 async def get_user_followers(
     user_id: str,
+    limit: int = Query(FOLLOW_PAGE_MAX, ge=1, le=FOLLOW_PAGE_MAX),
+    after: Optional[str] = None,
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """Get followers count and list (simplified)"""
-    followers = await db.garage_follows.find({"followingId": user_id}).to_list(length=100)
-    count = await db.garage_follows.count_documents({"followingId": user_id})
-    return {"count": count, "followers": [f["followerId"] for f in followers]}
+    """Get followers count and a page of follower ids, newest first (pass nextCursor as `after`)"""
+    counts = await ensure_counts(db, [user_id])
+    followers, next_cursor = await list_neighbors(db, user_id, FOLLOWERS, limit, after)
+    count = counts.get(user_id, {}).get("followerCount", 0)
+    return {"count": count, "followers": followers, "nextCursor": next_cursor}
 
 
 @router.get("/user/{user_id}/following")
 async def get_user_following(
     user_id: str,
+    limit: int = Query(FOLLOW_PAGE_MAX, ge=1, le=FOLLOW_PAGE_MAX),
+    after: Optional[str] = None,
     db: AsyncIOMotorDatabase = Depends(get_db)
 ):
-    """Get following count and list (simplified)"""
-    following = await db.garage_follows.find({"followerId": user_id}).to_list(length=100)
-    count = await db.garage_follows.count_documents({"followerId": user_id})
-    return {"count": count, "following": [f["followingId"] for f in following]}
+    """Get following count and a page of followed user ids, newest first (pass nextCursor as `after`)"""
+    counts = await ensure_counts(db, [user_id])
+    following, next_cursor = await list_neighbors(db, user_id, FOLLOWING, limit, after)
+    count = counts.get(user_id, {}).get("followingCount", 0)
+    return {"count": count, "following": following, "nextCursor": next_cursor}
@@ -7,6 +7,7 @@ import logging
 from models import NewsItem, NewsCreate, NewsUpdate, NewsListResponse
 from database import get_database
 from dependencies import get_current_user_required
+from pagination import decode_cursor, after_query, keyset_sort, split_page
 
 router = APIRouter(prefix="/news", tags=["News"])
 logger = logging.getLogger(__name__)
@@ -19,7 +20,8 @@ async def get_news_list(
     page: int = Query(1, ge=1),
     limit: int = Query(10, ge=1, le=100),
     tag: Optional[str] = None,
-    published: str = Query("true", description="Filter by published status: 'true', 'false', or 'all'")
+    published: str = Query("true", description="Filter by published status: 'true', 'false', or 'all'"),
+    after: Optional[str] = Query(None, description="nextCursor of the previous page (replaces page)")
 ):
     """Get list of news with optional filtering"""
     db = get_db()
@@ -47,15 +49,19 @@ async def get_news_list(
     total = await db.news.count_documents(query)
     
     # Get items
-    cursor = db.news.find(query)
-    cursor.sort("publishedAt", -1)
-    cursor.skip(skip).limit(limit)
+    after_values = decode_cursor(after)
+    cursor = db.news.find(after_query(query, "publishedAt", after_values))
+    cursor.sort(keyset_sort("publishedAt"))
+    if after_values is None:
+        cursor.skip(skip)
+    cursor.limit(limit + 1)
     
-    news_items = await cursor.to_list(length=limit)
+    news_items, next_cursor = split_page(await cursor.to_list(length=limit + 1), limit, "publishedAt")
     
     return NewsListResponse(
         news=news_items,
-        total=total
+        total=total,
+        nextCursor=next_cursor
     )
 
 @router.get("/{id}", response_model=NewsItem)
@@ -1,7 +1,8 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from datetime import datetime
 from typing import Optional, List
+import asyncio
 
 from models import (
     VehicleReviewCreate,
@@ -11,41 +12,45 @@ from models import (
     VehicleReviewStats,
     generate_id
 )
-from dependencies import get_db, get_current_user_required
+from dependencies import get_db, get_loaders, get_current_user, get_current_user_required
+from loaders import RequestLoaders
+from review_ownership import owns_model, compute_verified_owner
+from review_stats import record_rating_change, get_review_stats, stats_summary
+from pagination import decode_cursor, after_query, keyset_sort, split_page
+from likes import REVIEW, like_count, viewer_likes, liked_target_ids, toggle_like as toggle_target_like, delete_likes
 
 router = APIRouter(prefix="/reviews", tags=["reviews"])
 
 
-async def check_verified_owner(db: AsyncIOMotorDatabase, user_id: str, vehicle_id: str) -> bool:
-    """Kullanıcının garajında bu araç modeli var mı kontrol et"""
-    # Önce aracı bul
-    vehicle = await db.vehicles.find_one({"$or": [{"id": vehicle_id}, {"slug": vehicle_id}]})
+async def check_verified_owner(loaders: RequestLoaders, user_id: str, vehicle_id: str) -> bool:
+    """Kullanıcının garajında bu araç modeli var mı kontrol et (isVerifiedOwner alanı olmayan eski yorumlar için)"""
+    # Araç ve kullanıcının garajı (istek boyunca önbellekli, aynı turdaki istekler tek sorgu)
+    vehicle, garage = await asyncio.gather(loaders.vehicles.load(vehicle_id), loaders.garages.load(user_id))
     if not vehicle:
         return False
     
     # Kullanıcının garajında benzer marka/model var mı kontrol et
-    garage_vehicle = await db.garage.find_one({
-        "userId": user_id,
-        "brand": {"$regex": vehicle.get("brand", ""), "$options": "i"},
-        "model": {"$regex": vehicle.get("model", ""), "$options": "i"}
-    })
-    
-    return garage_vehicle is not None
+    return owns_model(garage or [], vehicle)
 
 
-async def get_user_name(db: AsyncIOMotorDatabase, user_id: str) -> str:
+async def get_user_name(loaders: RequestLoaders, user_id: str) -> str:
     """Kullanıcı adını getir"""
-    user = await db.users.find_one({"id": user_id})
+    user = await loaders.users.load(user_id)
     return user.get("name", "Anonim") if user else "Anonim"
 
 
 async def review_to_response(
-    db: AsyncIOMotorDatabase, 
-    review: dict
+    loaders: RequestLoaders,
+    review: dict,
+    viewer_id: Optional[str] = None,
+    liked: bool = False
 ) -> VehicleReviewResponse:
-    """Review veritabanı kaydını response modeline dönüştür"""
-    user_name = await get_user_name(db, review["userId"])
-    is_verified = await check_verified_owner(db, review["userId"], review["vehicleId"])
+    """Review veritabanı kaydını response modeline dönüştür (likes yalnızca beğenen izleyiciyi içerir)"""
+    user_name = await get_user_name(loaders, review["userId"])
+    # Yorumda saklanan bayrak; garaj değiştikçe review_ownership günceller
+    is_verified = review.get("isVerifiedOwner")
+    if is_verified is None:
+        is_verified = await check_verified_owner(loaders, review["userId"], review["vehicleId"])
     
     return VehicleReviewResponse(
         id=review["id"],
@@ -58,8 +63,8 @@ async def review_to_response(
         pros=review.get("pros", []),
         cons=review.get("cons", []),
         isVerifiedOwner=is_verified,
-        likes=review.get("likes", []),
-        likeCount=len(review.get("likes", [])),
+        likes=viewer_likes(review, liked, viewer_id),
+        likeCount=like_count(review),
         createdAt=review["createdAt"],
         updatedAt=review["updatedAt"]
     )
@@ -69,35 +74,47 @@ async def review_to_response(
 @router.get("/vehicle/{vehicle_id}", response_model=List[VehicleReviewResponse])
 async def get_vehicle_reviews(
     vehicle_id: str,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
     sort: str = Query("newest", regex="^(newest|oldest|highest|lowest|helpful)$"),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    after: Optional[str] = Query(None, description="X-Next-Cursor of the previous page (same sort)"),
+    viewer: Optional[dict] = Depends(get_current_user),
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loaders: RequestLoaders = Depends(get_loaders)
 ):
-    """Belirli bir aracın tüm yorumlarını getir"""
+    """Belirli bir aracın tüm yorumlarını getir (sonraki sayfa imleci X-Next-Cursor başlığında)"""
     # Önce aracı bul (id veya slug ile)
-    vehicle = await db.vehicles.find_one({"$or": [{"id": vehicle_id}, {"slug": vehicle_id}]})
+    vehicle = await loaders.vehicles.load(vehicle_id)
     if not vehicle:
         raise HTTPException(status_code=404, detail="Araç bulunamadı")
     
     actual_vehicle_id = vehicle["id"]
+    loaders.vehicles.prime(actual_vehicle_id, vehicle)
     
     # Sıralama
     sort_field = {"newest": ("createdAt", -1), "oldest": ("createdAt", 1), 
                   "highest": ("rating", -1), "lowest": ("rating", 1),
-                  "helpful": ("likes", -1)}
+                  "helpful": ("likeCount", -1)}
     
     sort_key, sort_order = sort_field.get(sort, ("createdAt", -1))
     
-    cursor = db.reviews.find({"vehicleId": actual_vehicle_id}).sort(sort_key, sort_order).skip(skip).limit(limit)
-    reviews = await cursor.to_list(length=limit)
-    
-    result = []
-    for review in reviews:
-        response = await review_to_response(db, review)
-        result.append(response)
-    
-    return result
+    # (sıralama alanı, id) imleciyle sayfalama; imleç yoksa eski skip
+    after_values = decode_cursor(after)
+    query = after_query({"vehicleId": actual_vehicle_id}, sort_key, after_values, sort_order)
+    cursor = db.reviews.find(query).sort(keyset_sort(sort_key, sort_order))
+    if after_values is None:
+        cursor = cursor.skip(skip)
+    reviews, next_cursor = split_page(await cursor.limit(limit + 1).to_list(length=limit + 1), limit, sort_key)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    
+    # İzleyicinin beğendikleri tek sorguda
+    viewer_id = viewer["id"] if viewer else None
+    liked = await liked_target_ids(db, REVIEW, [r["id"] for r in reviews], viewer_id)
+    
+    # Birlikte dönüştür: yazarlar ve garajlar tek seferde yüklenir
+    return await asyncio.gather(*[review_to_response(loaders, review, viewer_id, review["id"] in liked) for review in reviews])
 
 
 # ============ Get Review Stats for a Vehicle ============
@@ -114,35 +131,10 @@ async def get_vehicle_review_stats(
     
     actual_vehicle_id = vehicle["id"]
     
-    # Tüm yorumları getir
-    reviews = await db.reviews.find({"vehicleId": actual_vehicle_id}).to_list(length=1000)
-    
-    if not reviews:
-        return VehicleReviewStats(
-            vehicleId=actual_vehicle_id,
-            averageRating=0.0,
-            totalReviews=0,
-            ratingDistribution={}
-        )
-    
-    # İstatistikleri hesapla
-    total = len(reviews)
-    sum_rating = sum(r["rating"] for r in reviews)
-    avg_rating = round(sum_rating / total, 1) if total > 0 else 0.0
+    # Yorum yazıldıkça güncellenen istatistik belgesi (review_stats)
+    stats = await get_review_stats(db, actual_vehicle_id)
     
-    # Puan dağılımı
-    distribution = {}
-    for i in range(1, 11):
-        count = len([r for r in reviews if r["rating"] == i])
-        if count > 0:
-            distribution[str(i)] = count
-    
-    return VehicleReviewStats(
-        vehicleId=actual_vehicle_id,
-        averageRating=avg_rating,
-        totalReviews=total,
-        ratingDistribution=distribution
-    )
+    return VehicleReviewStats(**stats_summary(stats))
 
 
 # ============ Create Review ============
@@ -150,15 +142,14 @@ async def get_vehicle_review_stats(
 async def create_review(
     review_data: VehicleReviewCreate,
     user_info: dict = Depends(get_current_user_required),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loaders: RequestLoaders = Depends(get_loaders)
 ):
     """Yeni yorum ekle (giriş yapmış kullanıcılar için)"""
     user_id = user_info["id"]
     
     # Aracı kontrol et
-    vehicle = await db.vehicles.find_one({
-        "$or": [{"id": review_data.vehicleId}, {"slug": review_data.vehicleId}]
-    })
+    vehicle = await loaders.vehicles.load(review_data.vehicleId)
     if not vehicle:
         raise HTTPException(status_code=404, detail="Araç bulunamadı")
     
@@ -182,13 +173,15 @@ async def create_review(
         content=review_data.content,
         pros=review_data.pros,
         cons=review_data.cons,
+        isVerifiedOwner=await compute_verified_owner(db, user_id, vehicle),
         createdAt=now,
         updatedAt=now
     )
     
     await db.reviews.insert_one(review.dict())
+    await record_rating_change(db, actual_vehicle_id, new_rating=review.rating)
     
-    return await review_to_response(db, review.dict())
+    return await review_to_response(loaders, review.dict())
 
 
 # ============ Update Review ============
@@ -197,7 +190,8 @@ async def update_review(
     review_id: str,
     review_data: VehicleReviewUpdate,
     user_info: dict = Depends(get_current_user_required),
-    db: AsyncIOMotorDatabase = Depends(get_db)
+    db: AsyncIOMotorDatabase = Depends(get_db),
+    loaders: RequestLoaders = Depends(get_loaders)
 ):
     """Yorumu güncelle (sadece sahip)"""
     user_id = user_info["id"]
@@ -224,10 +218,14 @@ async def update_review(
     if review_data.cons is not None:
         update_data["cons"] = review_data.cons
     
+    old_rating = review["rating"]
     await db.reviews.update_one({"id": review_id}, {"$set": update_data})
+    if "rating" in update_data:
+        await record_rating_change(db, review["vehicleId"], old_rating=old_rating, new_rating=update_data["rating"])
     
     updated_review = await db.reviews.find_one({"id": review_id})
-    return await review_to_response(db, updated_review)
+    liked = await liked_target_ids(db, REVIEW, [review_id], user_id)
+    return await review_to_response(loaders, updated_review, user_id, review_id in liked)
 
 
 # ============ Delete Review ============
@@ -251,6 +249,8 @@ async def delete_review(
         raise HTTPException(status_code=403, detail="Bu yorumu silme yetkiniz yok")
     
     await db.reviews.delete_one({"id": review_id})
+    await delete_likes(db, REVIEW, review_id)
+    await record_rating_change(db, review["vehicleId"], old_rating=review["rating"])
     
     return {"message": "Yorum başarıyla silindi"}
 
@@ -270,20 +270,6 @@ async def toggle_like(
     if not review:
         raise HTTPException(status_code=404, detail="Yorum bulunamadı")
     
-    likes = review.get("likes", [])
-    
-    if user_id in likes:
-        # Beğeniyi kaldır
-        likes.remove(user_id)
-        action = "unliked"
-    else:
-        # Beğen
-        likes.append(user_id)
-        action = "liked"
-    
-    await db.reviews.update_one(
-        {"id": review_id},
-        {"$set": {"likes": likes}}
-    )
+    liked, count = await toggle_target_like(db, REVIEW, review, user_id)
     
-    return {"action": action, "likeCount": len(likes)}
+    return {"action": "liked" if liked else "unliked", "likeCount": count}
@@ -8,6 +8,8 @@ from models import (
     VehicleCreate, VehicleUpdate, VehicleResponse, VehicleInDB, VehicleListResponse
 )
 from dependencies import get_admin_user, get_current_user
+from catalog_context import catalog_context
+from pagination import decode_cursor, after_query, keyset_sort, split_page
 
 router = APIRouter(prefix="/vehicles", tags=["Vehicles"])
 
@@ -53,7 +55,8 @@ async def list_vehicles(
     minScore: Optional[float] = Query(None, ge=0, le=10, description="Minimum overall score"),
     search: Optional[str] = Query(None, description="Search in brand/model"),
     skip: int = Query(0, ge=0),
-    limit: int = Query(50, ge=1, le=100)
+    limit: int = Query(50, ge=1, le=100),
+    after: Optional[str] = Query(None, description="nextCursor of the previous page")
 ):
     """List vehicles with optional filters"""
     db = get_db()
@@ -83,13 +86,17 @@ async def list_vehicles(
     # Get total count
     total = await db.vehicles.count_documents(query)
     
-    # Get vehicles
-    cursor = db.vehicles.find(query).sort("createdAt", -1).skip(skip).limit(limit)
-    vehicles = await cursor.to_list(length=limit)
+    # Get vehicles (keyset page after the cursor, or skip for old clients)
+    after_values = decode_cursor(after)
+    cursor = db.vehicles.find(after_query(query, "createdAt", after_values)).sort(keyset_sort("createdAt"))
+    if after_values is None:
+        cursor = cursor.skip(skip)
+    vehicles, next_cursor = split_page(await cursor.limit(limit + 1).to_list(length=limit + 1), limit, "createdAt")
     
     return VehicleListResponse(
         vehicles=[VehicleResponse(**v) for v in vehicles],
-        total=total
+        total=total,
+        nextCursor=next_cursor
     )
 
 
@@ -152,6 +159,7 @@ async def create_vehicle(
     )
     
     await db.vehicles.insert_one(vehicle_in_db.dict())
+    catalog_context.invalidate(vehicle_in_db.id)
     
     return VehicleResponse(**vehicle_in_db.dict())
 
@@ -191,6 +199,7 @@ async def update_vehicle(
         {"id": vehicle_id},
         {"$set": update_data}
     )
+    catalog_context.invalidate(vehicle_id)
     
     # Return updated vehicle
     updated = await db.vehicles.find_one({"id": vehicle_id})
@@ -211,5 +220,6 @@ async def delete_vehicle(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Vehicle not found"
         )
+    catalog_context.invalidate(vehicle_id)
     
     return None
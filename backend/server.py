@@ -10,8 +10,11 @@ from contextlib import asynccontextmanager
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from pymongo.errors import OperationFailure
 
 from database import db_instance, get_database
+from gemini_client import gemini_http
+from job_queue import ai_job_queue, AI_JOB_TTL_SECONDS
 
 # Create limiter
 limiter = Limiter(key_func=get_remote_address)
@@ -48,23 +51,78 @@ async def lifespan(app: FastAPI):
     await db.vehicles.create_index("segment")
     await db.vehicles.create_index("scores.overall.score")
     
+    # Keyset pagination: (filter..., sortKey, id) per list endpoint, see pagination.py
+    await db.users.create_index([("createdAt", -1), ("id", -1)])
+    await db.vehicles.create_index([("createdAt", -1), ("id", -1)])
+    await db.blog_posts.create_index([("published", 1), ("createdAt", -1), ("id", -1)])
+    await db.blog_posts.create_index([("createdAt", -1), ("id", -1)])
+    await db.news.create_index([("isPublished", 1), ("publishedAt", -1), ("id", -1)])
+    await db.news.create_index([("publishedAt", -1), ("id", -1)])
+    
     # Garage collection indexes
     await db.garage.create_index("id", unique=True)
     await db.garage.create_index("userId")
-    await db.garage.create_index([("isPublic", 1), ("createdAt", -1)])
+    await db.garage.create_index([("isPublic", 1), ("createdAt", -1), ("id", -1)])
+    
+    # Activity feed: per-user activity log, follow graph and fanned-out timelines
+    await db.garage_activities.create_index("id", unique=True)
+    await db.garage_activities.create_index([("userId", 1), ("createdAt", -1), ("id", -1)])
+    await db.garage_activities.create_index("vehicleId")
+    try:
+        await db.garage_follows.create_index([("followerId", 1), ("followingId", 1)], unique=True)
+    except OperationFailure:
+        # Follows stored before the unique index can hold duplicate edges
+        from follow_graph import rebuild_follow_counts
+        users, duplicates = await rebuild_follow_counts(db)
+        logging.warning(f"Removed {duplicates} duplicate follow edges, recounted {users} users")
+        await db.garage_follows.create_index([("followerId", 1), ("followingId", 1)], unique=True)
+    await db.garage_follows.create_index([("followerId", 1), ("createdAt", -1), ("id", -1)])
+    await db.garage_follows.create_index([("followingId", 1), ("createdAt", -1), ("id", -1)])
+    await db.garage_timelines.create_index("userId", unique=True)
+    
+    # Garage comments (latest few are also kept on the garage document)
+    await db.garage_comments.create_index("id", unique=True)
+    await db.garage_comments.create_index([("vehicleId", 1), ("createdAt", -1), ("id", -1)])
     
     # Reviews collection indexes
     await db.reviews.create_index("id", unique=True)
     await db.reviews.create_index("vehicleId")
+    await db.reviews.create_index("userId")
     await db.reviews.create_index([("vehicleId", 1), ("userId", 1)], unique=True)
-    await db.reviews.create_index([("vehicleId", 1), ("createdAt", -1)])
+    await db.reviews.create_index([("vehicleId", 1), ("createdAt", -1), ("id", -1)])
+    await db.reviews.create_index([("vehicleId", 1), ("rating", -1), ("id", -1)])
+    await db.reviews.create_index([("vehicleId", 1), ("likeCount", -1), ("id", -1)])
+    await db.review_stats.create_index("vehicleId", unique=True)
+    
+    # Likes (reviews and garage vehicles)
+    await db.likes.create_index([("targetType", 1), ("userId", 1), ("targetId", 1)], unique=True)
+    await db.likes.create_index([("targetType", 1), ("targetId", 1)])
+    
+    # Background AI jobs
+    await db.ai_jobs.create_index("id", unique=True)
+    await db.ai_jobs.create_index("status")
+    await db.ai_jobs.create_index("finishedAt", expireAfterSeconds=AI_JOB_TTL_SECONDS)
     
     logging.info("Database indexes created")
+
+    # Legacy like arrays -> likeCount, so "helpful" review sorting ranks them correctly
+    from likes import migrate_legacy_likes
+    for collection, (documents, likes) in (await migrate_legacy_likes(db)).items():
+        if documents:
+            logging.info(f"Migrated {likes} legacy likes on {documents} {collection} documents")
+    
+    # Shared pooled HTTP client for Gemini
+    gemini_http.connect()
+    
+    # Background AI job workers (after the routers registered their handlers)
+    await ai_job_queue.start(db)
     
     yield
     
     # Shutdown
     logging.info("Shutting down...")
+    await ai_job_queue.stop()
+    await gemini_http.close()
     db_instance.close()
 
 
@@ -132,6 +190,7 @@ app.add_middleware(
     allow_origins=ALLOWED_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Configure logging
@@ -0,0 +1,240 @@
+"""
+Fan-out-on-write timelines for the garage activity feed.
+
+The feed used to load the reader's follows and scan all of garage_activities
+with {"userId": {"$in": following}} on every view. Now each user has a
+garage_timelines document whose `items` list holds {id, userId, createdAt}
+entries for their own and their followees' activities, newest first and capped
+at TIMELINE_MAX_ITEMS. record_activity pushes a new activity into the
+author's and all followers' timelines with one update_many, so reading the
+feed is a slice of that list plus one $in fetch of the activities.
+
+Hybrid pull: authors with more than TIMELINE_FANOUT_MAX_FOLLOWERS followers
+are flagged isPopularAuthor and not fanned out. Readers merge those authors'
+latest activities in at read time instead. When an author drops back below the
+threshold, their followers' timelines are refilled with the author's latest
+activities, including those posted while popular. A timeline that does not
+exist yet is built from the activity log on first read.
+
+merge_feed is the fan-out-on-read alternative (FEED_READ_MODE=merge, and
+every page requested with a cursor): each followed author's activities are
+read newest first from the (userId, createdAt, id) index in small keyset
+batches and k-way merged with a heap, stopping as soon as the page is full.
+Pages are addressed by a (createdAt, id) cursor instead of skip.
+"""
+import os
+import heapq
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from pagination import keyset_filter
+
+logger = logging.getLogger(__name__)
+
+TIMELINE_MAX_ITEMS = int(os.environ.get("TIMELINE_MAX_ITEMS", "500"))
+TIMELINE_FANOUT_MAX_FOLLOWERS = int(os.environ.get("TIMELINE_FANOUT_MAX_FOLLOWERS", "5000"))
+
+FEED_READ_MODE = os.environ.get("FEED_READ_MODE", "timeline")  # "timeline" or "merge"
+FEED_MERGE_BATCH = int(os.environ.get("FEED_MERGE_BATCH", "10"))
+
+ENTRY_FIELDS = {"_id": 0, "id": 1, "userId": 1, "createdAt": 1}
+FEED_ORDER = [("createdAt", -1), ("id", -1)]
+
+
+def timeline_entry(activity: dict) -> dict:
+    return {"id": activity["id"], "userId": activity["userId"], "createdAt": activity["createdAt"]}
+
+
+def _newest_first_key(entry: dict):
+    # createdAt may be a datetime or (json_db, after reload) its str form; id breaks ties
+    return (str(entry["createdAt"]), entry["id"])
+
+
+def _push_entries(entries: List[dict]) -> dict:
+    return {"$push": {"items": {"$each": entries, "$sort": {"createdAt": -1, "id": -1}, "$slice": TIMELINE_MAX_ITEMS}}}
+
+
+async def follower_ids(db: AsyncIOMotorDatabase, user_id: str) -> List[str]:
+    follows = await db.garage_follows.find({"followingId": user_id}, {"_id": 0, "followerId": 1}).to_list(length=None)
+    return [f["followerId"] for f in follows]
+
+
+async def following_ids(db: AsyncIOMotorDatabase, user_id: str) -> List[str]:
+    follows = await db.garage_follows.find({"followerId": user_id}, {"_id": 0, "followingId": 1}).to_list(length=None)
+    return [f["followingId"] for f in follows]
+
+
+async def record_activity(db: AsyncIOMotorDatabase, activity: dict):
+    """Store an activity and push it into the author's and (unless popular) the followers' timelines"""
+    await db.garage_activities.insert_one(activity)
+    author_id = activity["userId"]
+    targets = [author_id]
+
+    followers = await follower_ids(db, author_id)
+    popular = len(followers) > TIMELINE_FANOUT_MAX_FOLLOWERS
+    author = await db.users.find_one({"id": author_id}, {"_id": 0, "isPopularAuthor": 1})
+    was_popular = bool(author and author.get("isPopularAuthor"))
+    if author is not None and was_popular != popular:
+        await db.users.update_one({"id": author_id}, {"$set": {"isPopularAuthor": popular}})
+    if was_popular and not popular:
+        # No longer pulled at read time; the refill includes this activity
+        await refill_author(db, author_id, followers)
+    elif not popular:
+        targets.extend(followers)
+
+    # Users without a timeline yet get this activity when theirs is first built
+    await db.garage_timelines.update_many({"userId": {"$in": targets}}, _push_entries([timeline_entry(activity)]))
+
+
+async def build_timeline(db: AsyncIOMotorDatabase, user_id: str) -> dict:
+    """(Re)build a user's timeline from the activity log (fan-out-on-read, once)"""
+    authors = [user_id] + await following_ids(db, user_id)
+    entries = await db.garage_activities.find(
+        {"userId": {"$in": authors}}, ENTRY_FIELDS
+    ).sort(FEED_ORDER).limit(TIMELINE_MAX_ITEMS).to_list(length=TIMELINE_MAX_ITEMS)
+
+    timeline = {"userId": user_id, "items": entries, "updatedAt": datetime.utcnow()}
+    await db.garage_timelines.update_one({"userId": user_id}, {"$set": {"items": entries, "updatedAt": timeline["updatedAt"]}}, upsert=True)
+    return timeline
+
+
+async def refill_author(db: AsyncIOMotorDatabase, author_id: str, followers: List[str]):
+    """Replace an author's entries in the followers' timelines with their latest activities"""
+    if not followers:
+        return
+    entries = await db.garage_activities.find(
+        {"userId": author_id}, ENTRY_FIELDS
+    ).sort(FEED_ORDER).limit(TIMELINE_MAX_ITEMS).to_list(length=TIMELINE_MAX_ITEMS)
+    await db.garage_timelines.update_many({"userId": {"$in": followers}}, {"$pull": {"items": {"userId": author_id}}})
+    if entries:
+        await db.garage_timelines.update_many({"userId": {"$in": followers}}, _push_entries(entries))
+
+
+async def popular_followees(db: AsyncIOMotorDatabase, user_id: str) -> List[str]:
+    ids = await following_ids(db, user_id)
+    if not ids:
+        return []
+    users = await db.users.find({"id": {"$in": ids}, "isPopularAuthor": True}, {"_id": 0, "id": 1}).to_list(length=len(ids))
+    return [u["id"] for u in users]
+
+
+async def read_timeline(db: AsyncIOMotorDatabase, user_id: str, skip: int = 0, limit: int = 20) -> List[dict]:
+    """A page of the user's feed: precomputed timeline merged with popular followees' latest activities"""
+    timeline = await db.garage_timelines.find_one({"userId": user_id}, {"_id": 0, "items": 1})
+    if timeline is None:
+        timeline = await build_timeline(db, user_id)
+    wanted = skip + limit
+    entries = timeline.get("items", [])[:wanted]
+
+    popular = await popular_followees(db, user_id)
+    if popular:
+        pulled = await db.garage_activities.find(
+            {"userId": {"$in": popular}}, ENTRY_FIELDS
+        ).sort(FEED_ORDER).limit(wanted).to_list(length=wanted)
+        seen = {e["id"] for e in entries}
+        pulled = [e for e in pulled if e["id"] not in seen]
+        entries = list(heapq.merge(entries, pulled, key=_newest_first_key, reverse=True))[:wanted]
+
+    page_ids = [e["id"] for e in entries[skip:wanted]]
+    if not page_ids:
+        return []
+    activities = await db.garage_activities.find({"id": {"$in": page_ids}}).to_list(length=len(page_ids))
+    by_id = {a["id"]: a for a in activities}
+    return [by_id[i] for i in page_ids if i in by_id]
+
+
+def feed_cursor(page: List[dict], limit: int) -> Optional[list]:
+    """(createdAt, id) of a full page's last activity, to continue from; None on the last page"""
+    if not page or len(page) < limit:
+        return None
+    return [page[-1]["createdAt"], page[-1]["id"]]
+
+
+class _NewestFirst:
+    """heapq is a min-heap: order (createdAt, id) keys descending"""
+    __slots__ = ("key",)
+
+    def __init__(self, activity: dict):
+        self.key = _newest_first_key(activity)
+
+    def __lt__(self, other):
+        return self.key > other.key
+
+
+class _AuthorStream:
+    """One author's activities, newest first, fetched lazily in keyset batches"""
+
+    def __init__(self, db: AsyncIOMotorDatabase, author_id: str, after: Optional[list], batch_size: int):
+        self.db = db
+        self.author_id = author_id
+        self.after = after
+        self.batch_size = batch_size
+        self.buffer = []
+        self.exhausted = False
+
+    async def next(self) -> Optional[dict]:
+        if not self.buffer and not self.exhausted:
+            query = {"userId": self.author_id}
+            if self.after:
+                query.update(keyset_filter("createdAt", self.after[0], self.after[1]))
+            batch = await self.db.garage_activities.find(query, {"_id": 0}).sort(FEED_ORDER).limit(self.batch_size).to_list(length=self.batch_size)
+            self.exhausted = len(batch) < self.batch_size
+            if batch:
+                self.after = [batch[-1]["createdAt"], batch[-1]["id"]]
+            self.buffer = batch[::-1]
+        return self.buffer.pop() if self.buffer else None
+
+
+async def merge_feed(db: AsyncIOMotorDatabase, user_id: str, limit: int = 20, after: Optional[list] = None, skip: int = 0) -> Tuple[List[dict], Optional[list]]:
+    """
+    A page of the feed merged at read time from the followees' activities;
+    returns (page, next cursor). skip (for clients without cursors) discards
+    that many merged activities before the page.
+    """
+    authors = [user_id] + await following_ids(db, user_id)
+    wanted = skip + limit
+    batch_size = max(1, min(wanted, FEED_MERGE_BATCH))
+    streams = [_AuthorStream(db, author_id, after, batch_size) for author_id in authors]
+
+    heads = await asyncio.gather(*[stream.next() for stream in streams])
+    heap = [(_NewestFirst(head), i, head) for i, head in enumerate(heads) if head]
+    heapq.heapify(heap)
+
+    page = []
+    while heap and len(page) < wanted:
+        _, i, activity = heapq.heappop(heap)
+        page.append(activity)
+        if len(page) == wanted:
+            break
+        following = await streams[i].next()
+        if following:
+            heapq.heappush(heap, (_NewestFirst(following), i, following))
+    page = page[skip:]
+
+    more = bool(heap) or any(not s.exhausted or s.buffer for s in streams)
+    return page, feed_cursor(page, limit) if more else None
+
+
+async def on_follow(db: AsyncIOMotorDatabase, follower_id: str, followee_id: str):
+    """Backfill the followee's recent activities into the follower's timeline"""
+    followee = await db.users.find_one({"id": followee_id}, {"_id": 0, "isPopularAuthor": 1})
+    if followee and followee.get("isPopularAuthor"):
+        return  # pulled at read time
+    entries = await db.garage_activities.find(
+        {"userId": followee_id}, ENTRY_FIELDS
+    ).sort(FEED_ORDER).limit(TIMELINE_MAX_ITEMS).to_list(length=TIMELINE_MAX_ITEMS)
+    if entries:
+        await db.garage_timelines.update_one({"userId": follower_id}, _push_entries(entries))
+
+
+async def on_unfollow(db: AsyncIOMotorDatabase, follower_id: str, followee_id: str):
+    await db.garage_timelines.update_one({"userId": follower_id}, {"$pull": {"items": {"userId": followee_id}}})
+
+
+async def remove_vehicle_activities(db: AsyncIOMotorDatabase, vehicle_id: str):
+    """Drop a deleted garage vehicle's activities (timeline entries without an activity are skipped on read)"""
+    await db.garage_activities.delete_many({"vehicleId": vehicle_id})
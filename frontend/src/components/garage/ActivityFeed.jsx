@@ -37,7 +37,8 @@ const ActivityFeed = () => {
                         title: 'Garaja Yeni Araç Eklendi',
                         description: v.description || `${v.brand} ${v.model} artık garajda!`,
                         createdAt: v.createdAt,
-                        likes: v.likes || []
+                        likes: v.likes || [],
+                        likeCount: v.likeCount || 0
                     }));
                 }
             }
@@ -152,7 +153,7 @@ const ActivityFeed = () => {
                             {/* Like Button */}
                             <button className="flex items-center gap-1.5 px-3 py-1.5 rounded-full bg-white/5 hover:bg-white/10 transition-colors text-slate-400 hover:text-rose-400 group/like">
                                 <ThumbsUp className="w-4 h-4" />
-                                <span className="text-xs font-medium">{activity.likes?.length || 0}</span>
+                                <span className="text-xs font-medium">{activity.likeCount ?? activity.likes?.length ?? 0}</span>
                             </button>
                         </div>
 
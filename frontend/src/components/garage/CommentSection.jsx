@@ -8,12 +8,35 @@ import { garageAPI } from '../../services/api';
 import { formatDistanceToNow } from 'date-fns';
 import { tr } from 'date-fns/locale';
 
-const CommentSection = ({ vehicleId, comments = [], onCommentAdded, onCommentDeleted, isOwner = false }) => {
+const CommentSection = ({ vehicleId, comments = [], totalCount, onCommentAdded, onCommentDeleted, isOwner = false }) => {
     const navigate = useNavigate();
     const { user } = useAuth();
     const [newComment, setNewComment] = useState('');
     const [isSubmitting, setIsSubmitting] = useState(false);
     const [deletingId, setDeletingId] = useState(null);
+    // Only the latest comments come with the vehicle; older ones are loaded page by page
+    const [olderComments, setOlderComments] = useState([]);
+    const [olderCursor, setOlderCursor] = useState(undefined); // null: no older comments left
+    const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+
+    const allComments = [...olderComments, ...comments];
+    const commentTotal = Math.max(totalCount ?? 0, allComments.length);
+    const hasOlder = olderCursor !== null && allComments.length < commentTotal;
+
+    const handleLoadOlder = async () => {
+        setIsLoadingOlder(true);
+        try {
+            const data = await garageAPI.getComments(vehicleId, olderCursor ? { after: olderCursor } : {});
+            const shownIds = new Set(allComments.map(c => c.id));
+            const older = data.comments.filter(c => !shownIds.has(c.id)).reverse();
+            setOlderComments(prev => [...older, ...prev]);
+            setOlderCursor(data.nextCursor);
+        } catch (error) {
+            console.error('Failed to load comments:', error);
+        } finally {
+            setIsLoadingOlder(false);
+        }
+    };
 
     const handleSubmit = async (e) => {
         e.preventDefault();
@@ -41,6 +64,7 @@ const CommentSection = ({ vehicleId, comments = [], onCommentAdded, onCommentDel
         setDeletingId(commentId);
         try {
             await garageAPI.deleteComment(vehicleId, commentId);
+            setOlderComments(prev => prev.filter(c => c.id !== commentId));
             onCommentDeleted?.(commentId);
         } catch (error) {
             console.error('Failed to delete comment:', error);
@@ -68,7 +92,7 @@ const CommentSection = ({ vehicleId, comments = [], onCommentAdded, onCommentDel
             <div className="flex items-center gap-2">
                 <MessageCircle className="w-5 h-5 text-amber-500" />
                 <h3 className="text-lg font-semibold text-white">
-                    Yorumlar ({comments.length})
+                    Yorumlar ({commentTotal})
                 </h3>
             </div>
 
@@ -108,14 +132,28 @@ const CommentSection = ({ vehicleId, comments = [], onCommentAdded, onCommentDel
 
             {/* Comments List */}
             <div className="space-y-4">
-                {comments.length === 0 ? (
+                {hasOlder && (
+                    <Button
+                        variant="ghost"
+                        onClick={handleLoadOlder}
+                        disabled={isLoadingOlder}
+                        className="w-full text-slate-400 hover:text-white hover:bg-slate-800/50"
+                    >
+                        {isLoadingOlder ? (
+                            <div className="w-4 h-4 border-2 border-slate-500/30 border-t-slate-500 rounded-full animate-spin" />
+                        ) : (
+                            'Önceki yorumları göster'
+                        )}
+                    </Button>
+                )}
+                {allComments.length === 0 ? (
                     <div className="text-center py-8">
                         <MessageCircle className="w-12 h-12 text-slate-700 mx-auto mb-3" />
                         <p className="text-slate-500">Henüz yorum yok</p>
                         <p className="text-slate-600 text-sm">İlk yorumu siz yapın!</p>
                     </div>
                 ) : (
-                    comments.map((comment) => (
+                    allComments.map((comment) => (
                         <div
                             key={comment.id}
                             className="group relative p-4 rounded-xl bg-slate-800/30 border border-slate-700/30 hover:border-slate-600/50 transition-colors"
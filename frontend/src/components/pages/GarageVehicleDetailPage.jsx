@@ -581,6 +581,7 @@ const GarageVehicleDetailPage = () => {
                             <CommentSection
                                 vehicleId={vehicle.id}
                                 comments={vehicle.comments || []}
+                                totalCount={vehicle.commentCount}
                                 onCommentAdded={handleCommentAdded}
                                 onCommentDeleted={handleCommentDeleted}
                                 isOwner={isOwner}
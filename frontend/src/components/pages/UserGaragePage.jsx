@@ -52,10 +52,8 @@ const UserGaragePage = () => {
 
     const checkFollowStatus = async () => {
         try {
-            const data = await garageAPI.getFollowing(user.id);
-            if (data.following.includes(userId)) {
-                setIsFollowing(true);
-            }
+            const data = await garageAPI.getFollowStatus(userId);
+            setIsFollowing(data.following);
         } catch (e) {
             console.error(e);
         }
@@ -249,6 +249,12 @@ export const garageAPI = {
     await api.delete(`/garage/${vehicleId}/comment/${commentId}`);
   },
 
+  // Yorumları sayfa sayfa getir (en yeniler önce)
+  getComments: async (vehicleId, params = {}) => {
+    const response = await api.get(`/garage/${vehicleId}/comments`, { params });
+    return response.data;
+  },
+
   // Aktivite Akışı
   getFeed: async (params = {}) => {
     const response = await api.get('/garage/feed', { params });
@@ -278,6 +284,12 @@ export const garageAPI = {
     const response = await api.get(`/garage/user/${userId}/following`);
     return response.data;
   },
+
+  // Takip Ediliyor mu?
+  getFollowStatus: async (userId) => {
+    const response = await api.get(`/garage/follow/${userId}`);
+    return response.data;
+  },
 };
 
 // ============ AI API ============
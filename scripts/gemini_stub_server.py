@@ -0,0 +1,164 @@
+"""
+Local stand-in for the Gemini REST API.
+
+Run it and point the backend at it to exercise the AI endpoints offline and to
+see how many TCP connections the backend really opens:
+
+    python scripts/gemini_stub_server.py --port 8765 --delay 0.2
+    GEMINI_API_BASE=http://127.0.0.1:8765 uvicorn server:app
+
+GET /stats returns {"connections": N, "requests": M, ...}; with the shared pooled
+client N stays far below M. The tests start it through the gemini_stub fixture
+(tests/conftest.py). POST/DELETE /v1beta/cachedContents emulate Gemini
+context caching; generateContent answers 404 for unknown cachedContent names
+and returns a schema-shaped dummy object when a responseSchema is requested.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATS = {"connections": 0, "requests": 0, "cachedContentCreates": 0, "cachedContentHits": 0, "inlineSystemInstructions": 0}
+CACHED_CONTENTS = {}  # name -> systemInstruction text
+STATS_LOCK = threading.Lock()
+
+CANNED_TEXT = '{"summary": "Stub özet.", "highlight": "Stub"}'
+CANNED_STREAM_TEXT = "Toyota Corolla, Renault Clio ve Fiat Egea önerilerim bunlar."
+
+
+def _sample_from_schema(schema):
+    """Minimal value matching a Gemini responseSchema (structured profiles)"""
+    kind = schema.get("type")
+    if kind == "OBJECT":
+        return {name: _sample_from_schema(sub) for name, sub in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        return [_sample_from_schema(schema.get("items", {}))]
+    if kind == "INTEGER":
+        return 80
+    if kind == "NUMBER":
+        return 7.5
+    if kind == "BOOLEAN":
+        return True
+    return "Stub"
+
+
+def _bump(key):
+    with STATS_LOCK:
+        STATS[key] += 1
+
+
+class GeminiStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is visible
+    delay = 0.0
+    min_cache_chars = 0
+
+    def setup(self):
+        super().setup()
+        _bump("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        if self.path.startswith("/stats"):
+            with STATS_LOCK:
+                self._send_json(200, dict(STATS))
+            return
+        self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self._read_body()
+        _bump("requests")
+        if self.path.startswith("/v1beta/cachedContents"):
+            self._create_cached_content(json.loads(body or b"{}"))
+            return
+        payload = json.loads(body or b"{}")
+        if "cachedContent" in payload:
+            if payload["cachedContent"] not in CACHED_CONTENTS:
+                self._send_json(404, {"error": {"code": 404, "message": "CachedContent not found", "status": "NOT_FOUND"}})
+                return
+            _bump("cachedContentHits")
+        elif "system_instruction" in payload:
+            _bump("inlineSystemInstructions")
+        if ":generateContent" in self.path:
+            time.sleep(self.delay)
+            schema = payload.get("generationConfig", {}).get("responseSchema")
+            text = json.dumps(_sample_from_schema(schema), ensure_ascii=False) if schema else CANNED_TEXT
+            self._send_json(200, {
+                "candidates": [{
+                    "content": {"role": "model", "parts": [{"text": text}]},
+                    "finishReason": "STOP"
+                }]
+            })
+            return
+        if ":streamGenerateContent" in self.path:
+            self._send_stream()
+            return
+        self._send_json(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        name = self.path.split("/v1beta/", 1)[-1].split("?", 1)[0]
+        CACHED_CONTENTS.pop(name, None)
+        self._send_json(200, {})
+
+    def _create_cached_content(self, payload):
+        text = "".join(p.get("text", "") for p in payload.get("systemInstruction", {}).get("parts", []))
+        if len(text) < self.min_cache_chars:
+            self._send_json(400, {"error": {"code": 400, "message": "Cached content is too small", "status": "INVALID_ARGUMENT"}})
+            return
+        name = f"cachedContents/{uuid.uuid4().hex[:12]}"
+        CACHED_CONTENTS[name] = text
+        _bump("cachedContentCreates")
+        self._send_json(200, {"name": name, "model": payload.get("model"), "usageMetadata": {"totalTokenCount": len(text) // 4}})
+
+    def _send_stream(self):
+        """SSE chunks like streamGenerateContent?alt=sse"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        words = CANNED_STREAM_TEXT.split(" ")
+        for i, word in enumerate(words):
+            time.sleep(self.delay / max(len(words), 1))
+            text = word if i == len(words) - 1 else word + " "
+            event = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+            data = f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini REST stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.0, help="Artificial latency per call (seconds)")
+    parser.add_argument("--min-cache-chars", type=int, default=0, help="Reject cachedContents smaller than this")
+    args = parser.parse_args()
+
+    GeminiStubHandler.delay = args.delay
+    GeminiStubHandler.min_cache_chars = args.min_cache_chars
+    server = ThreadingHTTPServer((args.host, args.port), GeminiStubHandler)
+    print(f"Gemini stub listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Shared fixtures.
+
+The backend is a flat set of modules run from backend/, so that directory goes
+on sys.path. Async tests are marked @pytest.mark.anyio and run on asyncio.
+"""
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "backend"))
+
+STUB_SCRIPT = ROOT / "scripts" / "gemini_stub_server.py"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def db(tmp_path):
+    """An empty json_db database (the backend's local Motor stand-in) in a temp file"""
+    from json_db import AsyncJsonDatabase
+    return AsyncJsonDatabase(str(tmp_path / "db.json"))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class GeminiStub:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+
+    def stats(self) -> dict:
+        """GET /stats; this request opens one connection of its own"""
+        return httpx.get(f"{self.base_url}/stats", timeout=5).json()
+
+
+@pytest.fixture
+def gemini_stub():
+    """A fresh scripts/gemini_stub_server.py process on a free port"""
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, str(STUB_SCRIPT), "--port", str(port)],
+        stdout=subprocess.DEVNULL,
+    )
+    stub = GeminiStub(f"http://127.0.0.1:{port}")
+    try:
+        give_up = time.monotonic() + 10
+        while True:
+            try:
+                stub.stats()
+                break
+            except httpx.TransportError:
+                if process.poll() is not None or time.monotonic() > give_up:
+                    raise RuntimeError("Gemini stub did not start")
+                time.sleep(0.05)
+        yield stub
+    finally:
+        process.kill()
+        process.wait()
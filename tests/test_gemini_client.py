@@ -0,0 +1,58 @@
+import pytest
+
+import gemini_client
+from gemini_client import GeminiHttpClient, Base64Blob, gemini_url, request_body
+
+CALLS = 10
+
+
+@pytest.fixture
+def stub_api(gemini_stub, monkeypatch):
+    monkeypatch.setattr(gemini_client, "GEMINI_API_BASE", gemini_stub.base_url)
+    return gemini_stub
+
+
+def generate_payload(text: str) -> dict:
+    return {"contents": [{"role": "user", "parts": [{"text": text}]}]}
+
+
+@pytest.mark.anyio
+async def test_sequential_calls_reuse_one_connection(stub_api):
+    http = GeminiHttpClient()
+    http.connect()
+    before = stub_api.stats()
+    try:
+        for i in range(CALLS):
+            response = await http.get_client().post(
+                gemini_url("models/gemini-2.5-flash:generateContent?key=test"),
+                **request_body(generate_payload(f"soru {i}"))
+            )
+            assert response.status_code == 200
+    finally:
+        await http.close()
+    after = stub_api.stats()
+
+    assert after["requests"] - before["requests"] == CALLS
+    # minus the connection the second /stats request opened
+    assert after["connections"] - before["connections"] - 1 <= 1
+
+
+@pytest.mark.anyio
+async def test_streamed_blob_bodies_keep_the_connection(stub_api):
+    http = GeminiHttpClient()
+    http.connect()
+    before = stub_api.stats()
+    try:
+        for _ in range(3):
+            payload = generate_payload("görsel")
+            payload["contents"][0]["parts"].append({"inline_data": {"mime_type": "image/jpeg", "data": Base64Blob(b"\xff\xd8\xff" * 40000)}})
+            response = await http.get_client().post(
+                gemini_url("models/gemini-2.5-flash:generateContent?key=test"),
+                **request_body(payload)
+            )
+            assert response.status_code == 200
+    finally:
+        await http.close()
+    after = stub_api.stats()
+
+    assert after["connections"] - before["connections"] - 1 <= 1
@@ -0,0 +1,111 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from job_queue import JobQueue, check_job_access, STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, FINISHED_STATUSES
+
+TIMEOUT = 60
+
+
+class CountingHandler:
+    def __init__(self, delay: float = 0.05):
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, payload, db):
+        self.calls.append(payload["n"])
+        await asyncio.sleep(self.delay)
+        return {"n": payload["n"]}
+
+
+def make_queue(handler, workers: int = 2) -> JobQueue:
+    queue = JobQueue(workers=workers, max_size=20, timeout=TIMEOUT)
+    queue.register("test", handler)
+    return queue
+
+
+def job_doc(job_id: str, status: str = STATUS_QUEUED, started_at=None, user_id=None) -> dict:
+    return {
+        "id": job_id, "kind": "test", "status": status, "priority": 5, "userId": user_id,
+        "payload": {"n": job_id}, "result": None, "error": None,
+        "createdAt": datetime.utcnow(), "startedAt": started_at, "finishedAt": None,
+    }
+
+
+async def wait_finished(db, job_id: str) -> dict:
+    for _ in range(200):
+        job = await db.ai_jobs.find_one({"id": job_id})
+        if job["status"] in FINISHED_STATUSES:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.mark.anyio
+async def test_concurrent_claims_run_a_job_once(db):
+    handler = CountingHandler()
+    first, second = make_queue(handler), make_queue(handler)
+    first.db = second.db = db
+    await db.ai_jobs.insert_one(job_doc("j1"))
+
+    await asyncio.gather(first._run("j1"), second._run("j1"), first._run("j1"))
+
+    assert handler.calls == ["j1"]
+    assert (await db.ai_jobs.find_one({"id": "j1"}))["status"] == STATUS_DONE
+
+
+@pytest.mark.anyio
+async def test_two_processes_recovering_the_same_jobs_run_each_once(db):
+    handler = CountingHandler()
+    first, second = make_queue(handler), make_queue(handler)
+    await db.ai_jobs.insert_one(job_doc("queued"))
+    await db.ai_jobs.insert_one(job_doc("dead", STATUS_RUNNING, datetime.utcnow() - timedelta(seconds=TIMEOUT * 2)))
+
+    await first.start(db)
+    await second.start(db)
+    try:
+        for job_id in ("queued", "dead"):
+            assert (await wait_finished(db, job_id))["status"] == STATUS_DONE
+    finally:
+        await first.stop()
+        await second.stop()
+
+    assert sorted(handler.calls) == ["dead", "queued"]
+
+
+@pytest.mark.anyio
+async def test_fresh_running_jobs_are_not_requeued(db):
+    handler = CountingHandler()
+    queue = make_queue(handler)
+    started = datetime.utcnow() - timedelta(seconds=TIMEOUT / 2)
+    await db.ai_jobs.insert_one(job_doc("live", STATUS_RUNNING, started))
+
+    await queue.start(db)
+    try:
+        await asyncio.sleep(0.1)
+        job = await db.ai_jobs.find_one({"id": "live"})
+    finally:
+        await queue.stop()
+
+    assert handler.calls == []
+    assert job["status"] == STATUS_RUNNING
+    assert job["startedAt"] == started
+
+
+def test_job_access_is_limited_to_the_submitter():
+    job = job_doc("j1", user_id="owner")
+
+    check_job_access(job, {"id": "owner"})
+    for caller in ({"id": "someone-else"}, None):
+        with pytest.raises(HTTPException) as error:
+            check_job_access(job, caller)
+        assert error.value.status_code == 403
+
+
+def test_anonymous_jobs_are_visible_to_everyone():
+    job = job_doc("j1")
+
+    check_job_access(job, None)
+    check_job_access(job, {"id": "anyone"})
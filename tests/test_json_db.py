@@ -0,0 +1,182 @@
+"""json_db update/query operators, checked against what MongoDB does with the same documents"""
+import pytest
+
+
+async def stored(db, doc_id="d1") -> dict:
+    doc = await db.docs.find_one({"id": doc_id}, {"_id": 0})
+    return doc
+
+
+async def push(db, field, modifier, start=None) -> list:
+    await db.docs.insert_one({"id": "d1", **({field: start} if start is not None else {})})
+    await db.docs.update_one({"id": "d1"}, {"$push": {field: modifier}})
+    return (await stored(db))[field]
+
+
+# $push
+
+@pytest.mark.anyio
+async def test_push_appends_and_creates_the_array(db):
+    assert await push(db, "tags", "a") == ["a"]
+
+
+@pytest.mark.anyio
+async def test_push_each_appends_in_order(db):
+    assert await push(db, "n", {"$each": [3, 4]}, start=[1, 2]) == [1, 2, 3, 4]
+
+
+@pytest.mark.anyio
+async def test_push_each_at_position(db):
+    assert await push(db, "n", {"$each": [8, 9], "$position": 0}, start=[1, 2]) == [8, 9, 1, 2]
+
+
+@pytest.mark.anyio
+async def test_push_each_at_middle_position(db):
+    assert await push(db, "n", {"$each": [8], "$position": 1}, start=[1, 2]) == [1, 8, 2]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("n, expected", [(2, [1, 2]), (-2, [3, 4]), (0, []), (10, [1, 2, 3, 4])])
+async def test_push_each_slice(db, n, expected):
+    assert await push(db, "n", {"$each": [3, 4], "$slice": n}, start=[1, 2]) == expected
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("direction, expected", [(1, [1, 2, 3, 10]), (-1, [10, 3, 2, 1])])
+async def test_push_each_sort_scalars_numerically(db, direction, expected):
+    assert await push(db, "n", {"$each": [10, 2], "$sort": direction}, start=[3, 1]) == expected
+
+
+@pytest.mark.anyio
+async def test_push_each_sort_by_several_fields_then_slice(db):
+    start = [{"t": 2, "id": "a"}, {"t": 1, "id": "b"}]
+    items = await push(db, "items", {"$each": [{"t": 2, "id": "c"}, {"t": 3, "id": "d"}], "$sort": {"t": -1, "id": -1}, "$slice": 3}, start=start)
+
+    # sort applies before slice, id breaks the t tie
+    assert items == [{"t": 3, "id": "d"}, {"t": 2, "id": "c"}, {"t": 2, "id": "a"}]
+
+
+@pytest.mark.anyio
+async def test_push_each_sort_with_missing_fields_first_ascending(db):
+    items = await push(db, "items", {"$each": [{"id": "x"}], "$sort": {"t": 1}}, start=[{"t": 1, "id": "a"}])
+
+    assert items == [{"id": "x"}, {"t": 1, "id": "a"}]
+
+
+# $set / $inc / $pull
+
+@pytest.mark.anyio
+async def test_dotted_set_and_inc_create_nested_fields(db):
+    await db.docs.insert_one({"id": "d1"})
+
+    await db.docs.update_one({"id": "d1"}, {"$set": {"a.b": 1}, "$inc": {"histogram.8": 1, "count": 2}})
+    await db.docs.update_one({"id": "d1"}, {"$inc": {"histogram.8": 1, "histogram.3": -1}})
+
+    assert await stored(db) == {"id": "d1", "a": {"b": 1}, "histogram": {"8": 2, "3": -1}, "count": 2}
+
+
+@pytest.mark.anyio
+async def test_pull_removes_matching_subdocuments_and_values(db):
+    await db.docs.insert_one({"id": "d1", "items": [{"u": "a", "n": 1}, {"u": "b", "n": 2}, {"u": "a", "n": 3}], "tags": ["x", "y", "x"]})
+
+    await db.docs.update_one({"id": "d1"}, {"$pull": {"items": {"u": "a"}, "tags": "x"}})
+
+    assert await stored(db) == {"id": "d1", "items": [{"u": "b", "n": 2}], "tags": ["y"]}
+
+
+# update_many
+
+@pytest.mark.anyio
+async def test_update_many_updates_every_match(db):
+    for i, user in enumerate(["a", "b", "c"]):
+        await db.docs.insert_one({"id": f"d{i}", "userId": user, "items": []})
+
+    result = await db.docs.update_many({"userId": {"$in": ["a", "c"]}}, {"$push": {"items": 1}})
+
+    assert result.modified_count == 2
+    assert [doc["items"] for doc in await db.docs.find({}, {"_id": 0}).sort("id").to_list(length=None)] == [[1], [], [1]]
+
+
+@pytest.mark.anyio
+async def test_update_many_without_matches(db):
+    result = await db.docs.update_many({"userId": "nobody"}, {"$set": {"x": 1}})
+
+    assert result.modified_count == 0
+    assert await db.docs.count_documents({}) == 0
+
+
+# upsert / $setOnInsert
+
+@pytest.mark.anyio
+async def test_upsert_inserts_from_filter_equalities_set_on_insert_and_update(db):
+    result = await db.docs.update_one(
+        {"followerId": "a", "followingId": "b", "score.kind": "x", "note": {"$exists": False}},
+        {"$setOnInsert": {"id": "e1", "createdAt": "now"}, "$inc": {"n": 1}},
+        upsert=True
+    )
+
+    assert result.upserted_id is not None
+    assert result.modified_count == 0
+    assert await db.docs.find_one({"id": "e1"}, {"_id": 0}) == {
+        "followerId": "a", "followingId": "b", "score": {"kind": "x"}, "id": "e1", "createdAt": "now", "n": 1,
+    }
+
+
+@pytest.mark.anyio
+async def test_upsert_on_a_match_ignores_set_on_insert(db):
+    await db.docs.insert_one({"id": "e1", "followerId": "a", "createdAt": "then"})
+
+    result = await db.docs.update_one({"followerId": "a"}, {"$setOnInsert": {"createdAt": "now"}, "$set": {"seen": True}}, upsert=True)
+
+    assert result.upserted_id is None
+    assert result.modified_count == 1
+    assert await stored(db, "e1") == {"id": "e1", "followerId": "a", "createdAt": "then", "seen": True}
+
+
+@pytest.mark.anyio
+async def test_repeated_upserts_create_one_document(db):
+    for _ in range(3):
+        await db.docs.update_one({"id": "c1", "vehicleId": "v1"}, {"$setOnInsert": {"content": "hi"}}, upsert=True)
+
+    assert await db.docs.count_documents({"id": "c1"}) == 1
+
+
+# $exists
+
+@pytest.fixture
+async def exists_db(db):
+    await db.docs.insert_one({"id": "count", "likeCount": 3})
+    await db.docs.insert_one({"id": "zero", "likeCount": 0})
+    await db.docs.insert_one({"id": "null", "likeCount": None})
+    await db.docs.insert_one({"id": "absent"})
+    await db.docs.insert_one({"id": "nested", "stats": {"likeCount": 1}})
+    return db
+
+
+async def matching_ids(db, query) -> list:
+    return sorted(doc["id"] for doc in await db.docs.find(query, {"_id": 0, "id": 1}).to_list(length=None))
+
+
+@pytest.mark.anyio
+async def test_exists_true_includes_null_and_zero(exists_db):
+    assert await matching_ids(exists_db, {"likeCount": {"$exists": True}}) == ["count", "null", "zero"]
+
+
+@pytest.mark.anyio
+async def test_exists_false_only_matches_absent_fields(exists_db):
+    assert await matching_ids(exists_db, {"likeCount": {"$exists": False}}) == ["absent", "nested"]
+
+
+@pytest.mark.anyio
+async def test_exists_on_dotted_paths(exists_db):
+    assert await matching_ids(exists_db, {"stats.likeCount": {"$exists": True}}) == ["nested"]
+    assert await exists_db.docs.count_documents({"stats.likeCount": {"$exists": False}}) == 4
+
+
+@pytest.mark.anyio
+async def test_conditional_update_on_exists_applies_once(exists_db):
+    first = await exists_db.docs.update_one({"id": "absent", "likeCount": {"$exists": False}}, {"$set": {"likeCount": 5}})
+    second = await exists_db.docs.update_one({"id": "absent", "likeCount": {"$exists": False}}, {"$set": {"likeCount": 9}})
+
+    assert (first.modified_count, second.modified_count) == (1, 0)
+    assert (await stored(exists_db, "absent"))["likeCount"] == 5
@@ -0,0 +1,35 @@
+import pytest
+
+from likes import migrate_legacy_likes, toggle_like, like_count, REVIEW
+from pagination import keyset_sort
+
+
+async def helpful_order(db, vehicle_id: str):
+    reviews = await db.reviews.find({"vehicleId": vehicle_id}, {"_id": 0}).sort(keyset_sort("likeCount", -1)).to_list(length=None)
+    return [review["id"] for review in reviews]
+
+
+@pytest.mark.anyio
+async def test_startup_migration_ranks_legacy_reviews_by_their_likes(db):
+    await db.reviews.insert_one({"id": "legacy", "vehicleId": "v1", "likes": ["a", "b", "c"]})
+    await db.reviews.insert_one({"id": "new-liked", "vehicleId": "v1", "likes": [], "likeCount": 1})
+    await db.reviews.insert_one({"id": "new-unliked", "vehicleId": "v1", "likes": [], "likeCount": 0})
+
+    migrated = await migrate_legacy_likes(db)
+
+    assert migrated["reviews"] == (1, 3)
+    assert await helpful_order(db, "v1") == ["legacy", "new-liked", "new-unliked"]
+    assert await db.likes.count_documents({"targetType": REVIEW, "targetId": "legacy"}) == 3
+
+
+@pytest.mark.anyio
+async def test_migration_is_idempotent_and_keeps_later_likes(db):
+    await db.reviews.insert_one({"id": "legacy", "vehicleId": "v1", "likes": ["a", "b"]})
+    await migrate_legacy_likes(db)
+    review = await db.reviews.find_one({"id": "legacy"})
+    assert await toggle_like(db, REVIEW, review, "c") == (True, 3)
+
+    assert await migrate_legacy_likes(db) == {"reviews": (0, 0), "garage": (0, 0)}
+    review = await db.reviews.find_one({"id": "legacy"})
+    assert like_count(review) == 3
+    assert await db.likes.count_documents({"targetId": "legacy"}) == 3
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from loaders import DataLoader, RequestLoaders, load_user_names, UNKNOWN_AUTHOR
+
+
+class RecordingBatch:
+    def __init__(self, fail: bool = False):
+        self.calls = []
+        self.fail = fail
+
+    async def __call__(self, keys):
+        self.calls.append(list(keys))
+        if self.fail:
+            raise RuntimeError("db down")
+        return {key: key.upper() for key in keys if key != "missing"}
+
+
+@pytest.mark.anyio
+async def test_loads_in_the_same_tick_share_one_batch():
+    batch = RecordingBatch()
+    loader = DataLoader(batch)
+
+    values = await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("c"))
+
+    assert values == ["A", "B", "C"]
+    assert batch.calls == [["a", "b", "c"]]
+
+
+@pytest.mark.anyio
+async def test_repeated_keys_are_memoized():
+    batch = RecordingBatch()
+    loader = DataLoader(batch)
+
+    first = await asyncio.gather(loader.load("a"), loader.load("a"), loader.load("missing"))
+    second = await loader.load_many(["a", "missing", "b"])
+
+    assert first == ["A", "A", None]
+    assert second == ["A", None, "B"]
+    assert batch.calls == [["a", "missing"], ["b"]]
+
+
+@pytest.mark.anyio
+async def test_batches_are_split_at_max_batch_size():
+    batch = RecordingBatch()
+    loader = DataLoader(batch, max_batch_size=2)
+
+    await loader.load_many(["a", "b", "c", "d", "e"])
+
+    assert batch.calls == [["a", "b"], ["c", "d"], ["e"]]
+
+
+@pytest.mark.anyio
+async def test_primed_keys_skip_the_batch():
+    batch = RecordingBatch()
+    loader = DataLoader(batch)
+    loader.prime("a", "primed")
+
+    assert await loader.load_many(["a", "b"]) == ["primed", "B"]
+    assert batch.calls == [["b"]]
+
+
+@pytest.mark.anyio
+async def test_failed_batch_is_not_memoized():
+    batch = RecordingBatch(fail=True)
+    loader = DataLoader(batch)
+
+    with pytest.raises(RuntimeError):
+        await loader.load("a")
+    batch.fail = False
+
+    assert await loader.load("a") == "A"
+    assert len(batch.calls) == 2
+
+
+@pytest.fixture
+async def users_db(db):
+    for uid, name in (("u1", "Ayşe"), ("u2", "Mehmet")):
+        await db.users.insert_one({"id": uid, "name": name, "email": f"{uid}@otorite.test", "password_hash": "$2b$12$secret"})
+    return db
+
+
+@pytest.mark.anyio
+async def test_users_loader_never_returns_password_hash(users_db):
+    loaders = RequestLoaders(users_db)
+
+    users = await asyncio.gather(loaders.users.load("u1"), loaders.users.load("u2"), loaders.users.load("nobody"))
+
+    assert [user["name"] for user in users[:2]] == ["Ayşe", "Mehmet"]
+    assert users[2] is None
+    assert all("password_hash" not in user for user in users[:2])
+    assert loaders.users.batches == 1
+
+
+@pytest.mark.anyio
+async def test_user_names_use_one_query_and_a_default(users_db):
+    names = await load_user_names(users_db, ["u1", "u2", "u1", "gone"])
+
+    assert names == {"u1": "Ayşe", "u2": "Mehmet", "gone": UNKNOWN_AUTHOR}
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import encode_cursor, decode_cursor, after_query, keyset_sort, split_page, INVALID_CURSOR
+
+START = datetime(2026, 1, 1, 12, 0)
+
+# Mixed sort keys: ties, explicit nulls and missing fields
+NUMBER_KEYS = [5, None, 3, 5, None, 1, 3, "missing", 5, None, 8, "missing"]
+DATE_KEYS = [START + timedelta(hours=h) if isinstance(h, int) else h for h in NUMBER_KEYS]
+
+
+async def insert_rows(db, keys):
+    for i, key in enumerate(keys):
+        row = {"id": f"row{i:02}"}
+        if key != "missing":
+            row["sortKey"] = key
+        await db.rows.insert_one(row)
+
+
+async def page_through(db, direction, limit):
+    """Follow nextCursor from the first page to the last, as a client would"""
+    ids, after = [], None
+    for _ in range(50):
+        query = after_query({}, "sortKey", decode_cursor(after), direction)
+        docs = await db.rows.find(query, {"_id": 0}).sort(keyset_sort("sortKey", direction)).limit(limit + 1).to_list(length=limit + 1)
+        page, after = split_page(docs, limit, "sortKey")
+        ids += [doc["id"] for doc in page]
+        if after is None:
+            return ids
+    raise AssertionError("pagination did not terminate")
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("keys", [NUMBER_KEYS, DATE_KEYS], ids=["numbers", "datetimes"])
+@pytest.mark.parametrize("direction", [-1, 1], ids=["desc", "asc"])
+@pytest.mark.parametrize("limit", [1, 2, 3, 5, 20])
+async def test_keyset_pages_return_every_row_once(db, keys, direction, limit):
+    await insert_rows(db, keys)
+    expected = [doc["id"] for doc in await db.rows.find({}, {"_id": 0}).sort(keyset_sort("sortKey", direction)).to_list(length=None)]
+
+    ids = await page_through(db, direction, limit)
+
+    assert sorted(ids) == sorted(f"row{i:02}" for i in range(len(keys)))
+    assert ids == expected
+
+
+@pytest.mark.anyio
+async def test_nulls_come_last_descending_and_first_ascending(db):
+    await insert_rows(db, NUMBER_KEYS)
+    nulls = {f"row{i:02}" for i, key in enumerate(NUMBER_KEYS) if key in (None, "missing")}
+
+    descending = await page_through(db, -1, 2)
+    ascending = await page_through(db, 1, 2)
+
+    assert set(descending[-len(nulls):]) == nulls
+    assert set(ascending[:len(nulls)]) == nulls
+
+
+@pytest.mark.parametrize("values", [
+    [START, "row01"],
+    [START.replace(microsecond=123456), "row02"],
+    [None, "row03"],
+    [4.5, "row04"],
+    ["2026-01-01 12:00:00", "row05"],
+])
+def test_cursor_round_trip(values):
+    cursor = encode_cursor(values)
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == values
+
+
+def test_no_cursor_decodes_to_none():
+    assert decode_cursor(None) is None
+    assert decode_cursor("") is None
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    "bm90IGpzb24",  # "not json"
+    "eyJhIjogMX0",  # {"a": 1}, not a list
+    "W3siJGRhdGUiOiAieWVzdGVyZGF5In0sICJyb3cwMSJd",  # [{"$date": "yesterday"}, "row01"]
+])
+def test_malformed_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+
+    assert error.value.status_code == 400
+    assert error.value.detail == INVALID_CURSOR
+
+
+def test_cursor_with_wrong_arity_is_400():
+    with pytest.raises(HTTPException) as error:
+        after_query({}, "sortKey", decode_cursor(encode_cursor([1, "row01", "extra"])))
+
+    assert error.value.status_code == 400
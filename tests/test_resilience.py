@@ -0,0 +1,186 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from resilience import CircuitBreaker, AIMDLimiter, UpstreamGuard, CallTiming, UpstreamUnavailable
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def guard(clock):
+    return UpstreamGuard(
+        CircuitBreaker(failure_threshold=3, open_seconds=30, clock=clock),
+        AIMDLimiter(initial=8, max_limit=16, slow_seconds=15),
+        clock=clock,
+    )
+
+
+async def guarded(guard, clock, seconds: float = 0.1, error: BaseException = None, first_chunk_after: float = None):
+    """One call through the guard taking `seconds` on the fake clock"""
+    async with guard.call() as timing:
+        if first_chunk_after is not None:
+            clock.advance(first_chunk_after)
+            timing.first_chunk()
+            seconds -= first_chunk_after
+        clock.advance(seconds)
+        if error is not None:
+            raise error
+
+
+async def fail(guard, clock, times: int = 1):
+    for _ in range(times):
+        with pytest.raises(httpx.ConnectError):
+            await guarded(guard, clock, error=httpx.ConnectError("down"))
+
+
+def test_breaker_opens_after_threshold_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=30, clock=clock)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.trips == 1
+
+
+def test_success_resets_the_failure_streak(clock):
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=30, clock=clock)
+    for outcome in ("fail", "fail", "ok", "fail", "fail"):
+        breaker.before_call()
+        breaker.record_failure() if outcome == "fail" else breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.anyio
+async def test_open_breaker_rejects_without_calling(guard, clock):
+    await fail(guard, clock, 3)
+    clock.advance(29)
+
+    with pytest.raises(UpstreamUnavailable) as error:
+        await guarded(guard, clock)
+
+    assert error.value.status_code == 503
+    assert guard.breaker.rejected == 1
+    assert guard.limiter.in_flight == 0
+
+
+@pytest.mark.anyio
+async def test_half_open_lets_a_single_probe_through(guard, clock):
+    await fail(guard, clock, 3)
+    clock.advance(30)
+
+    async with guard.call():
+        assert guard.breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(UpstreamUnavailable):
+            async with guard.call():
+                pass
+
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+    await guarded(guard, clock)
+
+
+@pytest.mark.anyio
+async def test_failed_probe_opens_the_breaker_again(guard, clock):
+    await fail(guard, clock, 3)
+    clock.advance(30)
+
+    await fail(guard, clock)
+
+    assert guard.breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(UpstreamUnavailable):
+        await guarded(guard, clock)
+
+
+@pytest.mark.anyio
+async def test_client_errors_do_not_count_as_upstream_failures(guard, clock):
+    for _ in range(5):
+        with pytest.raises(HTTPException):
+            await guarded(guard, clock, error=HTTPException(status_code=400, detail="bad request"))
+
+    assert guard.breaker.state == CircuitBreaker.CLOSED
+    assert guard.limiter.limit == 8
+
+
+@pytest.mark.anyio
+async def test_slow_call_halves_the_limit_and_fast_calls_grow_it(guard, clock):
+    await guarded(guard, clock, seconds=16)
+    assert guard.limiter.limit == 4
+
+    for _ in range(4):
+        await guarded(guard, clock, seconds=1)
+    assert guard.limiter.limit == pytest.approx(5, abs=0.1)
+
+
+@pytest.mark.anyio
+async def test_failure_halves_the_limit_down_to_the_minimum(guard, clock):
+    await fail(guard, clock, 2)
+    assert guard.limiter.limit == 2
+
+    guard.breaker.record_success()
+    await fail(guard, clock, 2)
+    assert guard.limiter.limit == 1
+
+
+def test_limiter_rejects_past_its_limit():
+    limiter = AIMDLimiter(initial=2)
+    limiter.acquire()
+    limiter.acquire()
+
+    with pytest.raises(UpstreamUnavailable):
+        limiter.acquire()
+    assert limiter.rejected == 1
+
+
+@pytest.mark.anyio
+async def test_long_stream_is_judged_by_time_to_first_chunk(guard, clock):
+    await guarded(guard, clock, seconds=60, first_chunk_after=2)
+
+    assert guard.limiter.limit > 8
+
+
+@pytest.mark.anyio
+async def test_stream_with_a_slow_first_chunk_is_slow(guard, clock):
+    await guarded(guard, clock, seconds=60, first_chunk_after=20)
+
+    assert guard.limiter.limit == 4
+
+
+def test_call_timing_keeps_the_first_chunk(clock):
+    timing = CallTiming(clock)
+    clock.advance(3)
+    timing.first_chunk()
+    clock.advance(10)
+    timing.first_chunk()
+
+    assert timing.latency() == 3
+
+
+@pytest.mark.anyio
+async def test_cancelled_call_releases_its_slot(guard, clock):
+    with pytest.raises(asyncio.CancelledError):
+        await guarded(guard, clock, error=asyncio.CancelledError())
+
+    assert guard.limiter.in_flight == 0
+    assert guard.limiter.limit == 8
@@ -0,0 +1,47 @@
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+from PIL import Image
+
+from routes.ai_routes import read_upload_capped, prepare_image, UPLOAD_CHUNK_SIZE
+
+def png_bytes(size=(40, 30)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", size, (200, 30, 30)).save(out, format="PNG")
+    return out.getvalue()
+
+
+def upload(data: bytes, declare_size: bool = True) -> UploadFile:
+    return UploadFile(io.BytesIO(data), size=len(data) if declare_size else None, filename="car.png")
+
+
+@pytest.mark.anyio
+async def test_reads_the_whole_upload_into_one_buffer():
+    data = bytes(range(256)) * (3 * UPLOAD_CHUNK_SIZE // 256 + 7)
+
+    content = await read_upload_capped(upload(data), max_bytes=len(data))
+
+    assert isinstance(content, bytearray)
+    assert content == data
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("declare_size", [True, False], ids=["declared", "undeclared"])
+async def test_rejects_uploads_over_the_cap(declare_size):
+    data = b"x" * (2 * UPLOAD_CHUNK_SIZE + 1)
+
+    with pytest.raises(HTTPException) as error:
+        await read_upload_capped(upload(data, declare_size), max_bytes=2 * UPLOAD_CHUNK_SIZE)
+
+    assert error.value.status_code == 413
+
+
+@pytest.mark.anyio
+async def test_buffer_goes_straight_into_the_image_pipeline():
+    content = await read_upload_capped(upload(png_bytes()))
+
+    image = await prepare_image(content)
+
+    assert image.source_mime == "image/png"
+    assert (image.width, image.height) == (40, 30)